@@ -0,0 +1,94 @@
+# Рисование графиков: время одного графика каждого вида и задержка цикла
+# событий, пока рисуется пачка графиков — в пуле процессов (как в боте) и,
+# для сравнения, прямо в цикле событий.
+#
+# Запуск: python -m benchmarks.charts [--charts 40]
+import argparse
+import asyncio
+import random
+import statistics
+import sys
+import time
+
+import charts
+
+
+def samples(rng):
+    values = sorted((rng.randrange(1000, 5000000) for _ in range(8)), reverse=True)
+    series = [[rng.randrange(0, 20000000) for _ in range(12)] for _ in range(2)]
+    return values, series
+
+
+async def lag_while(render, count):
+    lags = []
+    done = False
+
+    async def ticker():
+        while not done:
+            started = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lags.append(time.perf_counter() - started - 0.01)
+
+    task = asyncio.create_task(ticker())
+    started = time.perf_counter()
+    await render(count)
+    elapsed = time.perf_counter() - started
+    done = True
+    await task
+    return elapsed, max(lags) if lags else 0.0
+
+
+async def run(count):
+    rng = random.Random(1)
+    values, series = samples(rng)
+    colors = [charts.INCOME_COLOR[1], charts.EXPENSE_COLOR[1]]
+    loop = asyncio.get_running_loop()
+
+    async def in_pool(n):
+        await asyncio.gather(*(
+            loop.run_in_executor(charts.get_pool(), charts.pie, values) if i % 2 else
+            loop.run_in_executor(charts.get_pool(), charts.bars, series, colors)
+            for i in range(n)
+        ))
+
+    async def in_loop(n):
+        for i in range(n):
+            if i % 2:
+                charts.pie(values)
+            else:
+                charts.bars(series, colors)
+            await asyncio.sleep(0)
+
+    # Запуск процессов пула не входит в замер
+    await in_pool(charts.CHART_WORKERS)
+    for name, render in (('пул процессов', in_pool), ('в цикле событий', in_loop)):
+        elapsed, lag = await lag_while(render, count)
+        print(f'{name}: {count} графиков за {elapsed:.2f} с, '
+              f'макс. задержка цикла событий {lag * 1000:.1f} мс')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--charts', type=int, default=40)
+    args = parser.parse_args()
+
+    values, series = samples(random.Random(1))
+    colors = [charts.INCOME_COLOR[1], charts.EXPENSE_COLOR[1]]
+    for name, render in (
+        ('круговая', lambda: charts.pie(values)),
+        ('столбцы по месяцам', lambda: charts.bars(series, colors)),
+    ):
+        timings = []
+        for _ in range(20):
+            started = time.perf_counter()
+            png = render()
+            timings.append(time.perf_counter() - started)
+        print(f'{name}: медиана {statistics.median(timings) * 1000:.1f} мс, PNG {len(png) / 1024:.1f} КБ')
+
+    asyncio.run(run(args.charts))
+    charts.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
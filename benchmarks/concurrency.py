@@ -0,0 +1,138 @@
+# Сколько одновременных пользователей выдерживает бот, если запросы к БД
+# выполняются прямо в корутине (sync) и через пул потоков (async).
+#
+# Запуск: python -m benchmarks.concurrency [--users 1 10 50 100] [--heavy-rows 200000]
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault(
+    'FINANCE_DB_PATH',
+    os.path.join(tempfile.mkdtemp(prefix='finance-bench-'), 'finance.db')
+)
+
+import config  # noqa: E402
+import database as db  # noqa: E402
+from formatting import to_timestamp  # noqa: E402
+
+HEAVY_USER_ID = 1
+CATEGORIES = ['Жилье', 'Еда', 'Транспорт', 'Здоровье', 'Кофе']
+
+
+def populate(users, heavy_rows):
+    db.init_db()
+    start = datetime(2020, 1, 1)
+    rows = []
+    for i in range(heavy_rows):
+        date = start + timedelta(minutes=7 * i)
+        rows.append((HEAVY_USER_ID, None, random.randint(1000, 500000),
+                     random.choice(CATEGORIES), to_timestamp(date)))
+    for user_id in range(2, users + 2):
+        for i in range(50):
+            date = start + timedelta(days=i)
+            rows.append((user_id, None, random.randint(1000, 500000),
+                         random.choice(CATEGORIES), to_timestamp(date)))
+    # Через пул: триггерам индекса поиска нужна функция search_tokens
+    with db.get_pool().writer() as conn:
+        conn.executemany(
+            'INSERT INTO expenses (user_id, username, amount, category, date) VALUES (?, ?, ?, ?, ?)',
+            rows
+        )
+
+
+def call_inline(func, *args):
+    # Так обработчики работали раньше: connect/запрос/close прямо в корутине
+    conn = sqlite3.connect(config.DB_PATH)
+    try:
+        return func(conn, *args)
+    finally:
+        conn.close()
+
+
+async def run_query(mode, func, *args):
+    if mode == 'sync':
+        return call_inline(func, *args)
+    return await db.read(func, *args)
+
+
+def full_history(conn, user_id):
+    # Выгрузка всей истории пользователя одним запросом
+    return conn.execute(
+        'SELECT amount, category, date FROM expenses WHERE user_id = ? ORDER BY date DESC',
+        (user_id,)
+    ).fetchall()
+
+
+async def heavy_user(mode, stop):
+    # Пользователь с большой историей постоянно запрашивает всю свою историю
+    while not stop.is_set():
+        await run_query(mode, full_history, HEAVY_USER_ID)
+        await asyncio.sleep(0.01)
+
+
+async def light_user(mode, user_id, requests, think_time, latencies):
+    for _ in range(requests):
+        # Задержку считаем от момента, когда сообщение «пришло», а не от начала
+        # обработки: так учитывается время, пока цикл событий был занят другими
+        arrival = time.perf_counter() + random.uniform(0, think_time)
+        await asyncio.sleep(arrival - time.perf_counter())
+        await run_query(mode, db.profile_totals, user_id)
+        latencies.append(time.perf_counter() - arrival)
+
+
+async def scenario(mode, users, requests, think_time):
+    latencies = []
+    stop = asyncio.Event()
+    heavy = asyncio.create_task(heavy_user(mode, stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        light_user(mode, user_id, requests, think_time, latencies)
+        for user_id in range(2, users + 2)
+    ))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await heavy
+    latencies.sort()
+    return {
+        'p50': statistics.median(latencies) * 1000,
+        'p95': latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        'rps': len(latencies) / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, nargs='+', default=[1, 10, 50, 100, 200])
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--think-time', type=float, default=0.05)
+    parser.add_argument('--heavy-rows', type=int, default=200000)
+    parser.add_argument('--sla-ms', type=float, default=100.0)
+    args = parser.parse_args()
+
+    print(f'БД: {config.DB_PATH}')
+    populate(max(args.users), args.heavy_rows)
+
+    served = {}
+    print(f"{'режим':>6} {'польз.':>7} {'p50, мс':>9} {'p95, мс':>9} {'запр/с':>9}")
+    for mode in ('sync', 'async'):
+        served[mode] = 0
+        for users in args.users:
+            result = asyncio.run(scenario(mode, users, args.requests, args.think_time))
+            print(f"{mode:>6} {users:>7} {result['p50']:>9.1f} {result['p95']:>9.1f} {result['rps']:>9.0f}")
+            if result['p95'] <= args.sla_ms:
+                served[mode] = users
+    db.shutdown()
+
+    print()
+    for mode, users in served.items():
+        print(f'{mode}: до {users} пользователей при p95 <= {args.sla_ms:.0f} мс')
+
+
+if __name__ == '__main__':
+    main()
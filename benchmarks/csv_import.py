@@ -0,0 +1,100 @@
+# Импорт CSV-выписки на временной БД: время импорта файла на N строк,
+# задержка цикла событий во время импорта (насколько бот «подвисает» для
+# остальных пользователей) и повторный импорт того же файла, который не
+# должен добавить ни одной записи. monthly_totals сверяется с записями.
+#
+# Запуск: python -m benchmarks.csv_import [--lines 100000] [--chunk 5000]
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault(
+    'FINANCE_DB_PATH',
+    os.path.join(tempfile.mkdtemp(prefix='finance-import-'), 'finance.db')
+)
+
+import database as db  # noqa: E402
+import importer  # noqa: E402
+
+CATEGORIES = ['Супермаркеты', 'Рестораны', 'Такси', 'Аптеки', 'ЖКХ', 'Связь', 'Переводы']
+HEADER = ('Дата операции;Дата платежа;Номер карты;Статус;Сумма операции;'
+          'Валюта операции;Категория;MCC;Описание')
+
+
+def write_statement(path, lines, seed=1):
+    rng = random.Random(seed)
+    moment = datetime(2023, 1, 1)
+    with open(path, 'w', encoding='cp1251', newline='') as f:
+        f.write('Выписка по счету 40817810000000000000\r\n')
+        f.write(HEADER + '\r\n')
+        for _ in range(lines):
+            moment += timedelta(seconds=rng.randrange(60, 1200))
+            if rng.random() < 0.1:
+                amount = f'{rng.randrange(1000, 150000)},00'
+                category = 'Пополнения'
+            else:
+                amount = f'-{rng.randrange(50, 9000)},{rng.randrange(100):02d}'
+                category = rng.choice(CATEGORIES)
+            status = 'FAILED' if rng.random() < 0.01 else 'OK'
+            f.write(
+                f"{moment:%d.%m.%Y %H:%M:%S};{moment:%d.%m.%Y};*1234;{status};{amount};"
+                f"RUB;{category};5411;Покупка\r\n"
+            )
+
+
+async def measure(path, chunk):
+    lags = []
+    done = False
+
+    async def ticker():
+        while not done:
+            started = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lags.append(time.perf_counter() - started - 0.01)
+
+    task = asyncio.create_task(ticker())
+    started = time.perf_counter()
+    result = await importer.import_statement(path, 42, '@importer', chunk)
+    elapsed = time.perf_counter() - started
+    done = True
+    await task
+    return result, elapsed, max(lags) if lags else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type=int, default=100000)
+    parser.add_argument('--chunk', type=int, default=5000)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='finance-statement-')
+    path = os.path.join(directory, 'statement.csv')
+    write_statement(path, args.lines)
+    print(f'Выписка: {args.lines} строк, {os.path.getsize(path) / 1e6:.1f} МБ')
+
+    db.init_db()
+    failed = False
+    for attempt in ('первый импорт', 'повторный импорт'):
+        result, elapsed, lag = asyncio.run(measure(path, args.chunk))
+        print(f'{attempt}: {elapsed:.2f} с, {args.lines / elapsed:,.0f} строк/с, '
+              f'макс. задержка цикла событий {lag * 1000:.1f} мс; {result}')
+        if attempt == 'повторный импорт' and (result['income'] or result['expense']):
+            print('  ОШИБКА: повторный импорт добавил записи')
+            failed = True
+
+    with db.get_pool().reader() as conn:
+        mismatches = db.check_monthly_totals(conn)
+    if mismatches:
+        print(f'  ОШИБКА: monthly_totals расходится в {len(mismatches)} строках')
+        failed = True
+    db.shutdown()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
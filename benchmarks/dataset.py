@@ -0,0 +1,173 @@
+# Генератор синтетической БД бота со схемой из миграций database.py.
+# Распределения приближены к живому использованию:
+# - активность пользователей с тяжёлым хвостом (Парето): немногие
+#   пользователи владеют большой долей записей;
+# - суммы логнормальные, доходы крупнее расходов;
+# - у части пользователей свои категории помимо стандартных;
+# - большинство долгов — между зарегистрированными пользователями,
+#   часть из них погашена;
+# - несколько процентов записей — в валютах из FOREIGN_RATES.
+#
+# Запуск: python -m benchmarks.dataset --rows 1000000 --path /tmp/finance-1m.db
+import argparse
+import calendar
+import math
+import os
+import random
+import time
+from datetime import datetime
+
+import database as db
+
+INCOME_CATEGORIES = ['Зарплата', 'Подарок', 'Перевод', 'Другое']
+EXPENSE_CATEGORIES = ['Жилье', 'Еда', 'Транспорт', 'Здоровье', 'Другое']
+CUSTOM_CATEGORIES = [
+    'Кафе', 'Подписки', 'Такси', 'Спорт', 'Кино', 'Книги', 'Питомцы',
+    'Ремонт', 'Путешествия', 'Подработка', 'Кешбэк', 'Дивиденды',
+]
+NAMES = ['Вася', 'Петя', 'Маша', 'Оля', 'Коля', 'Саша', 'Дима', 'Лена']
+
+# Доли видов записей
+KIND_WEIGHTS = {'expense': 0.60, 'income': 0.25, 'debt': 0.15}
+# Курсы валют (рублей за единицу) и доля записей не в рублях
+FOREIGN_RATES = {'USD': 92.5, 'EUR': 100.2}
+FOREIGN_SHARE = 0.05
+CHUNK = 100000
+YEARS = 3
+
+
+def user_weights(rng, users):
+    # Парето с alpha=1.2: у 1% самых активных — около трети записей
+    return [rng.paretovariate(1.2) for _ in range(users)]
+
+
+def kopecks(rng, median_rub, sigma):
+    return max(100, int(rng.lognormvariate(math.log(median_rub * 100), sigma)))
+
+
+def generate_users(rng, users, now):
+    rows = []
+    for user_id in range(1, users + 1):
+        registered = now - rng.randrange(YEARS * 365 * 86400)
+        # Примерно у каждого пятого нет юзернейма
+        username = f'@user{user_id}' if rng.random() < 0.8 else None
+        rows.append((
+            user_id, username, f'Имя{user_id}', None,
+            datetime.fromtimestamp(registered).isoformat(),
+            datetime.fromtimestamp(now).isoformat(),
+        ))
+    return rows
+
+
+def generate_records(rng, count, user_ids, cum_weights, usernames, named_users, now):
+    # Строки в порядке столбцов INSERT_SQL: (вид, кортеж)
+    start = now - YEARS * 365 * 86400
+    kinds = rng.choices(list(KIND_WEIGHTS), list(KIND_WEIGHTS.values()), k=count)
+    owners = rng.choices(user_ids, cum_weights=cum_weights, k=count)
+    by_kind = {'income': [], 'expense': [], 'debt': []}
+    for kind, user_id in zip(kinds, owners):
+        date = rng.randrange(start, now)
+        username = usernames[user_id]
+        currency = rng.choice(list(FOREIGN_RATES)) if rng.random() < FOREIGN_SHARE else 'RUB'
+        if kind == 'debt':
+            amount = kopecks(rng, 1500, 1.0)
+            if rng.random() < 0.7:
+                to_user_id = rng.choice(named_users)
+                row = (user_id, username, to_user_id, usernames[to_user_id],
+                       amount, rng.choice(['обед', 'такси', 'билеты', 'в долг']), date, currency)
+            else:
+                row = (user_id, username, None, rng.choice(NAMES),
+                       amount, 'наличными', date, currency)
+        else:
+            categories = INCOME_CATEGORIES if kind == 'income' else EXPENSE_CATEGORIES
+            if user_id % 10 == 0 and rng.random() < 0.5:
+                # Пользователи со своими категориями («Другое» -> своё название)
+                custom = (user_id + rng.randrange(3)) % len(CUSTOM_CATEGORIES)
+                category = CUSTOM_CATEGORIES[custom]
+            else:
+                category = rng.choice(categories[:-1])
+            median = 30000 if kind == 'income' else 700
+            row = (user_id, username, kopecks(rng, median, 1.1), category, date, currency)
+        by_kind[kind].append(row)
+    return by_kind
+
+
+def generate(path, rows, users=None, seed=1):
+    # Создаёт БД path с rows записями и возвращает сводку
+    users = users or max(100, rows // 100)
+    rng = random.Random(seed)
+    now = calendar.timegm(datetime.now().timetuple())
+
+    pool = db.ConnectionPool(path, readers=1)
+    db.init_db(pool)
+    started = time.perf_counter()
+    with pool.writer() as conn:
+        # Индексы и индекс поиска строятся один раз после вставки, а не на
+        # каждую строку: триггеры поиска на время вставки снимаются
+        indexes = conn.execute(
+            '''SELECT type, name, sql FROM sqlite_master WHERE type IN ('index', 'trigger')
+            AND tbl_name IN ('incomes', 'expenses', 'debts') AND sql IS NOT NULL'''
+        ).fetchall()
+        for kind, name, _ in indexes:
+            conn.execute(f'DROP {kind.upper()} {name}')
+
+        user_rows = generate_users(rng, users, now)
+        conn.executemany(
+            '''INSERT INTO users
+            (user_id, username, first_name, last_name, registration_date, last_activity)
+            VALUES (?, ?, ?, ?, ?, ?)''',
+            user_rows
+        )
+        user_ids = [row[0] for row in user_rows]
+        usernames = {row[0]: row[1] for row in user_rows}
+        named_users = [row[0] for row in user_rows if row[1]]
+        weights = user_weights(rng, users)
+        cum_weights, total = [], 0
+        for weight in weights:
+            total += weight
+            cum_weights.append(total)
+
+        for offset in range(0, rows, CHUNK):
+            by_kind = generate_records(
+                rng, min(CHUNK, rows - offset), user_ids, cum_weights,
+                usernames, named_users, now
+            )
+            for kind, kind_rows in by_kind.items():
+                conn.executemany(db.INSERT_SQL[kind], kind_rows)
+        db.load_rates(conn, FOREIGN_RATES)
+
+        # Погашено около 40% долгов
+        conn.execute('UPDATE debts SET is_paid = 1 WHERE id % 5 < 2')
+        for _, _, sql in indexes:
+            conn.execute(sql)
+        db.rebuild_monthly_totals(conn)
+        db.rebuild_search(conn)
+    with pool.writer() as conn:
+        conn.execute('ANALYZE')
+    pool.close()
+
+    return {
+        'path': path,
+        'rows': rows,
+        'users': users,
+        'seconds': round(time.perf_counter() - started, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Синтетическая БД для нагрузочных замеров')
+    parser.add_argument('--rows', type=int, default=1000000, help='записей всего')
+    parser.add_argument('--users', type=int, help='пользователей (по умолчанию rows/100)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--path', required=True, help='файл создаваемой БД')
+    args = parser.parse_args()
+
+    if os.path.exists(args.path):
+        parser.error(f'{args.path} уже существует')
+    summary = generate(args.path, args.rows, args.users, args.seed)
+    print(f"{summary['rows']} записей, {summary['users']} пользователей "
+          f"за {summary['seconds']} с -> {summary['path']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+# Запросы бота на синтетических БД разного размера (benchmarks/dataset.py):
+# каждое SQL-выражение обработчиков — чтения для самого активного и для
+# «медианного» пользователя, записи в откатываемой транзакции — с временем
+# выполнения и планом запроса. Сгенерированные БД сохраняются в --data-dir
+# и переиспользуются следующими запусками.
+#
+# Запуск: python -m benchmarks.db_scale [--scales 10000,1000000,10000000]
+#         [--data-dir /tmp/finance-scale] [--json scale.json]
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+from datetime import datetime
+
+import database as db
+from benchmarks.dataset import generate
+from benchmarks.query_plans import full_scans, hot_queries
+from formatting import now_timestamp, year_month
+
+# «--» — выражения внутри триггеров и FTS5, их план входит в план внешнего
+SKIP_PLAN = ('BEGIN', 'COMMIT', 'ROLLBACK', '--')
+
+
+def pick_users(conn):
+    # Самый активный и медианный по числу записей пользователи
+    counts = conn.execute(
+        '''SELECT user_id, SUM(count) FROM monthly_totals
+        GROUP BY user_id ORDER BY SUM(count) DESC'''
+    ).fetchall()
+    return counts[0][0], counts[len(counts) // 2][0]
+
+
+def user_queries(conn, user_id):
+    username = conn.execute(
+        'SELECT username FROM users WHERE user_id = ?', (user_id,)
+    ).fetchone()[0] or '@nobody'
+    other = conn.execute(
+        '''SELECT to_user_id FROM debts
+        WHERE from_user_id = ? AND to_user_id IS NOT NULL LIMIT 1''',
+        (user_id,)
+    ).fetchone()
+    page_key = conn.execute(
+        '''SELECT date, id FROM expenses WHERE user_id = ?
+        ORDER BY date DESC, id DESC LIMIT 1 OFFSET 20''',
+        (user_id,)
+    ).fetchone() or (now_timestamp(), 0)
+    year, month = year_month(now_timestamp())
+    return hot_queries(user_id, other[0] if other else 0, username, year, month, tuple(page_key))
+
+
+def write_queries(conn, user_id):
+    username = conn.execute(
+        'SELECT username FROM users WHERE user_id = ?', (user_id,)
+    ).fetchone()[0]
+    record_id = conn.execute(
+        'SELECT id FROM expenses WHERE user_id = ? ORDER BY date DESC LIMIT 1',
+        (user_id,)
+    ).fetchone()[0]
+    now = now_timestamp()
+    return [
+        ('register_user: upsert', db.upsert_user,
+         (user_id, username, 'Имя', None, datetime.now().isoformat())),
+        ('save_income', db.add_income, (user_id, username, 5000000, 'Зарплата', now)),
+        ('save_expense', db.add_expense, (user_id, username, 50000, 'Еда', now)),
+        ('save_debt', db.add_debt, (user_id, username, None, 'Вася', 10000, 'обед', now)),
+        ('delete_expense_record', db.delete_record, ('expense', record_id, user_id)),
+        ('persistence: save_state', db.save_state,
+         ([], [(user_id, 'stats_type', '"Расходы"')], [('main', f'[{user_id},{user_id}]', '13')])),
+    ]
+
+
+def measure(conn, func, args, repeat, write):
+    timings, statements = [], []
+    for i in range(repeat):
+        if i == 0:
+            conn.set_trace_callback(statements.append)
+        conn.execute('BEGIN IMMEDIATE' if write else 'BEGIN')
+        started = time.perf_counter()
+        func(conn, *args)
+        timings.append(time.perf_counter() - started)
+        conn.execute('ROLLBACK' if write else 'COMMIT')
+        conn.set_trace_callback(None)
+
+    plans = []
+    for sql in statements:
+        if sql.lstrip().upper().startswith(SKIP_PLAN):
+            continue
+        plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql)]
+        plans.append(plan)
+    return {
+        'p50_ms': round(statistics.median(timings) * 1000, 3),
+        'max_ms': round(max(timings) * 1000, 3),
+        'statements': len(plans),
+        'plans': plans,
+    }
+
+
+def run_scale(path, repeat):
+    pool = db.ConnectionPool(path, readers=1)
+    conn = pool.connect()
+    heavy, median = pick_users(conn)
+    records = conn.execute('SELECT SUM(count) FROM monthly_totals').fetchone()[0]
+    heavy_records = conn.execute(
+        'SELECT SUM(count) FROM monthly_totals WHERE user_id = ?', (heavy,)
+    ).fetchone()[0]
+
+    results = {'records_in_totals': records, 'heavy_user_records': heavy_records, 'queries': []}
+    heavy_queries = user_queries(conn, heavy)
+    median_queries = user_queries(conn, median)
+    for (name, func, args), (_, _, median_args) in zip(heavy_queries, median_queries):
+        heavy_result = measure(conn, func, args, repeat, write=False)
+        median_result = measure(conn, func, median_args, repeat, write=False)
+        results['queries'].append({
+            'name': name, 'heavy': heavy_result, 'median_user': median_result,
+        })
+    for name, func, args in write_queries(conn, heavy):
+        results['queries'].append({
+            'name': name, 'heavy': measure(conn, func, args, repeat, write=True),
+        })
+    conn.close()
+    pool.close()
+    return results
+
+
+def print_scale(rows, results, show_plans):
+    print(f"\n=== {rows} записей (у самого активного пользователя "
+          f"{results['heavy_user_records']}) ===")
+    print(f"{'запрос':<44}{'активный p50':>14}{'max':>9}{'медианный p50':>15}")
+    for query in results['queries']:
+        heavy = query['heavy']
+        median = query.get('median_user')
+        median_text = f"{median['p50_ms']:>15.3f}" if median else f"{'-':>15}"
+        scans = [scan for plan in heavy['plans'] for scan in full_scans([(0, 0, 0, d) for d in plan])]
+        flag = '  SCAN!' if scans else ''
+        print(f"{query['name']:<44}{heavy['p50_ms']:>14.3f}{heavy['max_ms']:>9.3f}"
+              f"{median_text}{flag}")
+        if show_plans:
+            for plan in heavy['plans']:
+                for detail in plan:
+                    print(f"{'':<6}{detail}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scales', default='10000,1000000,10000000',
+                        help='размеры БД в записях через запятую')
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'finance-scale'))
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--no-plans', action='store_true', help='не печатать планы запросов')
+    parser.add_argument('--json', help='записать результаты в JSON')
+    args = parser.parse_args()
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    report = {}
+    for rows in (int(value) for value in args.scales.split(',')):
+        path = os.path.join(args.data_dir, f'finance-{rows}.db')
+        if not os.path.exists(path):
+            print(f'Генерация {rows} записей -> {path}')
+            summary = generate(path, rows)
+            print(f"  готово за {summary['seconds']} с")
+        results = run_scale(path, args.repeat)
+        print_scale(rows, results, not args.no_plans)
+        report[rows] = results
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+# Выгрузка /export на временной БД: пользователь с N записями выгружается
+# в CSV и XLSX; замеряются время и пик памяти Python (tracemalloc) — он не
+# должен расти вместе с историей. XLSX проверяется разбором листа, CSV —
+# повторным импортом через importer другому пользователю.
+#
+# Запуск: python -m benchmarks.export [--rows 100000,1000000]
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from xml.etree import ElementTree
+
+os.environ.setdefault(
+    'FINANCE_DB_PATH',
+    os.path.join(tempfile.mkdtemp(prefix='finance-export-'), 'finance.db')
+)
+
+import database as db  # noqa: E402
+import exporter  # noqa: E402
+import importer  # noqa: E402
+from formatting import now_timestamp  # noqa: E402
+
+SHEET_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+
+def fill(pool, user_id, rows, seed=1):
+    rng = random.Random(seed)
+    now = now_timestamp()
+    left = rows
+    while left:
+        chunk = min(left, 100000)
+        left -= chunk
+        by_kind = {'income': [], 'expense': [], 'debt': []}
+        for _ in range(chunk):
+            kind = rng.choices(['income', 'expense', 'debt'], [2, 7, 1])[0]
+            date = now - rng.randrange(5 * 365 * 86400)
+            amount = rng.randrange(100, 5000000)
+            if kind == 'debt':
+                by_kind[kind].append((user_id, '@owner', None, 'Вася', amount,
+                                      'обед & "такси" <тест>', date, 'RUB'))
+            else:
+                by_kind[kind].append((user_id, '@owner', amount, rng.choice(['Еда', 'Кафе']), date,
+                                      'RUB'))
+        with pool.writer() as conn:
+            for kind, kind_rows in by_kind.items():
+                db.insert_records(conn, kind, kind_rows)
+
+
+def xlsx_rows(path):
+    with zipfile.ZipFile(path) as archive, archive.open('xl/worksheets/sheet1.xml') as sheet:
+        count = 0
+        for _, element in ElementTree.iterparse(sheet):
+            if element.tag == SHEET_NS + 'row':
+                count += 1
+                element.clear()
+    return count - 1
+
+
+def run(pool, user_id, file_format, path):
+    # tracemalloc замедляет выгрузку в несколько раз, поэтому время и пик
+    # памяти меряются отдельными проходами
+    # Соединение вне пула, без транзакции, как у db.read_detached в боте
+    conn = pool.connect()
+    started = time.perf_counter()
+    count = exporter.export_ledger(conn, user_id, file_format, path)
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    exporter.export_ledger(conn, user_id, file_format, path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    conn.close()
+    return count, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', default='100000,1000000')
+    args = parser.parse_args()
+
+    db.init_db()
+    pool = db.get_pool()
+    directory = tempfile.mkdtemp(prefix='finance-export-files-')
+    failed = False
+    for user_id, rows in enumerate((int(value) for value in args.rows.split(',')), 1):
+        fill(pool, user_id, rows)
+        print(f'\n{rows} записей')
+        for file_format in exporter.FORMATS:
+            path = os.path.join(directory, f'finance-{user_id}.{file_format}')
+            count, elapsed, peak = run(pool, user_id, file_format, path)
+            print(f'  {file_format}: {elapsed:.2f} с, {count / elapsed:,.0f} записей/с, '
+                  f'пик памяти Python {peak / 1024:.0f} КБ, файл {os.path.getsize(path) / 1e6:.1f} МБ')
+            if count != rows:
+                print(f'  ОШИБКА: выгружено {count} из {rows}')
+                failed = True
+            if file_format == 'xlsx' and xlsx_rows(path) != rows:
+                print('  ОШИБКА: число строк листа XLSX не совпадает')
+                failed = True
+
+        # CSV выгрузки читается импортом выписок (долги импорт пропускает)
+        with pool.reader() as conn:
+            records = conn.execute(
+                '''SELECT (SELECT COUNT(*) FROM incomes WHERE user_id = ?)
+                + (SELECT COUNT(*) FROM expenses WHERE user_id = ?)''',
+                (user_id, user_id)
+            ).fetchone()[0]
+        result = asyncio.run(importer.import_statement(
+            os.path.join(directory, f'finance-{user_id}.csv'), user_id + 1000, None
+        ))
+        print(f"  импорт CSV выгрузки: доходов {result['income']}, "
+              f"расходов {result['expense']} из {records}")
+        if result['income'] + result['expense'] != records:
+            print('  ОШИБКА: импорт выгрузки потерял записи')
+            failed = True
+    db.shutdown()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
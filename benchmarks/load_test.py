@@ -0,0 +1,470 @@
+# Нагрузочный прогон без Telegram: приложение из finance_bot.build_application
+# (тот же ConversationHandler, что в боте) с подменённым транспортом Bot API,
+# который запоминает исходящие сообщения и клавиатуры. Тысячи сценарных
+# пользователей проходят ввод доходов, расходов и долгов, просмотр
+# статистики и итогов, удаление записей; следующий шаг выбирается по
+# клавиатуре из последнего ответа бота.
+# Итог — задержки p50/p95/p99 по обработчикам и обновлениям в целом,
+# пропускная способность; результаты пишутся в JSON для сравнения коммитов.
+#
+# Запуск: python -m benchmarks.load_test [--users 1000] [--flows 5]
+#         [--output load.json] [--compare previous.json]
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+
+os.environ.setdefault(
+    'FINANCE_DB_PATH',
+    os.path.join(tempfile.mkdtemp(prefix='finance-load-'), 'finance.db')
+)
+# Курсы из примера в репозитории: сценарии вводят суммы в разных валютах
+os.environ.setdefault(
+    'RATES_PATH',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'rates.example.csv')
+)
+
+from telegram import Update  # noqa: E402
+from telegram.ext import ConversationHandler, TypeHandler  # noqa: E402
+from telegram.request import BaseRequest  # noqa: E402
+
+import database as db  # noqa: E402
+import finance_bot as fb  # noqa: E402
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Load', 'username': 'load_bot'}
+
+
+class RecordingRequest(BaseRequest):
+    # Транспорт Bot API в памяти: ответы бота не уходят в сеть, а
+    # запоминаются последние обычная и inline-клавиатуры каждого чата
+
+    def __init__(self):
+        self.keyboards = {}
+        self.inline = {}
+        self.calls = defaultdict(int)
+        self._message_ids = itertools.count(1)
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls[endpoint] += 1
+        if endpoint == 'getMe':
+            result = BOT_USER
+        elif endpoint in ('sendMessage', 'editMessageText', 'sendPhoto'):
+            result = self._message(endpoint, params)
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+    def _message(self, endpoint, params):
+        chat_id = params['chat_id']
+        markup = params.get('reply_markup') or {}
+        if 'keyboard' in markup:
+            self.keyboards[chat_id] = [
+                button['text'] for row in markup['keyboard'] for button in row
+            ]
+        elif markup.get('remove_keyboard'):
+            self.keyboards[chat_id] = []
+        # Сообщение с обычной клавиатурой часто идёт следом за сообщением с
+        # inline-кнопками и не должно их затирать
+        if 'inline_keyboard' in markup or 'keyboard' not in markup:
+            self.inline[chat_id] = [
+                button['callback_data']
+                for row in markup.get('inline_keyboard', []) for button in row
+            ]
+        if endpoint == 'editMessageText':
+            return True
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+        }
+        if endpoint == 'sendPhoto':
+            message['photo'] = [{'file_id': f'photo{message["message_id"]}',
+                                 'file_unique_id': str(message['message_id']),
+                                 'width': 1, 'height': 1}]
+            message['caption'] = params.get('caption')
+        else:
+            message['text'] = params['text']
+        return message
+
+
+class Harness:
+
+    def __init__(self, application, api):
+        self.application = application
+        self.api = api
+        self.update_ids = itertools.count(1)
+        self.pending = {}
+        self.latencies = []
+        self.handler_latencies = defaultdict(list)
+        self.errors = 0
+
+        self._instrument()
+        # Группа 1 выполняется после всех обработчиков группы 0
+        application.add_handler(TypeHandler(Update, self._processed), group=1)
+        application.add_error_handler(self._error)
+
+    def _instrument(self):
+        for handlers in list(self.application.handlers.values()):
+            for handler in handlers:
+                if isinstance(handler, ConversationHandler):
+                    inner = list(handler.entry_points) + list(handler.fallbacks)
+                    for state_handlers in handler.states.values():
+                        inner.extend(state_handlers)
+                else:
+                    inner = [handler]
+                for item in inner:
+                    item.callback = self._timed(item.callback)
+
+    def _timed(self, callback):
+        latencies = self.handler_latencies[callback.__name__]
+
+        async def wrapper(update, context):
+            started = time.perf_counter()
+            try:
+                return await callback(update, context)
+            finally:
+                latencies.append(time.perf_counter() - started)
+        return wrapper
+
+    async def _processed(self, update, context):
+        future = self.pending.pop(update.update_id, None)
+        if future is not None:
+            future.set_result(None)
+
+    async def _error(self, update, context):
+        self.errors += 1
+
+    async def send(self, data):
+        update_id = next(self.update_ids)
+        data['update_id'] = update_id
+        future = asyncio.get_running_loop().create_future()
+        self.pending[update_id] = future
+        started = time.perf_counter()
+        await self.application.update_queue.put(Update.de_json(data, self.application.bot))
+        await future
+        self.latencies.append(time.perf_counter() - started)
+
+
+class Session:
+    # Сценарный пользователь: пишет следующее сообщение после ответа бота
+
+    def __init__(self, harness, user_id, rng):
+        self.harness = harness
+        self.user_id = user_id
+        self.rng = rng
+        self.user = {
+            'id': user_id, 'is_bot': False,
+            'first_name': f'Тест{user_id}', 'username': f'user{user_id}',
+        }
+        self.chat = {'id': user_id, 'type': 'private'}
+
+    @property
+    def keyboard(self):
+        return self.harness.api.keyboards.get(self.user_id, [])
+
+    @property
+    def inline(self):
+        return self.harness.api.inline.get(self.user_id, [])
+
+    async def say(self, text):
+        message = {
+            'message_id': 1, 'date': int(time.time()),
+            'chat': self.chat, 'from': self.user, 'text': text,
+        }
+        if text.startswith('/'):
+            command = text.split()[0]
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+        await self.harness.send({'message': message})
+
+    async def click(self, data):
+        await self.harness.send({'callback_query': {
+            'id': str(self.user_id), 'from': self.user, 'chat_instance': 'load',
+            'data': data,
+            'message': {'message_id': 1, 'date': int(time.time()), 'chat': self.chat},
+        }})
+
+    def period(self):
+        return self.rng.choice([
+            'За все время', fb.RUSSIAN_MONTHS[datetime.now().month - 1],
+            *fb.PERIOD_WINDOWS, f'{datetime.now().year} год',
+        ])
+
+    def amount(self):
+        return f"{self.rng.randint(1, 50000)},{self.rng.randint(0, 99):02d}"
+
+
+async def flow_income(session):
+    await session.say('Доходы')
+    await session.say(session.amount())
+    await session.say(session.rng.choice(fb.INCOME_CATEGORIES[:-1]))
+
+
+async def flow_expense(session):
+    await session.say('Расходы')
+    await session.say(session.amount())
+    await session.say(session.rng.choice(fb.EXPENSE_CATEGORIES[:-1]))
+
+
+async def flow_debt(session, users):
+    await session.say('Долги')
+    await session.say(session.amount())
+    if session.rng.random() < 0.5:
+        await session.say(f'@user{session.rng.randrange(users)}')
+    else:
+        await session.say('Вася')
+    await session.say('обед')
+
+
+async def flow_stats(session):
+    await session.say('Статистика')
+    await session.say(session.rng.choice(list(fb.STATS_KINDS)))
+    await session.say(session.period())
+    for data in session.inline:
+        if ':next:' in data:
+            await session.click(data)
+            break
+    await open_chart(session)
+    await session.say('Назад')
+
+
+async def open_chart(session):
+    # Кнопка графика есть под итогами и под страницей статистики
+    if session.rng.random() < 0.3:
+        for data in session.inline:
+            if data.startswith('chart:'):
+                await session.click(data)
+                break
+
+
+async def flow_finances(session):
+    await session.say('Финансы')
+    await session.say(session.period())
+    await open_chart(session)
+
+
+async def flow_delete(session):
+    await session.say('Удалить')
+    await session.say(session.rng.choice(['Доходы', 'Расходы', 'Долги']))
+    choices = [text for text in session.keyboard if text.startswith('Удалить ')]
+    if choices:
+        await session.say(choices[0])
+    await session.say('Назад')
+
+
+async def flow_profile(session):
+    await session.say('Мой профиль')
+    await session.say('Мои данные')
+    await session.say('Назад')
+
+
+async def flow_settle(session):
+    await session.say('/settle')
+    if 'settle:offer' in session.inline:
+        await session.click('settle:offer')
+    # Предложение приходит и самому пользователю, если ему должны
+    for data in session.inline:
+        if data.startswith('settle:ok:'):
+            await session.click(data)
+            break
+
+
+async def flow_analytics(session):
+    await session.say('/analytics')
+
+
+async def flow_recurring(session):
+    if session.rng.random() < 0.5:
+        await session.say(f'/recurring расход {session.amount()} Подписки ежемесячно '
+                          f'{session.rng.randint(1, 31)}')
+    await session.say('/recurring')
+
+
+async def flow_budget(session):
+    if session.rng.random() < 0.5:
+        await session.say(f'/budget {session.rng.choice(fb.EXPENSE_CATEGORIES[:-1])} {session.amount()}')
+    await session.say('/budget')
+
+
+async def flow_currency(session):
+    # Смена валюты отчетов, расход в другой валюте и итоги в новой валюте
+    await session.say(f"/currency {session.rng.choice(['RUB', 'USD', 'EUR'])}")
+    await session.say('Расходы')
+    await session.say(f"{session.amount()} {session.rng.choice(['USD', '€', 'руб'])}")
+    await session.say(session.rng.choice(fb.EXPENSE_CATEGORIES[:-1]))
+    await flow_finances(session)
+
+
+async def flow_search(session):
+    # Поиск по категории или описанию долга, иногда за период, и следующая страница
+    words = session.rng.choice(['еда', 'такс', 'обед', 'зарплата', 'user'])
+    if session.rng.random() < 0.5:
+        words += ' ' + session.rng.choice([*fb.PERIOD_WINDOWS, str(datetime.now().year)])
+    await session.say(f'/search {words}')
+    for data in session.inline:
+        if data.startswith('search:'):
+            await session.click(data)
+            break
+
+
+FLOWS = {
+    'income': (flow_income, 3),
+    'expense': (flow_expense, 4),
+    'debt': (flow_debt, 1),
+    'stats': (flow_stats, 2),
+    'finances': (flow_finances, 2),
+    'delete': (flow_delete, 1),
+    'profile': (flow_profile, 1),
+    'settle': (flow_settle, 1),
+    'analytics': (flow_analytics, 1),
+    'budget': (flow_budget, 1),
+    'recurring': (flow_recurring, 1),
+    'currency': (flow_currency, 1),
+    'search': (flow_search, 1),
+}
+
+
+async def run_session(harness, user_id, args):
+    rng = random.Random(args.seed * 1000003 + user_id)
+    session = Session(harness, user_id, rng)
+    names = list(FLOWS)
+    weights = [FLOWS[name][1] for name in names]
+    await session.say('/start')
+    for _ in range(args.flows):
+        if args.think:
+            await asyncio.sleep(rng.uniform(0, 2 * args.think / 1000))
+        name = rng.choices(names, weights)[0]
+        flow = FLOWS[name][0]
+        if name == 'debt':
+            await flow(session, args.users)
+        else:
+            await flow(session)
+
+
+def percentiles(values):
+    if not values:
+        return {'count': 0}
+    ordered = sorted(values)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 3)
+
+    return {
+        'count': len(values),
+        'p50_ms': pick(0.50),
+        'p95_ms': pick(0.95),
+        'p99_ms': pick(0.99),
+        'mean_ms': round(statistics.fmean(values) * 1000, 3),
+    }
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(fb.__file__)),
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args):
+    api = RecordingRequest()
+    application = fb.build_application('1:load', request=api, mode='webhook')
+    harness = Harness(application, api)
+
+    async with application:
+        # post_init (on_startup) вызывается только в run_polling/run_webhook
+        await fb.load_rates()
+        await application.start()
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            run_session(harness, user_id, args) for user_id in range(1, args.users + 1)
+        ))
+        elapsed = time.perf_counter() - started
+        await application.stop()
+    await db.close_batcher()
+
+    return {
+        'commit': current_commit(),
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'params': {'users': args.users, 'flows': args.flows,
+                   'think_ms': args.think, 'seed': args.seed},
+        'updates': len(harness.latencies),
+        'elapsed_s': round(elapsed, 3),
+        'throughput_ups': round(len(harness.latencies) / elapsed, 1),
+        'errors': harness.errors,
+        'api_calls': dict(api.calls),
+        'latency': percentiles(harness.latencies),
+        'handlers': {
+            name: percentiles(values)
+            for name, values in sorted(harness.handler_latencies.items())
+        },
+    }
+
+
+def print_report(result, previous=None):
+    print(f"{result['updates']} обновлений за {result['elapsed_s']} с: "
+          f"{result['throughput_ups']} обновлений/с, ошибок {result['errors']}")
+    latency = result['latency']
+    print(f"Обновление целиком: p50 {latency['p50_ms']} мс, p95 {latency['p95_ms']} мс, "
+          f"p99 {latency['p99_ms']} мс")
+    print(f"\n{'обработчик':<26}{'вызовов':>9}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for name, stats in result['handlers'].items():
+        if stats['count']:
+            print(f"{name:<26}{stats['count']:>9}{stats['p50_ms']:>9.2f}"
+                  f"{stats['p95_ms']:>9.2f}{stats['p99_ms']:>9.2f}")
+    if previous:
+        print(f"\nПо сравнению с {previous.get('commit')}: пропускная способность "
+              f"{previous['throughput_ups']} -> {result['throughput_ups']} обновлений/с, "
+              f"p95 {previous['latency']['p95_ms']} -> {latency['p95_ms']} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--flows', type=int, default=5, help='сценариев на пользователя')
+    parser.add_argument('--think', type=float, default=0,
+                        help='средняя пауза пользователя между сценариями, мс')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default='load_test.json', help='куда записать JSON')
+    parser.add_argument('--compare', help='JSON прошлого прогона для сравнения')
+    args = parser.parse_args()
+
+    db.init_db()
+    result = asyncio.run(run(args))
+    db.shutdown()
+
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            previous = json.load(f)
+    print_report(result, previous)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f'\nРезультаты: {args.output}')
+
+
+if __name__ == '__main__':
+    main()
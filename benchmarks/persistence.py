@@ -0,0 +1,96 @@
+# Сохранение состояний диалогов: PicklePersistence (весь файл заново при
+# каждом изменении) против SQLitePersistence (только изменившиеся ключи,
+# одна транзакция на прогон) и время загрузки при старте.
+#
+# Запуск: python -m benchmarks.persistence [--users 5000] [--touched 100]
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+os.environ.setdefault(
+    'FINANCE_DB_PATH',
+    os.path.join(tempfile.mkdtemp(prefix='finance-persistence-'), 'finance.db')
+)
+
+from telegram.ext import PersistenceInput, PicklePersistence  # noqa: E402
+
+import database as db  # noqa: E402
+from persistence import SQLitePersistence  # noqa: E402
+
+
+def user_data(user_id, step):
+    return {
+        'debt_amount': 10000 + user_id,
+        'debt_person': f'Пользователь {user_id}',
+        'stats_type': 'Расходы',
+        'step': step,
+    }
+
+
+async def update_run(persistence, users, touched, step):
+    # Как Application.update_persistence: затронутые пользователи и диалоги
+    # передаются одновременно
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        coro
+        for user_id in range(touched)
+        for coro in (
+            persistence.update_user_data(user_id, user_data(user_id, step)),
+            persistence.update_conversation('main', (user_id, user_id), step % 20),
+        )
+    ))
+    await persistence.flush()
+    return time.perf_counter() - started
+
+
+async def measure(make, users, touched, runs):
+    # Начальное заполнение одной записью, замеряются только прогоны после него
+    filler = make(on_flush=True)
+    await filler.get_user_data()
+    await filler.get_conversations('main')
+    await update_run(filler, users, users, 0)
+
+    persistence = make()
+    await persistence.get_user_data()
+    await persistence.get_conversations('main')
+    times = [await update_run(persistence, users, touched, step) for step in range(1, runs + 1)]
+
+    started = time.perf_counter()
+    restarted = make()
+    loaded = await restarted.get_user_data()
+    await restarted.get_conversations('main')
+    load_time = time.perf_counter() - started
+    assert len(loaded) == users
+    return sum(times) / len(times), load_time
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=5000,
+                        help='пользователей с сохранённым состоянием')
+    parser.add_argument('--touched', type=int, default=100,
+                        help='пользователей, изменившихся за прогон')
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    db.init_db()
+    pickle_path = os.path.join(os.path.dirname(os.environ['FINANCE_DB_PATH']), 'state.pickle')
+    variants = {
+        'pickle': lambda on_flush=False: PicklePersistence(
+            pickle_path,
+            store_data=PersistenceInput(bot_data=False, chat_data=False, callback_data=False),
+            on_flush=on_flush
+        ),
+        'sqlite': lambda on_flush=False: SQLitePersistence(),
+    }
+    print(f'{args.users} пользователей, изменились {args.touched} за прогон')
+    for name, make in variants.items():
+        run_time, load_time = asyncio.run(measure(make, args.users, args.touched, args.runs))
+        print(f'{name:>8}: прогон {run_time * 1000:8.1f} мс, загрузка {load_time * 1000:7.1f} мс')
+    db.shutdown()
+
+
+if __name__ == '__main__':
+    main()
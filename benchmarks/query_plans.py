@@ -0,0 +1,124 @@
+# Проверка планов запросов: каждый запрос горячих обработчиков должен
+# идти по индексу, а не полным просмотром таблицы. Выражения перехватываются
+# через trace callback, поэтому проверяется ровно тот SQL, который выполняет бот.
+#
+# Запуск: python -m benchmarks.query_plans  (код возврата 1, если есть SCAN);
+# то же проверяет тест tests/test_query_plans.py
+import os
+import sys
+import tempfile
+
+os.environ.setdefault(
+    'FINANCE_DB_PATH',
+    os.path.join(tempfile.mkdtemp(prefix='finance-plans-'), 'finance.db')
+)
+
+import database as db  # noqa: E402
+from formatting import month_start  # noqa: E402
+
+USER_ID = 1
+OTHER_ID = 2
+YEAR, MONTH = 2024, 3
+PAGE_KEY = (month_start(YEAR, MONTH) + 14 * 86400, 100)
+
+
+def hot_queries(user_id, other_id, username, year, month, page_key):
+    # (название, функция, аргументы) — запросы, которые выполняют обработчики
+    start = month_start(year, month)
+    end = month_start(year + month // 12, month % 12 + 1)
+    year_start, year_end = month_start(year, 1), month_start(year + 1, 1)
+    queries = [
+        ('show_profile', db.get_profile, (user_id,)),
+        ('show_profile: итоги', db.profile_totals, (user_id,)),
+        ('find_user', db.find_by_username, (username,)),
+        ('find_user: долги', db.debts_between, (user_id, other_id)),
+        ('show_finances: месяц', db.finance_totals, (user_id, start, end)),
+        ('show_finances: год', db.finance_totals, (user_id, year_start, year_end)),
+        ('show_finances: 30 дней', db.finance_totals, (user_id, end - 30 * 86400, end)),
+        ('show_finances: все время', db.finance_totals, (user_id,)),
+        ('analytics: скользящие окна', db.rolling_totals, (user_id, end, (30, 90, 365))),
+        ('analytics: баланс нарастающим итогом', db.balance_series, (user_id, (year, 1), 12)),
+        ('chart: столбцы по месяцам', db.month_totals, (user_id, (year - 1, month), (year, month))),
+        ('save_expense: проверка бюджета', db.budget_checks,
+         ([(user_id, None, 50000, 'Еда', start)],)),
+        ('budget: лимиты за месяц', db.budget_report, (user_id, year, month)),
+        ('recurring: список правил', db.recurring_rules, (user_id,)),
+        ('settle: круг пользователя', db.debt_balances, (user_id,)),
+        ('settle: группа', db.debt_balances, (None, [user_id, other_id])),
+        ('search: слово', db.search_records, (user_id, ['такси'])),
+        ('search: префикс за месяц', db.search_records, (user_id, ['ед'], start, end)),
+        ('search: два слова, третья страница', db.search_records,
+         (user_id, ['такси', 'user'], None, None, 10, 20)),
+    ]
+    for kind in ('income', 'expense', 'debt'):
+        queries += [
+            (f'show_stats {kind}: месяц', db.stats_page, (kind, user_id, start, end)),
+            (f'show_stats {kind}: все время', db.stats_page, (kind, user_id)),
+            (f'show_stats {kind}: следующая страница', db.stats_page,
+             (kind, user_id, start, end, 'next', page_key)),
+            (f'show_stats {kind}: предыдущая страница', db.stats_page,
+             (kind, user_id, None, None, 'prev', page_key)),
+            (f'show_stats {kind}: сумма за месяц', db.stats_total, (kind, user_id, start, end)),
+            (f'show_stats {kind}: сумма за все время', db.stats_total, (kind, user_id)),
+            (f'delete_* {kind}: список', db.recent_records, (kind, user_id, 5)),
+        ]
+        if kind != 'debt':
+            queries += [
+                (f'chart {kind}: категории за месяц', db.category_totals,
+                 (user_id, kind, start, end)),
+                (f'chart {kind}: категории за 30 дней', db.category_totals,
+                 (user_id, kind, end - 30 * 86400, end)),
+            ]
+    return queries
+
+
+HOT_QUERIES = hot_queries(USER_ID, OTHER_ID, '@user', YEAR, MONTH, PAGE_KEY)
+
+
+def capture_statements(conn, func, args):
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        func(conn, *args)
+    finally:
+        conn.set_trace_callback(None)
+    return [sql for sql in statements if sql.lstrip().upper().startswith(('SELECT', 'WITH'))]
+
+
+# Просмотры строк CTE, подзапросов и константы — не таблицы
+NOT_TABLES = {
+    'SCAN CONSTANT ROW', 'SCAN members', 'SCAN calendar', 'SCAN c', 'SCAN sums', 'SCAN m',
+    # Настройки индекса поиска (несколько строк) читает сам модуль FTS5
+    'SCAN main.records_search_config',
+}
+
+
+def full_scans(plan):
+    # «SCAN t» без «USING ... INDEX» означает чтение всей таблицы
+    return [
+        detail for _, _, _, detail in plan
+        if detail.startswith('SCAN') and 'INDEX' not in detail
+        and detail not in NOT_TABLES and not detail.startswith('SCAN (subquery')
+    ]
+
+
+def main():
+    db.init_db()
+    failed = 0
+    with db.get_pool().reader() as conn:
+        for name, func, args in HOT_QUERIES:
+            for sql in capture_statements(conn, func, args):
+                plan = conn.execute('EXPLAIN QUERY PLAN ' + sql).fetchall()
+                scans = full_scans(plan)
+                status = 'FAIL' if scans else 'ok'
+                failed += bool(scans)
+                print(f'[{status}] {name}')
+                for _, _, _, detail in plan:
+                    print(f'       {detail}')
+    db.shutdown()
+    print(f'\nПолных просмотров таблиц: {failed}')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,132 @@
+# Регулярные операции на временной БД: N правил (ежемесячные и
+# еженедельные), бот «простоял» --downtime дней. Замеряется создание всех
+# пропущенных записей (run_recurring, пачками по RECURRING_BATCH_SIZE
+# правил в транзакции) и рассылка уведомлений через поддельный Bot API с
+# задержкой ответа. Проверяется, что каждый срок создан ровно один раз,
+# повторный запуск ничего не добавляет, monthly_totals сходится с записями,
+# а одновременных запросов к API не больше RECURRING_NOTIFY_CONCURRENCY.
+#
+# Запуск: python -m benchmarks.recurring [--rules 20000] [--downtime 90]
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+os.environ.setdefault(
+    'FINANCE_DB_PATH',
+    os.path.join(tempfile.mkdtemp(prefix='finance-recurring-'), 'finance.db')
+)
+
+import database as db  # noqa: E402
+import finance_bot as fb  # noqa: E402
+from config import RECURRING_NOTIFY_CONCURRENCY  # noqa: E402
+from formatting import SECONDS_PER_DAY, now_timestamp, recurring_due  # noqa: E402
+
+
+class FakeBot:
+    def __init__(self, latency):
+        self.latency = latency
+        self.sent = 0
+        self.active = 0
+        self.max_active = 0
+        self.first_sent = None
+
+    async def send_message(self, chat_id, text):
+        if self.first_sent is None:
+            self.first_sent = time.perf_counter()
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.active -= 1
+        self.sent += 1
+
+
+def fill(rules, users, downtime, seed=1):
+    # Правила со сроком downtime дней назад; возвращает ожидаемое число записей
+    rng = random.Random(seed)
+    now = now_timestamp()
+    start = now - downtime * SECONDS_PER_DAY
+    expected = 0
+    rows = []
+    for _ in range(rules):
+        if rng.random() < 0.7:
+            period, day = 'monthly', rng.randrange(1, 32)
+        else:
+            period, day = 'weekly', rng.randrange(7)
+        due = recurring_due(period, day, start)
+        next_due = due
+        while next_due <= now:
+            expected += 1
+            next_due = recurring_due(period, day, next_due + SECONDS_PER_DAY)
+        rows.append((rng.randrange(1, users + 1), None, rng.choice(['income', 'expense']),
+                     rng.randrange(100, 10000000), 'Подписки', period, day, due))
+    with db.get_pool().writer() as conn:
+        conn.executemany(
+            '''INSERT INTO recurring
+            (user_id, username, kind, amount, category, period, day, next_due)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+            rows
+        )
+    return expected
+
+
+def count_records(conn):
+    return sum(
+        conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+        for table in ('incomes', 'expenses')
+    )
+
+
+async def run(args):
+    bot = FakeBot(args.latency / 1000)
+    started = time.perf_counter()
+    await fb.run_recurring(bot)
+    elapsed = time.perf_counter() - started
+    written = (bot.first_sent or time.perf_counter()) - started
+    await fb.run_recurring(bot)
+    await db.close_batcher()
+    return bot, written, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rules', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--downtime', type=int, default=90, help='дней простоя')
+    parser.add_argument('--latency', type=float, default=20, help='ответ Bot API, мс')
+    args = parser.parse_args()
+
+    db.init_db()
+    expected = fill(args.rules, args.users, args.downtime)
+    bot, written, elapsed = asyncio.run(run(args))
+
+    failed = False
+    with db.get_pool().reader() as conn:
+        created = count_records(conn)
+        totals = conn.execute(
+            "SELECT SUM(count) FROM monthly_totals WHERE kind IN ('income', 'expense')"
+        ).fetchone()[0] or 0
+        overdue = conn.execute(
+            'SELECT COUNT(*) FROM recurring WHERE next_due <= ?', (now_timestamp(),)
+        ).fetchone()[0]
+    print(f'Правил: {args.rules}, простой {args.downtime} дн.: создано записей {created} '
+          f'(ожидалось {expected}) за {written:.2f} с')
+    print(f'Уведомлений {bot.sent} за {elapsed - written:.2f} с, '
+          f'одновременно не больше {bot.max_active}')
+    if created != expected or totals != created or overdue:
+        print(f'ОШИБКА: записей {created}, в monthly_totals {totals}, просроченных правил {overdue}')
+        failed = True
+    if bot.max_active > RECURRING_NOTIFY_CONCURRENCY:
+        print(f'ОШИБКА: одновременных уведомлений {bot.max_active}')
+        failed = True
+    db.shutdown()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,66 @@
+# Форматирование строк статистики: старое хранение (TEXT-дата + REAL сумма,
+# strptime/strftime на каждую строку) против нового (секунды + копейки).
+#
+# Запуск: python -m benchmarks.render_rows [--rows 100000]
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from formatting import format_date, money, to_timestamp
+
+
+def make_rows(count):
+    start = datetime(2020, 1, 1)
+    old_rows, new_rows = [], []
+    for i in range(count):
+        date = start + timedelta(minutes=37 * i)
+        kopecks = random.randint(100, 5000000)
+        old_rows.append((kopecks / 100, 'Еда', date.strftime('%Y-%m-%d %H:%M:%S')))
+        new_rows.append((kopecks, 'Еда', to_timestamp(date)))
+    return old_rows, new_rows
+
+
+def render_old(rows):
+    lines = []
+    for amount, category, date in rows:
+        date_str = datetime.strptime(date, '%Y-%m-%d %H:%M:%S').strftime('%d.%m.%Y')
+        lines.append(f"• {amount:.2f} руб. ({category}) - {date_str}")
+    return lines
+
+
+def render_new(rows):
+    lines = []
+    for amount, category, date in rows:
+        lines.append(f"• {money(amount)} руб. ({category}) - {format_date(date)}")
+    return lines
+
+
+def measure(render, rows, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = render(rows)
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    old_rows, new_rows = make_rows(args.rows)
+    old_time, old_lines = measure(render_old, old_rows, args.repeat)
+    new_time, new_lines = measure(render_new, new_rows, args.repeat)
+    assert old_lines == new_lines, 'форматы дают разный текст'
+
+    print(f'{args.rows} строк')
+    print(f'  TEXT + REAL:        {old_time * 1000:8.1f} мс')
+    print(f'  секунды + копейки:  {new_time * 1000:8.1f} мс')
+    print(f'  ускорение:          x{old_time / new_time:.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+# Полнотекстовый поиск (/search) на синтетической БД (benchmarks/dataset.py):
+# время первой страницы для самого активного пользователя и выборки
+# остальных — по всем словам и периодам, — и сверка найденного с полным
+# перебором записей пользователя: те же записи, то же число, страницы без
+# повторов. Затем в откатываемой транзакции проверяется, что триггеры
+# добавляют и удаляют записи в индексе поиска.
+#
+# Запуск: python -m benchmarks.search [--rows 1000000] [--path /tmp/finance-1m.db]
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import database as db
+from benchmarks.dataset import generate
+from benchmarks.db_scale import pick_users
+from formatting import SECONDS_PER_DAY, day_start, month_start, now_timestamp, year_month
+
+QUERIES = ['еда', 'такси', 'т', 'user', 'обед', 'зарпл', 'такси user', 'ё']
+PAGE = 10
+# Страница при сверке: все найденные записи читаются постранично
+CHECK_PAGE = 500
+
+
+def periods():
+    # Название -> (start_date, end_date), как у stats_period в боте
+    year, month = year_month(now_timestamp())
+    month = month - 2 if month > 2 else month + 10
+    year = year if month <= 10 else year - 1
+    end = day_start(now_timestamp()) + SECONDS_PER_DAY
+    return {
+        'все время': (None, None),
+        'год': (month_start(year, 1), month_start(year + 1, 1)),
+        'месяц': (month_start(year, month), month_start(year + month // 12, month % 12 + 1)),
+        '30 дней': (end - 30 * SECONDS_PER_DAY, end),
+        '365 дней': (end - 365 * SECONDS_PER_DAY, end),
+    }
+
+
+def user_records(conn, user_id):
+    # [(вид, id, слова текста, дата)] — полный перебор без индекса поиска
+    records = []
+    for kind in db.SEARCH_KINDS:
+        table, owner = db.RECORD_TABLES[kind]
+        text = "COALESCE(description, '') || ' ' || COALESCE(to_username, '')" \
+            if kind == 'debt' else "COALESCE(category, '')"
+        for record_id, value, date in conn.execute(
+            f'SELECT id, {text}, date FROM {table} WHERE {owner} = ?', (user_id,)
+        ):
+            records.append((kind, record_id, db.search_words(value), date))
+    return records
+
+
+def expected(records, words, start, end):
+    return {
+        (kind, record_id) for kind, record_id, tokens, date in records
+        if all(any(token.startswith(word) for token in tokens) for word in words)
+        and (start is None or start <= date < end)
+    }
+
+
+def all_pages(conn, user_id, words, start, end):
+    found, total, offset = [], None, 0
+    while True:
+        rows, count = db.search_records(conn, user_id, words, start, end, CHECK_PAGE, offset)
+        if total is None:
+            total = count
+        found += [(row[0], row[1]) for row in rows]
+        if len(rows) < CHECK_PAGE:
+            return found, total
+        offset += CHECK_PAGE
+
+
+def check_triggers(conn, user_id):
+    # Вставка и удаление в откатываемой транзакции; пусто — всё в порядке
+    errors = []
+    word = 'проверкапоиска'
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        db.add_expense(conn, user_id, None, 100, f'Ёжик {word}', now_timestamp())
+        db.add_debt(conn, user_id, None, None, '@друг', 100, word, now_timestamp())
+        rows, total = db.search_records(conn, user_id, [word])
+        if total != 2:
+            errors.append(f'после вставки найдено {total} из 2')
+        if not db.search_records(conn, user_id, ['ежик', word[:5]])[1]:
+            errors.append('не найдено по «ежик»')
+        for kind, record_id, *_ in rows:
+            db.delete_record(conn, kind, record_id, user_id)
+        if db.search_records(conn, user_id, [word])[1]:
+            errors.append('удалённые записи остались в индексе')
+        conn.execute("INSERT INTO records_search (records_search, rank) VALUES ('integrity-check', 0)")
+    finally:
+        conn.execute('ROLLBACK')
+    return errors
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--path', help='БД из benchmarks.dataset; создаётся, если её нет')
+    parser.add_argument('--users', type=int, default=100, help='пользователей в выборке')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    path = args.path or os.path.join(tempfile.gettempdir(), f'finance-search-{args.rows}.db')
+    if not os.path.exists(path):
+        print(f'Генерация {args.rows} записей -> {path}')
+        print(f"  готово за {generate(path, args.rows)['seconds']} с")
+
+    pool = db.ConnectionPool(path, readers=1)
+    conn = pool.connect()
+    heavy, median = pick_users(conn)
+    user_ids = [row[0] for row in conn.execute('SELECT user_id FROM users')]
+    sample = [heavy, median] + random.Random(1).sample(user_ids, min(args.users, len(user_ids)))
+    heavy_records = conn.execute(
+        'SELECT SUM(count) FROM monthly_totals WHERE user_id = ?', (heavy,)
+    ).fetchone()[0]
+
+    failed = False
+    timings = {'heavy': [], 'all': []}
+    by_period = {}
+    for user_id in sample:
+        records = user_records(conn, user_id)
+        for query in QUERIES:
+            words = db.search_words(query)
+            for name, (start, end) in periods().items():
+                elapsed = []
+                for _ in range(args.repeat):
+                    started = time.perf_counter()
+                    db.search_records(conn, user_id, words, start, end, PAGE)
+                    elapsed.append((time.perf_counter() - started) * 1000)
+                value = statistics.median(elapsed)
+                timings['all'].append(value)
+                if user_id == heavy:
+                    timings['heavy'].append(value)
+                    by_period[name] = max(by_period.get(name, 0), value)
+
+                found, total = all_pages(conn, user_id, words, start, end)
+                want = expected(records, words, start, end)
+                if set(found) != want or len(found) != len(want) or total != len(want):
+                    print(f'ОШИБКА: пользователь {user_id}, «{query}» {name}: '
+                          f'найдено {len(found)} (total {total}), ожидалось {len(want)}')
+                    failed = True
+
+    errors = check_triggers(conn, median)
+    for error in errors:
+        print(f'ОШИБКА триггеров: {error}')
+    failed = failed or bool(errors)
+    conn.close()
+    pool.close()
+
+    print(f'Поисков: {len(timings["all"])} ({len(sample)} пользователей × '
+          f'{len(QUERIES)} запросов × {len(periods())} периодов), первая страница, мс:')
+    print(f'  все: p50 {percentile(timings["all"], 0.5):.2f}, '
+          f'p95 {percentile(timings["all"], 0.95):.2f}, max {max(timings["all"]):.2f}')
+    print(f'  самый активный ({heavy_records} записей): p50 {percentile(timings["heavy"], 0.5):.2f}, '
+          f'max {max(timings["heavy"]):.2f}')
+    for name, value in by_period.items():
+        print(f'    {name:<10} max {value:.2f}')
+    print('Сверка с перебором и триггеры:', 'ОШИБКИ' if failed else 'ok')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,169 @@
+# Взаимозачёт /settle на временной БД: граф долгов между N пользователями
+# (компании друзей плюс случайные связи между ними). Замеряется расчёт
+# балансов по всему графу, по кругу одного пользователя и по группе, для
+# сравнения — те же балансы по всем строкам в Python. Проверяется, что
+# переводы обнуляют балансы и что их меньше участников, а после
+# подтверждения взаимозачёта круга monthly_totals сходится с записями.
+#
+# Запуск: python -m benchmarks.settlement [--users 20000] [--debts 100000]
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+os.environ.setdefault(
+    'FINANCE_DB_PATH',
+    os.path.join(tempfile.mkdtemp(prefix='finance-settle-'), 'finance.db')
+)
+
+import database as db  # noqa: E402
+import settlement  # noqa: E402
+from currencies import BASE_CURRENCY  # noqa: E402
+from formatting import now_timestamp  # noqa: E402
+
+GROUP_SIZE = 8
+
+
+def fill(pool, users, debts, seed=1):
+    rng = random.Random(seed)
+    now = now_timestamp()
+    with pool.writer() as conn:
+        conn.executemany(
+            'INSERT INTO users (user_id, username, first_name) VALUES (?, ?, ?)',
+            [(user_id, f'@user{user_id}', 'Имя') for user_id in range(1, users + 1)]
+        )
+        rows = []
+        for _ in range(debts):
+            debtor = rng.randrange(1, users + 1)
+            if rng.random() < 0.9:
+                # Внутри своей компании
+                base = (debtor - 1) // GROUP_SIZE * GROUP_SIZE
+                creditor = base + rng.randrange(GROUP_SIZE) + 1
+            else:
+                creditor = rng.randrange(1, users + 1)
+            if creditor == debtor or creditor > users:
+                continue
+            paid = rng.random() < 0.3
+            rows.append((debtor, f'@user{debtor}', creditor, f'@user{creditor}',
+                         rng.randrange(100, 1000000), 'обед', now - rng.randrange(365 * 86400),
+                         int(paid)))
+        # Часть долгов записана на незарегистрированных — они в зачёт не идут
+        rows += [(rng.randrange(1, users + 1), None, None, 'Вася', 50000, 'такси', now, 0)
+                 for _ in range(debts // 10)]
+        conn.executemany(
+            '''INSERT INTO debts (from_user_id, from_username, to_user_id, to_username,
+            amount, description, date, is_paid) VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+            rows
+        )
+        db.rebuild_monthly_totals(conn)
+    return len(rows)
+
+
+def python_balances(conn):
+    # Как без агрегации в SQL: каждая строка долга приходит в Python
+    balances = {}
+    for debtor, creditor, amount in conn.execute(
+        'SELECT from_user_id, to_user_id, amount FROM debts WHERE is_paid = 0'
+    ):
+        if creditor is None:
+            continue
+        balances[debtor] = balances.get(debtor, 0) - amount
+        balances[creditor] = balances.get(creditor, 0) + amount
+    return {user_id: balance for user_id, balance in balances.items() if balance}
+
+
+def check(balances, plan):
+    left = dict(balances)
+    for debtor, creditor, amount in plan:
+        if amount <= 0:
+            return False
+        left[debtor] += amount
+        left[creditor] -= amount
+    return not any(left.values()) and len(plan) <= max(len(balances) - 1, 0)
+
+
+def timed(func, *args, repeat=5):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--debts', type=int, default=100000)
+    args = parser.parse_args()
+
+    db.init_db()
+    pool = db.get_pool()
+    rows = fill(pool, args.users, args.debts)
+    with pool.reader() as conn:
+        pairs = conn.execute(
+            '''SELECT COUNT(*) FROM (SELECT 1 FROM debts
+            WHERE is_paid = 0 AND to_user_id IS NOT NULL GROUP BY from_user_id, to_user_id)'''
+        ).fetchone()[0]
+    print(f'Пользователей {args.users}, строк долгов {rows}, непогашенных пар {pairs}')
+
+    failed = False
+    user_id = 1
+    with pool.reader() as conn:
+        (balances, max_id), sql_time = timed(db.debt_balances, conn)
+        reference, python_time = timed(python_balances, conn)
+        plan, plan_time = timed(settlement.transfers, balances)
+        print(f'весь граф: SQL {sql_time * 1000:.1f} мс, по строкам в Python '
+              f'{python_time * 1000:.1f} мс; переводы {plan_time * 1000:.1f} мс — '
+              f'{len(plan)} вместо {pairs} для {len(balances)} участников')
+        if balances != reference or not check(balances, plan):
+            print('  ОШИБКА: балансы или переводы по всему графу неверны')
+            failed = True
+
+        (circle, _), circle_time = timed(db.debt_balances, conn, user_id)
+        circle_plan = settlement.transfers(circle)
+        print(f'круг пользователя: {circle_time * 1000:.1f} мс, участников {len(circle)}, '
+              f'переводов {len(circle_plan)}')
+        if not check(circle, circle_plan):
+            print('  ОШИБКА: переводы по кругу пользователя неверны')
+            failed = True
+
+        group = list(range(1, GROUP_SIZE + 1))
+        (members, _), group_time = timed(db.debt_balances, conn, None, group)
+        group_plan = settlement.transfers(members)
+        print(f'группа из {len(group)}: {group_time * 1000:.2f} мс, переводов {len(group_plan)}')
+        if not check(members, group_plan):
+            print('  ОШИБКА: переводы по группе неверны')
+            failed = True
+
+    # Взаимозачёт круга пользователя: план подтверждают все, кому должны
+    started = time.perf_counter()
+    now = now_timestamp()
+    with pool.writer() as conn:
+        settlement_id, confirmers = db.create_settlement(
+            conn, user_id, None, BASE_CURRENCY, max_id, circle_plan, now
+        )
+        for confirmer in confirmers:
+            _, _, count, owners = db.confirm_settlement(conn, settlement_id, confirmer, now)
+    print(f'взаимозачёт круга: подтверждений {len(confirmers)}, {count} долгов за '
+          f'{(time.perf_counter() - started) * 1000:.1f} мс, '
+          f'итоги изменились у {len(owners)} пользователей')
+    with pool.reader() as conn:
+        left = conn.execute(
+            '''SELECT COUNT(*) FROM debts WHERE is_paid = 0 AND to_user_id IS NOT NULL
+            AND (from_user_id = ? OR to_user_id = ?)''',
+            (user_id, user_id)
+        ).fetchone()[0]
+        mismatches = db.check_monthly_totals(conn)
+    if left or mismatches:
+        print(f'  ОШИБКА: осталось непогашенных {left}, расхождений monthly_totals {len(mismatches)}')
+        failed = True
+    db.shutdown()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,219 @@
+# Задержка доставки обновлений: webhook (свой HTTP-сервер) против polling.
+# Вместо Telegram — FakeTelegram: отдаёт обновления через getUpdates или
+# POST-запросами на webhook и принимает ответы бота sendMessage. Сетевая
+# задержка до Telegram моделируется: rtt/2 на каждый путь в одну сторону.
+# Задержка — от появления обновления «в Telegram» до ответа бота.
+#
+# Запуск: python -m benchmarks.webhook_latency [--updates 2000] [--rate 500] [--rtt 50]
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+
+from telegram.ext import Application, MessageHandler, filters
+from telegram.request import BaseRequest
+
+from webhook import WebhookServer
+
+SECRET = 'benchmark-secret'
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+
+
+def make_update(update_id, user_id):
+    chat = {'id': user_id, 'type': 'private'}
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': chat,
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'U{user_id}'},
+            'text': str(update_id),
+        },
+    }
+
+
+class FakeTelegram(BaseRequest):
+    # Bot API без сети: getUpdates ждёт обновления как long polling,
+    # sendMessage отмечает время ответа на обновление с номером из текста
+
+    def __init__(self, rtt):
+        self.rtt = rtt
+        self.pending = asyncio.Queue()
+        self.created = {}
+        self.latencies = []
+        self.done = asyncio.Event()
+        self.expected = 0
+        self._message_id = 0
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        params = request_data.parameters if request_data else {}
+        if endpoint == 'getMe':
+            result = BOT_USER
+        elif endpoint == 'getUpdates':
+            result = await self._get_updates(params)
+        elif endpoint == 'sendMessage':
+            result = self._send_message(params)
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+    async def _get_updates(self, params):
+        await asyncio.sleep(self.rtt / 2)
+        try:
+            updates = [await asyncio.wait_for(self.pending.get(), params.get('timeout') or 10)]
+        except asyncio.TimeoutError:
+            updates = []
+        while updates and not self.pending.empty() and len(updates) < params.get('limit', 100):
+            updates.append(self.pending.get_nowait())
+        await asyncio.sleep(self.rtt / 2)
+        return updates
+
+    def _send_message(self, params):
+        update_id = int(params['text'])
+        self.latencies.append(time.perf_counter() - self.created.pop(update_id))
+        if len(self.latencies) == self.expected:
+            self.done.set()
+        self._message_id += 1
+        return {
+            'message_id': self._message_id,
+            'date': int(time.time()),
+            'chat': {'id': params['chat_id'], 'type': 'private'},
+            'text': params['text'],
+        }
+
+
+async def echo(update, context):
+    await update.message.reply_text(update.message.text)
+
+
+def build_application(telegram, **builder_args):
+    builder = (
+        Application.builder()
+        .token('1:benchmark')
+        .request(telegram)
+        .get_updates_request(telegram)
+    )
+    for name, value in builder_args.items():
+        builder = getattr(builder, name)(value)
+    application = builder.build()
+    application.add_handler(MessageHandler(filters.TEXT, echo))
+    return application
+
+
+async def generate(telegram, deliver, updates, rate, users):
+    telegram.expected = updates
+    started = time.perf_counter()
+    tasks = []
+    for update_id in range(1, updates + 1):
+        delay = started + update_id / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        telegram.created[update_id] = time.perf_counter()
+        update = make_update(update_id, random.randrange(users))
+        tasks.append(asyncio.ensure_future(deliver(update)))
+    await asyncio.gather(*tasks)
+    await asyncio.wait_for(telegram.done.wait(), 60)
+
+
+async def run_polling(args):
+    telegram = FakeTelegram(args.rtt / 1000)
+    application = build_application(telegram)
+
+    async def deliver(update):
+        telegram.pending.put_nowait(update)
+
+    async with application:
+        await application.start()
+        await application.updater.start_polling(poll_interval=0)
+        await generate(telegram, deliver, args.updates, args.rate, args.users)
+        await application.updater.stop()
+        await application.stop()
+    return telegram.latencies
+
+
+async def run_webhook(args):
+    telegram = FakeTelegram(args.rtt / 1000)
+    application = build_application(
+        telegram, updater=None, update_queue=asyncio.Queue(args.queue_size)
+    )
+    server = WebhookServer(application, host='127.0.0.1', port=0, secret_token=SECRET)
+    connections = asyncio.Queue()
+    rejected = 0
+
+    async def deliver(update):
+        # Как Telegram: rtt/2 до сервера, не больше max_connections запросов
+        # одновременно; при 503 — повтор
+        nonlocal rejected
+        body = json.dumps(update).encode()
+        request = (
+            f'POST /telegram HTTP/1.1\r\nHost: bot\r\n'
+            f'Content-Type: application/json\r\n'
+            f'X-Telegram-Bot-Api-Secret-Token: {SECRET}\r\n'
+            f'Content-Length: {len(body)}\r\n\r\n'
+        ).encode() + body
+        await asyncio.sleep(telegram.rtt / 2)
+        while True:
+            reader, writer = await connections.get()
+            writer.write(request)
+            status_line = await reader.readuntil(b'\r\n\r\n')
+            connections.put_nowait((reader, writer))
+            if b' 200 ' in status_line.split(b'\r\n', 1)[0]:
+                return
+            rejected += 1
+            await asyncio.sleep(telegram.rtt)
+
+    async with application:
+        await application.start()
+        await server.start()
+        for _ in range(args.connections):
+            connections.put_nowait(await asyncio.open_connection('127.0.0.1', server.port))
+        await generate(telegram, deliver, args.updates, args.rate, args.users)
+        while not connections.empty():
+            _, writer = connections.get_nowait()
+            writer.close()
+        await server.stop()
+        await application.stop()
+    if rejected:
+        print(f'  webhook: 503 при заполненной очереди — {rejected} раз')
+    return telegram.latencies
+
+
+def report(name, latencies):
+    q = statistics.quantiles(latencies, n=100)
+    print(f'{name:>8}: p50 {q[49] * 1000:7.1f} мс  p95 {q[94] * 1000:7.1f} мс  '
+          f'p99 {q[98] * 1000:7.1f} мс')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--rate', type=float, default=500, help='обновлений в секунду')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--rtt', type=float, default=50, help='задержка до Telegram туда-обратно, мс')
+    parser.add_argument('--connections', type=int, default=40,
+                        help='соединений от Telegram (max_connections)')
+    parser.add_argument('--queue-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    print(f'{args.updates} обновлений, {args.rate:.0f}/с, RTT {args.rtt:.0f} мс')
+    report('polling', asyncio.run(run_polling(args)))
+    report('webhook', asyncio.run(run_webhook(args)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+# Пропускная способность записи: фиксация каждой строки отдельно (db.write)
+# против групповой фиксации через очередь (db.add_record) — при заданном
+# числе пишущих и при малом (LOW_CONCURRENCY), где пакетам не из чего
+# набираться и групповая фиксация не должна проигрывать.
+#
+# Запуск: python -m benchmarks.write_throughput [--writers 200] [--rows 20]
+#         DB_SYNCHRONOUS=FULL python -m benchmarks.write_throughput
+#         python -m benchmarks.write_throughput --budgets  (лимит на категорию
+#         каждого пользователя: проверка бюджета в транзакции вставки)
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+os.environ.setdefault(
+    'FINANCE_DB_PATH',
+    os.path.join(tempfile.mkdtemp(prefix='finance-writes-'), 'finance.db')
+)
+
+import config  # noqa: E402
+import database as db  # noqa: E402
+from formatting import month_start  # noqa: E402
+
+# (пишущих, записей на каждого) для малой нагрузки
+LOW_CONCURRENCY = (20, 5)
+
+
+def make_row(user_id, i):
+    return (user_id, None, 10000 + i, 'Еда', month_start(2024, 3) + i * 3600, 'RUB')
+
+
+async def per_row(user_id, rows):
+    for i in range(rows):
+        await db.write(db.add_expense, *make_row(user_id, i))
+
+
+async def grouped(user_id, rows):
+    for i in range(rows):
+        await db.add_record('expense', make_row(user_id, i))
+
+
+async def set_budgets(writers):
+    for user_id in range(writers):
+        await db.write(db.set_budget, user_id, 'Еда', 1000000)
+
+
+async def scenario(writer, writers, rows):
+    started = time.perf_counter()
+    await asyncio.gather(*(writer(user_id, rows) for user_id in range(writers)))
+    elapsed = time.perf_counter() - started
+    await db.close_batcher()
+    return writers * rows / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--writers', type=int, default=200,
+                        help='одновременно пишущих пользователей')
+    parser.add_argument('--rows', type=int, default=20,
+                        help='записей на пользователя')
+    parser.add_argument('--budgets', action='store_true',
+                        help='задать каждому пользователю лимит на категорию')
+    args = parser.parse_args()
+
+    db.init_db()
+    if args.budgets:
+        asyncio.run(set_budgets(args.writers))
+    print(f'БД: {config.DB_PATH}, synchronous={config.DB_SYNCHRONOUS}, '
+          f'пакет до {config.WRITE_BATCH_SIZE} строк')
+    for writers, rows in dict.fromkeys([(args.writers, args.rows), LOW_CONCURRENCY]):
+        print(f'\n{writers} пишущих по {rows} записей:')
+        results = {}
+        for name, writer in (('по строке', per_row), ('группой', grouped)):
+            results[name] = asyncio.run(scenario(writer, writers, rows))
+            print(f'{name:>10}: {results[name]:>9.0f} записей/с')
+        print(f"Ускорение: x{results['группой'] / results['по строке']:.1f}")
+    db.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+import sys
+import time
+from collections import OrderedDict
+
+from config import (
+    CHART_CACHE_MAX_BYTES, CHART_CACHE_TTL, SUMMARY_CACHE_MAX_BYTES, SUMMARY_CACHE_TTL,
+    USER_ACTIVITY_INTERVAL, USER_CACHE_SIZE
+)
+from formatting import ROLLING_DAYS
+
+
+def _approx_size(obj):
+    # Грубая оценка памяти: ключи и значения кэша — небольшие кортежи чисел и строк
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (tuple, list)):
+        size += sum(_approx_size(item) for item in obj)
+    return size
+
+
+class SummaryCache:
+    # LRU-кэш итогов с временем жизни записей и ограничением по памяти.
+    # Ключ — (user_id, представление, период). Доступ только из цикла событий.
+
+    def __init__(self, max_bytes=SUMMARY_CACHE_MAX_BYTES, ttl=SUMMARY_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._generation = 0
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def version(self, user_id):
+        # Меняется при каждой инвалидации данных пользователя и при clear()
+        return self._generation, self._versions.get(user_id, 0)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, expires, size = entry
+        if expires < time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, version=None):
+        # version — значение self.version(user_id) до чтения из БД: если
+        # за время запроса данные изменились, устаревший результат не кладём
+        if version is not None and version != self.version(key[0]):
+            return
+        if key in self._entries:
+            self._remove(key)
+        size = _approx_size(key) + _approx_size(value)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (value, time.monotonic() + self.ttl, size)
+        self.size += size
+        while self.size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def invalidate(self, user_id, keys):
+        self._versions[user_id] = self._versions.get(user_id, 0) + 1
+        for key in keys:
+            if key in self._entries:
+                self._remove(key)
+
+    def invalidate_user(self, user_id):
+        # Все итоги пользователя, например после импорта за много месяцев
+        self._versions[user_id] = self._versions.get(user_id, 0) + 1
+        for key in [key for key in self._entries if key[0] == user_id]:
+            self._remove(key)
+
+    def clear(self):
+        # Все итоги сразу, например после смены курсов валют; чтения,
+        # начатые до этого, свои результаты уже не сохранят
+        self._generation += 1
+        self._entries.clear()
+        self.size = 0
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self.size -= size
+
+
+summaries = SummaryCache()
+# Отправленные графики: ключ (user_id, график, период, summaries.version,
+# день для периодов от сегодняшней даты), значение — (file_id картинки,
+# подпись). После изменения данных версия другая, и старые записи просто
+# вытесняются
+chart_files = SummaryCache(CHART_CACHE_MAX_BYTES, CHART_CACHE_TTL)
+
+
+def summary_keys(user_id, kind, period_code):
+    # Записи кэша, которые меняются при добавлении или удалении записи
+    # вида kind за месяц period_code ('ГГГГММ'): сам месяц, его год, всё
+    # время и скользящие окна (запись может попасть в любое из них)
+    keys = [(user_id, 'profile', 'all')]
+    for period in ('all', period_code, period_code[:4], *ROLLING_DAYS):
+        keys.append((user_id, 'finances', period))
+        keys.append((user_id, f'stats:{kind}', period))
+    return keys
+
+
+def invalidate_record(user_id, kind, period_code):
+    summaries.invalidate(user_id, summary_keys(user_id, kind, period_code))
+
+
+class UserDirectory:
+    # Двусторонний LRU-справочник user_id <-> @username с данными профиля,
+    # чтобы разрешать @юзернеймы и проверять изменения без запросов к БД.
+    # Запись: (username, first_name, last_name, registration_date).
+    # Для пользователей из справочника хранится и время (monotonic)
+    # последней записи users.last_activity в БД.
+
+    def __init__(self, max_entries=USER_CACHE_SIZE, activity_interval=USER_ACTIVITY_INTERVAL):
+        self.max_entries = max_entries
+        self.activity_interval = activity_interval
+        self._by_id = OrderedDict()
+        self._by_username = {}
+        self._activity = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def get(self, user_id):
+        entry = self._by_id.get(user_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._by_id.move_to_end(user_id)
+        self.hits += 1
+        return entry
+
+    def resolve(self, username):
+        # Возвращает (user_id, запись) или None, если юзернейма нет в справочнике
+        user_id = self._by_username.get(username)
+        if user_id is None:
+            self.misses += 1
+            return None
+        self._by_id.move_to_end(user_id)
+        self.hits += 1
+        return user_id, self._by_id[user_id]
+
+    def put(self, user_id, username, first_name, last_name, registration_date):
+        old = self._by_id.pop(user_id, None)
+        if old is not None and self._by_username.get(old[0]) == user_id:
+            del self._by_username[old[0]]
+        entry = (username, first_name, last_name, registration_date)
+        self._by_id[user_id] = entry
+        if username:
+            # Юзернейм мог перейти от другого пользователя
+            self._by_username[username] = user_id
+        while len(self._by_id) > self.max_entries:
+            evicted_id, evicted = self._by_id.popitem(last=False)
+            if self._by_username.get(evicted[0]) == evicted_id:
+                del self._by_username[evicted[0]]
+            self._activity.pop(evicted_id, None)
+            self.evictions += 1
+        return entry
+
+    def activity_due(self, user_id):
+        # Пора ли снова записать last_activity: не чаще раза в activity_interval
+        last = self._activity.get(user_id)
+        return last is None or time.monotonic() - last >= self.activity_interval
+
+    def mark_active(self, user_id):
+        # last_activity пользователя только что записан в БД
+        if user_id in self._by_id:
+            self._activity[user_id] = time.monotonic()
+
+
+users = UserDirectory()
@@ -0,0 +1,176 @@
+import math
+import multiprocessing
+import struct
+import zlib
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+
+from config import CHART_WORKERS
+
+# Графики рисуются без сторонних библиотек прямо в PNG (RGB, zlib).
+# Подписей на картинке нет: легенда и суммы уходят в подпись к фото,
+# поэтому цвета совпадают с цветными квадратами эмодзи.
+PALETTE = [
+    ('🟥', (221, 46, 68)),
+    ('🟧', (244, 144, 12)),
+    ('🟨', (253, 203, 88)),
+    ('🟩', (120, 177, 89)),
+    ('🟦', (85, 172, 238)),
+    ('🟪', (170, 142, 214)),
+    ('🟫', (193, 105, 79)),
+    ('⬛', (49, 55, 61)),
+]
+INCOME_COLOR = PALETTE[3]
+EXPENSE_COLOR = PALETTE[0]
+DEBT_COLOR = PALETTE[4]
+
+BACKGROUND = (255, 255, 255)
+GRID = (225, 225, 225)
+AXIS = (120, 120, 120)
+PIE_SIZE = 480
+BARS_WIDTH, BARS_HEIGHT = 720, 400
+
+
+def _png(width, height, pixels):
+    # pixels — bytearray RGB построчно сверху вниз
+    def chunk(tag, data):
+        return (struct.pack('>I', len(data)) + tag + data
+                + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff))
+
+    stride = width * 3
+    raw = b''.join(
+        b'\x00' + pixels[y * stride:(y + 1) * stride] for y in range(height)
+    )
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw, 6))
+            + chunk(b'IEND', b''))
+
+
+def _fill(pixels, width, x0, y0, x1, y1, color):
+    # Прямоугольник [x0, x1) x [y0, y1)
+    if x1 <= x0 or y1 <= y0:
+        return
+    line = bytes(color) * (x1 - x0)
+    for y in range(y0, y1):
+        start = (y * width + x0) * 3
+        pixels[start:start + len(line)] = line
+
+
+def _blend(color, alpha):
+    return bytes(round(c * alpha + b * (1 - alpha)) for c, b in zip(color, BACKGROUND))
+
+
+def pie(values, size=PIE_SIZE):
+    # Круговая диаграмма: доли values по часовой стрелке от «12 часов»,
+    # цвета — PALETTE по порядку. В каждой половине строки угол монотонен
+    # по x, поэтому границы секторов ищутся двоичным поиском и строка
+    # заливается отрезками; попиксельно считается только сглаженный край.
+    total = sum(values)
+    bounds = []
+    acc = 0
+    for value in values:
+        acc += value
+        bounds.append(acc / total * 2 * math.pi)
+    last = len(values) - 1
+    colors = [PALETTE[i % len(PALETTE)][1] for i in range(len(values))]
+
+    pixels = bytearray(bytes(BACKGROUND) * size * size)
+    center = (size - 1) / 2
+    radius = size / 2 - 8
+    for y in range(size):
+        dy = y - center
+        if abs(dy) >= radius + 0.5:
+            continue
+
+        def sector(x):
+            angle = math.atan2(x - center, -dy) % (2 * math.pi)
+            return min(bisect_right(bounds, angle), last)
+
+        half = math.sqrt(max((radius + 0.5) ** 2 - dy * dy, 0))
+        x0 = max(0, math.floor(center - half))
+        x1 = min(size - 1, math.ceil(center + half))
+        middle = math.floor(center)
+        for start, end in ((x0, min(middle, x1)), (max(middle + 1, x0), x1)):
+            x = start
+            while x <= end:
+                index = sector(x)
+                lo, hi = x, end
+                while lo < hi:
+                    mid = (lo + hi + 1) // 2
+                    if sector(mid) == index:
+                        lo = mid
+                    else:
+                        hi = mid - 1
+                _fill(pixels, size, x, y, lo + 1, y + 1, colors[index])
+                x = lo + 1
+
+        # Край круга: доля пикселя внутри окружности по расстоянию до центра
+        inner = radius - 0.5
+        if inner > abs(dy):
+            solid = math.sqrt(inner * inner - dy * dy)
+            edge = [*range(x0, math.ceil(center - solid)),
+                    *range(math.floor(center + solid) + 1, x1 + 1)]
+        else:
+            edge = range(x0, x1 + 1)
+        for x in edge:
+            coverage = radius - math.hypot(x - center, dy) + 0.5
+            start = (y * size + x) * 3
+            if coverage <= 0:
+                pixels[start:start + 3] = bytes(BACKGROUND)
+            elif coverage < 1:
+                pixels[start:start + 3] = _blend(colors[sector(x)], coverage)
+    return _png(size, size, pixels)
+
+
+def bars(series, colors, width=BARS_WIDTH, height=BARS_HEIGHT):
+    # Столбцы по месяцам: series — списки значений одной длины (по одному
+    # на ряд), colors — цвет каждого ряда; столбцы рядов стоят рядом
+    pixels = bytearray(bytes(BACKGROUND) * width * height)
+    left, right, top, bottom = 16, width - 16, 16, height - 24
+    months = len(series[0])
+    peak = max((value for values in series for value in values), default=0) or 1
+
+    # Сетка: 4 равных деления до максимума
+    for step in range(1, 5):
+        y = bottom - round((bottom - top) * step / 4)
+        _fill(pixels, width, left, y, right, y + 1, GRID)
+
+    slot = (right - left) / months
+    bar = max(1, int(slot * 0.8 / len(series)))
+    for month in range(months):
+        x = round(left + slot * month + slot * 0.1)
+        for values, color in zip(series, colors):
+            bar_height = round((bottom - top) * values[month] / peak)
+            if values[month] > 0:
+                bar_height = max(bar_height, 1)
+            _fill(pixels, width, x, bottom - bar_height, x + bar, bottom, color)
+            x += bar
+        # Риска месяца на оси
+        tick = round(left + slot * (month + 0.5))
+        _fill(pixels, width, tick, bottom, tick + 1, bottom + 6, AXIS)
+    _fill(pixels, width, left, bottom, right, bottom + 2, AXIS)
+    return _png(width, height, pixels)
+
+
+# Рисование занимает процессор на десятки-сотни миллисекунд, поэтому идёт
+# в пуле процессов. Процессы запускаются через spawn: fork копировал бы
+# процесс бота вместе с потоками БД и открытыми соединениями SQLite.
+_pool = None
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=CHART_WORKERS,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    return _pool
+
+
+def shutdown() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True)
+        _pool = None
@@ -0,0 +1,108 @@
+import os
+from pathlib import Path
+from dotenv import load_dotenv
+
+# Загружаем переменные из файла .env
+load_dotenv()
+
+# Получаем абсолютный путь к директории скрипта
+BASE_DIR = Path(__file__).parent
+DB_PATH = os.getenv('FINANCE_DB_PATH', os.path.join(BASE_DIR, 'finance.db'))
+
+# Пул соединений: одно соединение на запись и DB_READERS на чтение
+DB_READERS = int(os.getenv('DB_READERS', '4'))
+# NORMAL: в режиме WAL fsync только при checkpoint; FULL: fsync на каждый COMMIT
+DB_SYNCHRONOUS = os.getenv('DB_SYNCHRONOUS', 'NORMAL')
+# Размер кэша страниц SQLite на соединение, КБ
+DB_CACHE_SIZE_KB = int(os.getenv('DB_CACHE_SIZE_KB', '65536'))
+# Размер файла БД, отображаемого в память, байт
+DB_MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', str(256 * 1024 * 1024)))
+# Число подготовленных выражений, кэшируемых на соединение
+DB_STATEMENT_CACHE = int(os.getenv('DB_STATEMENT_CACHE', '256'))
+
+# Групповая фиксация записей: пакет — строки, накопившиеся, пока писатель
+# был занят предыдущим пакетом, но не больше WRITE_BATCH_SIZE
+WRITE_BATCH_SIZE = int(os.getenv('WRITE_BATCH_SIZE', '100'))
+
+# Кэш итогов для экранов «Финансы», профиля и сумм статистики
+SUMMARY_CACHE_MAX_BYTES = int(os.getenv('SUMMARY_CACHE_MAX_BYTES', str(4 * 1024 * 1024)))
+SUMMARY_CACHE_TTL = int(os.getenv('SUMMARY_CACHE_TTL', '300'))
+# Размер справочника пользователей (user_id <-> @username) в памяти
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '10000'))
+# users.last_activity пишется в БД не чаще раза в столько секунд на пользователя
+USER_ACTIVITY_INTERVAL = float(os.getenv('USER_ACTIVITY_INTERVAL', '300'))
+
+# Как часто (секунд) состояния диалогов и user_data сохраняются в БД
+PERSISTENCE_UPDATE_INTERVAL = float(os.getenv('PERSISTENCE_UPDATE_INTERVAL', '5'))
+
+# Режим получения обновлений: polling (getUpdates) или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+# Публичный адрес, на который Telegram шлёт обновления (без пути)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+# Значение заголовка X-Telegram-Bot-Api-Secret-Token, без него запрос отклоняется
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+# Сертификат и ключ, если TLS не завершается на балансировщике
+WEBHOOK_CERT = os.getenv('WEBHOOK_CERT', '')
+WEBHOOK_KEY = os.getenv('WEBHOOK_KEY', '')
+# Обновлений, принятых, но ещё не обработанных; сверх этого — ответ 503
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000'))
+# Одновременных соединений от Telegram (параметр setWebhook, 1-100)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+WEBHOOK_MAX_BODY = int(os.getenv('WEBHOOK_MAX_BODY', str(1024 * 1024)))
+# Секунд на приём запроса целиком (заголовки и тело) и на отправку ответа;
+# сколько keep-alive-соединение может простаивать между запросами
+WEBHOOK_READ_TIMEOUT = float(os.getenv('WEBHOOK_READ_TIMEOUT', '10'))
+WEBHOOK_IDLE_TIMEOUT = float(os.getenv('WEBHOOK_IDLE_TIMEOUT', '120'))
+
+# Обработчиков, выполняемых одновременно (обновления разных пользователей)
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', '32'))
+# Принятых обновлений, включая ждущие завершения предыдущих того же пользователя
+UPDATE_PENDING_LIMIT = int(os.getenv('UPDATE_PENDING_LIMIT', '4096'))
+
+# Метрики в формате Prometheus: в режиме webhook отдаются тем же сервером
+# по METRICS_PATH, в режиме polling — отдельным на METRICS_LISTEN:METRICS_PORT
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '0') == '1'
+METRICS_PATH = os.getenv('METRICS_PATH', '/metrics')
+METRICS_LISTEN = os.getenv('METRICS_LISTEN', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9090'))
+# Если задан, запрос метрик должен нести заголовок Authorization: Bearer <токен>
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Профиль SQL-запросов по отпечаткам (литералы заменены на ?):
+# число выполнений, суммарное и максимальное время
+QUERY_PROFILE = os.getenv('QUERY_PROFILE', '0') == '1'
+# Выражения дольше этого пишутся в лог вместе с EXPLAIN QUERY PLAN, мс
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '100'))
+# Сколько разных отпечатков хранить; остальные учитываются одной строкой
+QUERY_PROFILE_SIZE = int(os.getenv('QUERY_PROFILE_SIZE', '1000'))
+# Снимок профиля для `python -m querylog`
+QUERY_PROFILE_PATH = os.getenv('QUERY_PROFILE_PATH', os.path.join(BASE_DIR, 'query_profile.json'))
+
+# Telegram ID администраторов через запятую (команда /admin_queries)
+ADMIN_IDS = {int(value) for value in os.getenv('ADMIN_IDS', '').split(',') if value.strip()}
+
+# Импорт CSV-выписок: строк в одной транзакции и предельный размер файла
+IMPORT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', '5000'))
+IMPORT_MAX_BYTES = int(os.getenv('IMPORT_MAX_BYTES', str(20 * 1024 * 1024)))
+
+# Графики статистики: процессов рисования и кэш отправленных картинок
+# (file_id Telegram) по пользователю, графику, периоду и версии данных
+CHART_WORKERS = int(os.getenv('CHART_WORKERS', '2'))
+CHART_CACHE_MAX_BYTES = int(os.getenv('CHART_CACHE_MAX_BYTES', str(1024 * 1024)))
+CHART_CACHE_TTL = int(os.getenv('CHART_CACHE_TTL', str(24 * 3600)))
+
+# Регулярные операции: как часто проверять наступившие сроки (секунд),
+# правил в одной транзакции и одновременных уведомлений пользователям
+RECURRING_INTERVAL = float(os.getenv('RECURRING_INTERVAL', '60'))
+RECURRING_BATCH_SIZE = int(os.getenv('RECURRING_BATCH_SIZE', '1000'))
+RECURRING_NOTIFY_CONCURRENCY = int(os.getenv('RECURRING_NOTIFY_CONCURRENCY', '8'))
+
+# Сколько дней взаимозачёт /settle ждёт подтверждений участников
+SETTLE_EXPIRE_DAYS = int(os.getenv('SETTLE_EXPIRE_DAYS', '7'))
+
+# Курсы валют (рублей за единицу): локальный CSV-файл «код;курс», читается
+# при запуске и по команде /rates reload. Пример — rates.example.csv
+RATES_PATH = os.getenv('RATES_PATH', os.path.join(BASE_DIR, 'rates.csv'))
@@ -0,0 +1,86 @@
+import csv
+import re
+from decimal import Decimal, InvalidOperation
+
+from formatting import money, parse_amount
+
+# Суммы во всех валютах хранятся целыми сотыми долями (как копейки), а у
+# каждой записи есть код валюты. Курсы — рублей за единицу валюты — лежат
+# в таблице rates и загружаются из локального CSV-файла (RATES_PATH)
+# строками «код;курс» или «код,курс», например «USD;92,50». Отчёты
+# пересчитываются в валюту пользователя прямо в запросах (см. database.py).
+BASE_CURRENCY = 'RUB'
+# Знаки и другие написания валют при вводе суммы
+ALIASES = {
+    '₽': 'RUB', 'Р': 'RUB', 'РУБ': 'RUB', 'РУБ.': 'RUB', 'RUR': 'RUB',
+    '$': 'USD', '€': 'EUR', '£': 'GBP', '¥': 'CNY', '₸': 'KZT',
+}
+_CODE = re.compile('[A-Z]{3}')
+_MONEY = re.compile(r'\s*([^\d\s,.+-]*)\s*([+-]?[\d\s]*[\d][\d\s]*(?:[.,]\d*)?)\s*([^\d\s,.+-]*)\s*')
+
+# Курсы, загруженные в БД: код -> рублей за единицу. Заполняется при
+# запуске бота и после /rates reload
+rates = {BASE_CURRENCY: 1.0}
+
+
+def label(currency: str) -> str:
+    return 'руб.' if currency == BASE_CURRENCY else currency
+
+
+def amount_text(kopecks: int, currency: str) -> str:
+    # 150050, 'RUB' -> '1500.50 руб.'; 2000, 'USD' -> '20.00 USD'
+    return f"{money(kopecks)} {label(currency)}"
+
+
+def normalize(text: str):
+    # Код валюты по коду, знаку или названию; None — не распознана
+    text = text.strip().upper()
+    code = ALIASES.get(text, text)
+    return code if _CODE.fullmatch(code) else None
+
+
+def parse_money(text: str):
+    # '1500', '1500 usd', '$15', '15,5€' -> (сотые доли, код или None);
+    # ValueError, если это не сумма
+    match = _MONEY.fullmatch(text)
+    if match is None or (match.group(1) and match.group(3)):
+        raise ValueError(text)
+    amount = parse_amount(match.group(2).replace(' ', ''))
+    sign = match.group(1) or match.group(3)
+    if not sign:
+        return amount, None
+    currency = normalize(sign)
+    if currency is None:
+        raise ValueError(text)
+    return amount, currency
+
+
+def read_rates(path) -> dict:
+    # {код: курс} из CSV-файла; строки с «#» и заголовок пропускаются.
+    # ValueError с номером строки, если курс не разобран
+    with open(path, encoding='utf-8-sig') as f:
+        lines = [
+            (number, line) for number, line in enumerate(f, start=1)
+            if line.strip() and not line.lstrip().startswith('#')
+        ]
+    # «;» — если он есть в данных: в «USD,92.50» запятая разделяет
+    # столбцы, в «USD;92,50» — дробную часть
+    delimiter = ';' if any(';' in line for _, line in lines) else ','
+    result = {BASE_CURRENCY: 1.0}
+    for i, (number, line) in enumerate(lines):
+        cells = [cell.strip() for cell in next(csv.reader([line], delimiter=delimiter))]
+        currency = normalize(cells[0])
+        # Заголовок — первая строка, если в ней не код валюты с курсом
+        if i == 0 and (currency is None or len(cells) < 2 or not cells[1][:1].isdigit()):
+            continue
+        try:
+            if currency is None or len(cells) < 2:
+                raise ValueError(line)
+            rate = Decimal(cells[1].replace(',', '.'))
+            if not rate.is_finite() or rate <= 0:
+                raise ValueError(line)
+        except (ValueError, InvalidOperation):
+            raise ValueError(f'{path}, строка {number}: {line.strip()}')
+        if currency != BASE_CURRENCY:
+            result[currency] = float(rate)
+    return result
@@ -0,0 +1,1989 @@
+import argparse
+import asyncio
+import heapq
+import logging
+import queue
+import re
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+
+from config import (
+    DB_PATH, DB_READERS, DB_CACHE_SIZE_KB, DB_MMAP_SIZE, DB_STATEMENT_CACHE,
+    DB_SYNCHRONOUS, RATES_PATH, SETTLE_EXPIRE_DAYS, WRITE_BATCH_SIZE
+)
+import metrics
+import settlement
+from currencies import BASE_CURRENCY, read_rates
+from formatting import SECONDS_PER_DAY, recurring_due, year_month
+from querylog import profiler
+
+logger = logging.getLogger(__name__)
+
+
+# Наблюдатели за SQL-выражениями: observer(sql, секунды) вызывается в потоке
+# БД после каждого выражения. Подключаются до открытия соединений.
+_statement_observers = []
+_TRANSACTION = ('BEGIN', 'COMMIT', 'ROLLBACK', 'END')
+
+
+def observe_statements(observer):
+    _statement_observers.append(observer)
+
+
+def _trace_statements(conn):
+    # sqlite3 сообщает только о начале выражения, поэтому время выражения —
+    # от его начала до начала следующего на том же соединении (включая
+    # чтение строк результата); COMMIT и ROLLBACK закрывают последнее
+    # выражение транзакции. Соединение используется одним потоком за раз.
+    current = [None, 0.0]
+
+    def trace(sql):
+        if sql.startswith('--'):
+            # Выражения триггеров и служебные запросы FTS5 выполняются внутри
+            # текущего выражения, их время входит в его время
+            return
+        now = time.perf_counter()
+        if current[0] is not None:
+            seconds = now - current[1]
+            for observer in _statement_observers:
+                observer(current[0], seconds)
+            current[0] = None
+        words = sql.lstrip()[:9].split(None, 1)
+        if words and words[0].upper() in _TRANSACTION:
+            return
+        current[0] = sql
+        current[1] = now
+
+    conn.set_trace_callback(trace)
+
+
+if metrics.enabled:
+    observe_statements(metrics.observe_statement)
+if profiler is not None:
+    # План медленного запроса строится на отдельном соединении без трассировки
+    profiler.explain_connect = lambda: get_pool().connect(trace=False)
+    observe_statements(profiler.record)
+
+
+class ConnectionPool:
+    # Долгоживущие соединения с прогретым кэшем страниц: одно на запись
+    # (запись в SQLite всё равно последовательная) и несколько на чтение.
+    # В режиме WAL читатели не блокируются писателем.
+
+    def __init__(self, path, readers=DB_READERS):
+        self.path = path
+        self.size = readers
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._writer = None
+
+    def connect(self, trace=True):
+        conn = sqlite3.connect(
+            self.path,
+            check_same_thread=False,
+            isolation_level=None,
+            cached_statements=DB_STATEMENT_CACHE
+        )
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute(f'PRAGMA synchronous = {DB_SYNCHRONOUS}')
+        conn.execute(f'PRAGMA mmap_size = {DB_MMAP_SIZE}')
+        conn.execute(f'PRAGMA cache_size = {-DB_CACHE_SIZE_KB}')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        # Токены индекса поиска для триггеров records_search
+        conn.create_function('search_tokens', 2, search_tokens, deterministic=True)
+        if trace and _statement_observers:
+            _trace_statements(conn)
+        return conn
+
+    @contextmanager
+    def reader(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._lock:
+                if self._created < self.size:
+                    conn = self.connect()
+                    self._created += 1
+            if conn is None:
+                conn = self._idle.get()
+
+        # Все запросы одной функции видят один снимок данных
+        conn.execute('BEGIN')
+        try:
+            yield conn
+        finally:
+            conn.execute('COMMIT')
+            self._idle.put(conn)
+
+    @contextmanager
+    def writer(self):
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = self.connect()
+            conn = self._writer
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            else:
+                conn.execute('COMMIT')
+
+    def close(self):
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        with self._lock:
+            while self._created:
+                self._idle.get().close()
+                self._created -= 1
+
+
+# Все запросы к SQLite выполняются в отдельном пуле потоков на соединениях
+# из общего пула, чтобы медленный запрос или fsync не останавливал цикл
+# событий бота, а соединения жили всё время работы процесса
+_pool = None
+_executor = None
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        _pool = ConnectionPool(DB_PATH)
+    return _pool
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=get_pool().size + 1,
+            thread_name_prefix='db'
+        )
+    return _executor
+
+
+def shutdown() -> None:
+    global _executor, _pool
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+    if _pool is not None:
+        _pool.close()
+        _pool = None
+
+
+def _read(func, args):
+    started = time.perf_counter()
+    try:
+        with get_pool().reader() as conn:
+            return func(conn, *args)
+    finally:
+        if metrics.enabled:
+            metrics.observe_db_call(func, 'read', started)
+
+
+def _write(func, args):
+    started = time.perf_counter()
+    try:
+        with get_pool().writer() as conn:
+            return func(conn, *args)
+    finally:
+        if metrics.enabled:
+            metrics.observe_db_call(func, 'write', started)
+
+
+def executor_queue_size():
+    # Вызовы read/write, ждущие свободного потока БД
+    if _executor is None:
+        return 0
+    return _executor._work_queue.qsize()
+
+
+async def read(func, *args):
+    # Выполняет func(conn, *args) в потоке БД на соединении для чтения
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), _read, func, args)
+
+
+def _read_detached(func, args):
+    started = time.perf_counter()
+    conn = get_pool().connect()
+    try:
+        conn.execute('PRAGMA query_only = ON')
+        return func(conn, *args)
+    finally:
+        conn.close()
+        if metrics.enabled:
+            metrics.observe_db_call(func, 'read', started)
+
+
+async def read_detached(func, *args):
+    # Как read, но на отдельном соединении только для чтения в потоке вне
+    # пула БД: долгая выгрузка не занимает ни соединение, ни поток пула.
+    # Транзакцию func не открывает — каждое выражение читает свой снимок
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, _read_detached, func, args)
+
+
+async def write(func, *args):
+    # Выполняет func(conn, *args) в одной транзакции на соединении для записи
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), _write, func, args)
+
+
+# Инициализация БД: применяем по порядку ещё не выполненные миграции,
+# каждую в своей транзакции вместе с записью в schema_version
+def init_db(pool=None):
+    pool = pool or get_pool()
+    with pool.writer() as conn:
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TEXT
+        )''')
+        current = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()[0] or 0
+
+    for version, description, migration in MIGRATIONS:
+        if version <= current:
+            continue
+        logger.info("Миграция БД %d: %s", version, description)
+        with pool.writer() as conn:
+            migration(conn)
+            conn.execute(
+                'INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)',
+                (version, description, datetime.now().isoformat())
+            )
+
+
+def _create_tables(conn):
+    cursor = conn.cursor()
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT UNIQUE,
+        first_name TEXT,
+        last_name TEXT,
+        registration_date TEXT,
+        last_activity TEXT
+    )''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS incomes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        username TEXT,
+        amount REAL,
+        category TEXT,
+        date TEXT,
+        FOREIGN KEY (user_id) REFERENCES users (user_id)
+    )''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS expenses (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        username TEXT,
+        amount REAL,
+        category TEXT,
+        date TEXT,
+        FOREIGN KEY (user_id) REFERENCES users (user_id)
+    )''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS debts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        from_user_id INTEGER,
+        from_username TEXT,
+        to_user_id INTEGER,
+        to_username TEXT,
+        amount REAL,
+        description TEXT,
+        date TEXT,
+        is_paid INTEGER DEFAULT 0,
+        FOREIGN KEY (from_user_id) REFERENCES users (user_id),
+        FOREIGN KEY (to_user_id) REFERENCES users (user_id)
+    )''')
+
+
+def _add_record_indexes(conn):
+    # Покрывающие индексы: выборки за период и суммы по ним читаются
+    # только из индекса, без обращения к самим таблицам
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS idx_incomes_user_date
+    ON incomes (user_id, date, amount, category)''')
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS idx_expenses_user_date
+    ON expenses (user_id, date, amount, category)''')
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS idx_debts_from_user
+    ON debts (from_user_id, is_paid, date)''')
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS idx_debts_to_user
+    ON debts (to_user_id, is_paid)''')
+
+
+# Итоги по записям в схеме миграции 3: даты — текст, суммы — рубли
+_TOTALS_SOURCE_V3 = '''
+    SELECT user_id,
+           CAST(strftime('%Y', date) AS INTEGER) AS year,
+           CAST(strftime('%m', date) AS INTEGER) AS month,
+           'income' AS kind, COALESCE(category, '') AS category,
+           SUM(amount) AS total, COUNT(*) AS count
+    FROM incomes GROUP BY 1, 2, 3, 5
+    UNION ALL
+    SELECT user_id,
+           CAST(strftime('%Y', date) AS INTEGER),
+           CAST(strftime('%m', date) AS INTEGER),
+           'expense', COALESCE(category, ''),
+           SUM(amount), COUNT(*)
+    FROM expenses GROUP BY 1, 2, 3, 5
+    UNION ALL
+    SELECT from_user_id,
+           CAST(strftime('%Y', date) AS INTEGER),
+           CAST(strftime('%m', date) AS INTEGER),
+           'debt', '',
+           SUM(amount), COUNT(*)
+    FROM debts WHERE is_paid = 0 GROUP BY 1, 2, 3
+'''
+
+
+def _create_monthly_totals(conn):
+    # Помесячные итоги по пользователю, виду записи и категории. Обновляются
+    # в той же транзакции, что и сами записи (см. _update_totals).
+    # Для долгов учитываются только непогашенные, категория пустая.
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS monthly_totals (
+        user_id INTEGER NOT NULL,
+        year INTEGER NOT NULL,
+        month INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        category TEXT NOT NULL,
+        total REAL NOT NULL DEFAULT 0,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, year, month, kind, category)
+    ) WITHOUT ROWID''')
+    conn.execute('DELETE FROM monthly_totals')
+    conn.execute(
+        '''INSERT INTO monthly_totals
+        (user_id, year, month, kind, category, total, count)
+        ''' + _TOTALS_SOURCE_V3
+    )
+
+
+def _add_debts_page_index(conn):
+    # Статистика долгов листается по (date, id) среди всех долгов
+    # пользователя, включая погашенные
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS idx_debts_from_user_date
+    ON debts (from_user_id, date)''')
+
+
+# Итоги по записям в схеме миграции 5, без валюты (её добавляет миграция 10)
+_TOTALS_SOURCE_V5 = '''
+    SELECT user_id,
+           CAST(strftime('%Y', date, 'unixepoch') AS INTEGER),
+           CAST(strftime('%m', date, 'unixepoch') AS INTEGER),
+           'income', COALESCE(category, ''), SUM(amount), COUNT(*)
+    FROM incomes GROUP BY 1, 2, 3, 5
+    UNION ALL
+    SELECT user_id,
+           CAST(strftime('%Y', date, 'unixepoch') AS INTEGER),
+           CAST(strftime('%m', date, 'unixepoch') AS INTEGER),
+           'expense', COALESCE(category, ''), SUM(amount), COUNT(*)
+    FROM expenses GROUP BY 1, 2, 3, 5
+    UNION ALL
+    SELECT from_user_id,
+           CAST(strftime('%Y', date, 'unixepoch') AS INTEGER),
+           CAST(strftime('%m', date, 'unixepoch') AS INTEGER),
+           'debt', '', SUM(amount), COUNT(*)
+    FROM debts WHERE is_paid = 0 GROUP BY 1, 2, 3
+'''
+
+
+def _numeric_dates_and_amounts(conn):
+    # date: TEXT '%Y-%m-%d %H:%M:%S' -> INTEGER секунд (то же время суток,
+    # без часового пояса); amount: REAL рублей -> INTEGER копеек.
+    # SQLite не меняет тип столбца, поэтому таблицы пересоздаются.
+    tables = {
+        'incomes': ('''
+        CREATE TABLE incomes_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            username TEXT,
+            amount INTEGER,
+            category TEXT,
+            date INTEGER,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )''', 'id, user_id, username, amount, category, date'),
+        'expenses': ('''
+        CREATE TABLE expenses_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            username TEXT,
+            amount INTEGER,
+            category TEXT,
+            date INTEGER,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )''', 'id, user_id, username, amount, category, date'),
+        'debts': ('''
+        CREATE TABLE debts_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            from_user_id INTEGER,
+            from_username TEXT,
+            to_user_id INTEGER,
+            to_username TEXT,
+            amount INTEGER,
+            description TEXT,
+            date INTEGER,
+            is_paid INTEGER DEFAULT 0,
+            FOREIGN KEY (from_user_id) REFERENCES users (user_id),
+            FOREIGN KEY (to_user_id) REFERENCES users (user_id)
+        )''', 'id, from_user_id, from_username, to_user_id, to_username, '
+              'amount, description, date, is_paid'),
+    }
+    for table, (create_sql, columns) in tables.items():
+        converted = columns.replace(
+            'amount', 'CAST(ROUND(amount * 100) AS INTEGER)'
+        ).replace(
+            'date', "CAST(strftime('%s', date) AS INTEGER)"
+        )
+        seq = conn.execute(
+            'SELECT seq FROM sqlite_sequence WHERE name = ?', (table,)
+        ).fetchone()
+
+        conn.execute(create_sql)
+        conn.execute(
+            f'INSERT INTO {table}_new ({columns}) SELECT {converted} FROM {table}'
+        )
+        conn.execute(f'DROP TABLE {table}')
+        conn.execute(f'ALTER TABLE {table}_new RENAME TO {table}')
+        if seq is not None:
+            # Номера удалённых записей не должны выдаваться повторно
+            conn.execute(
+                'UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?',
+                (seq[0], table)
+            )
+
+    _add_record_indexes(conn)
+    _add_debts_page_index(conn)
+
+    conn.execute('DROP TABLE monthly_totals')
+    conn.execute('''
+    CREATE TABLE monthly_totals (
+        user_id INTEGER NOT NULL,
+        year INTEGER NOT NULL,
+        month INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        category TEXT NOT NULL,
+        total INTEGER NOT NULL DEFAULT 0,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, year, month, kind, category)
+    ) WITHOUT ROWID''')
+    conn.execute(
+        '''INSERT INTO monthly_totals
+        (user_id, year, month, kind, category, total, count)
+        ''' + _TOTALS_SOURCE_V5
+    )
+
+
+def _create_persistence_tables(conn):
+    # Состояния ConversationHandler и context.user_data, по строке на ключ,
+    # чтобы после перезапуска пользователь продолжил диалог с того же шага
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS conversations (
+        name TEXT NOT NULL,
+        key TEXT NOT NULL,
+        state TEXT NOT NULL,
+        PRIMARY KEY (name, key)
+    ) WITHOUT ROWID''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS user_data (
+        user_id INTEGER NOT NULL,
+        key TEXT NOT NULL,
+        value TEXT NOT NULL,
+        PRIMARY KEY (user_id, key)
+    ) WITHOUT ROWID''')
+
+
+def _add_open_debts_indexes(conn):
+    # Частичные индексы только по непогашенным долгам между пользователями
+    # бота: граф долгов обходится и суммируется по парам без чтения таблицы
+    # (is_paid в индексе постоянен, но без него SQLite читает строку).
+    # idx_debts_to_user больше нигде не нужен и заменяется частичным
+    conn.execute('DROP INDEX IF EXISTS idx_debts_to_user')
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS idx_debts_open_from
+    ON debts (from_user_id, to_user_id, amount, is_paid)
+    WHERE is_paid = 0 AND to_user_id IS NOT NULL''')
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS idx_debts_open_to
+    ON debts (to_user_id, from_user_id, amount, is_paid)
+    WHERE is_paid = 0 AND to_user_id IS NOT NULL''')
+
+
+def _create_budgets(conn):
+    # Месячные лимиты расходов по категориям в копейках. Потраченное за
+    # месяц не хранится отдельно: это строка monthly_totals, которая
+    # обновляется в той же транзакции, что и вставка расхода
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS budgets (
+        user_id INTEGER NOT NULL,
+        category TEXT NOT NULL,
+        amount INTEGER NOT NULL,
+        PRIMARY KEY (user_id, category)
+    ) WITHOUT ROWID''')
+
+
+def _create_recurring(conn):
+    # Регулярные доходы и расходы. next_due — ближайший ещё не созданный
+    # срок (секунды); индекс по нему даёт наступившие правила всех
+    # пользователей одним поиском по диапазону
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS recurring (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        username TEXT,
+        kind TEXT NOT NULL,
+        amount INTEGER NOT NULL,
+        category TEXT NOT NULL,
+        period TEXT NOT NULL,
+        day INTEGER NOT NULL,
+        next_due INTEGER NOT NULL
+    )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_recurring_next_due ON recurring (next_due)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_recurring_user ON recurring (user_id)')
+
+
+# Итоги по записям в схеме миграции 10: с валютой записи
+_TOTALS_SOURCE_V10 = '''
+    SELECT user_id,
+           CAST(strftime('%Y', date, 'unixepoch') AS INTEGER),
+           CAST(strftime('%m', date, 'unixepoch') AS INTEGER),
+           'income', COALESCE(category, ''), currency, SUM(amount), COUNT(*)
+    FROM incomes GROUP BY 1, 2, 3, 5, 6
+    UNION ALL
+    SELECT user_id,
+           CAST(strftime('%Y', date, 'unixepoch') AS INTEGER),
+           CAST(strftime('%m', date, 'unixepoch') AS INTEGER),
+           'expense', COALESCE(category, ''), currency, SUM(amount), COUNT(*)
+    FROM expenses GROUP BY 1, 2, 3, 5, 6
+    UNION ALL
+    SELECT from_user_id,
+           CAST(strftime('%Y', date, 'unixepoch') AS INTEGER),
+           CAST(strftime('%m', date, 'unixepoch') AS INTEGER),
+           'debt', '', currency, SUM(amount), COUNT(*)
+    FROM debts WHERE is_paid = 0 GROUP BY 1, 2, 3, 6
+'''
+
+
+def _add_currencies(conn):
+    # Валюта у каждой записи, регулярного правила и лимита (всё, что было
+    # до этого, — в рублях) и таблица курсов. monthly_totals пересоздаётся
+    # с валютой в ключе, покрывающие индексы — с валютой, чтобы пересчёт
+    # по курсу не читал строки таблиц
+    for table in ('incomes', 'expenses', 'debts', 'recurring', 'budgets'):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN currency TEXT NOT NULL DEFAULT 'RUB'")
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS rates (
+        currency TEXT PRIMARY KEY,
+        rate REAL NOT NULL
+    ) WITHOUT ROWID''')
+    conn.execute("INSERT OR IGNORE INTO rates (currency, rate) VALUES ('RUB', 1)")
+
+    for table in ('incomes', 'expenses'):
+        conn.execute(f'DROP INDEX IF EXISTS idx_{table}_user_date')
+        conn.execute(f'''
+        CREATE INDEX idx_{table}_user_date
+        ON {table} (user_id, date, amount, category, currency)''')
+    conn.execute('DROP INDEX IF EXISTS idx_debts_open_from')
+    conn.execute('DROP INDEX IF EXISTS idx_debts_open_to')
+    conn.execute('''
+    CREATE INDEX idx_debts_open_from
+    ON debts (from_user_id, to_user_id, amount, currency, is_paid)
+    WHERE is_paid = 0 AND to_user_id IS NOT NULL''')
+    conn.execute('''
+    CREATE INDEX idx_debts_open_to
+    ON debts (to_user_id, from_user_id, amount, currency, is_paid)
+    WHERE is_paid = 0 AND to_user_id IS NOT NULL''')
+
+    conn.execute('DROP TABLE monthly_totals')
+    conn.execute('''
+    CREATE TABLE monthly_totals (
+        user_id INTEGER NOT NULL,
+        year INTEGER NOT NULL,
+        month INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        category TEXT NOT NULL,
+        currency TEXT NOT NULL,
+        total INTEGER NOT NULL DEFAULT 0,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, year, month, kind, category, currency)
+    ) WITHOUT ROWID''')
+    conn.execute(
+        '''INSERT INTO monthly_totals
+        (user_id, year, month, kind, category, currency, total, count)
+        ''' + _TOTALS_SOURCE_V10
+    )
+
+
+# Строка индекса поиска в схеме миграции 11 по таблицам записей:
+# (таблица, rowid, body, month), {row} — 'NEW.'/'OLD.' в триггерах
+# или '' при заполнении по существующим записям
+_SEARCH_SOURCES_V11 = [
+    ('incomes', '{row}id * 4 + 1', 'search_tokens({row}user_id, {row}category)',
+     "'u' || {row}user_id || 'm' || strftime('%Y%m', {row}date, 'unixepoch')"),
+    ('expenses', '{row}id * 4 + 2', 'search_tokens({row}user_id, {row}category)',
+     "'u' || {row}user_id || 'm' || strftime('%Y%m', {row}date, 'unixepoch')"),
+    ('debts', '{row}id * 4 + 3',
+     "search_tokens({row}from_user_id, "
+     "COALESCE({row}description, '') || ' ' || COALESCE({row}to_username, ''))",
+     "'u' || {row}from_user_id || 'm' || strftime('%Y%m', {row}date, 'unixepoch')"),
+]
+
+
+def _create_search(conn):
+    # Полнотекстовый поиск по категориям доходов и расходов, описаниям и
+    # получателям долгов: одна таблица FTS5 без своей копии текста
+    # (content=''), записи всех видов в ней под rowid = id * 4 + код вида.
+    # Слова индексируются вместе с владельцем записи — токенами
+    # «u<user_id>x<слово>» (см. search_tokens): поиск читает только списки
+    # токенов самого пользователя, а bm25 считает частоты слов по его
+    # записям. Столбец month — токен «u<user_id>m<ГГГГММ>» месяца записи:
+    # по нему период отбирается в самом индексе, а в ранжировании он не
+    # участвует. Триггеры держат индекс в синхронном состоянии с таблицами:
+    # из таблицы без содержимого строка удаляется командой 'delete' с
+    # прежними значениями столбцов — их дают OLD.* в триггере. Текст
+    # записей не меняется, поэтому триггеров на UPDATE нет
+    conn.execute('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS records_search USING fts5 (
+        body, month, content = '', tokenize = 'unicode61 remove_diacritics 2'
+    )''')
+    conn.execute(
+        "INSERT INTO records_search (records_search, rank) VALUES ('rank', 'bm25(1.0, 0.0)')"
+    )
+    for table, *columns in _SEARCH_SOURCES_V11:
+        values = ', '.join(column.format(row='NEW.') for column in columns)
+        conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_search_insert AFTER INSERT ON {table} BEGIN
+            INSERT INTO records_search (rowid, body, month) VALUES ({values});
+        END''')
+        values = ', '.join(column.format(row='OLD.') for column in columns)
+        conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_search_delete AFTER DELETE ON {table} BEGIN
+            INSERT INTO records_search (records_search, rowid, body, month)
+            VALUES ('delete', {values});
+        END''')
+        values = ', '.join(column.format(row='') for column in columns)
+        conn.execute(f'INSERT INTO records_search (rowid, body, month) SELECT {values} FROM {table}')
+    conn.execute("INSERT INTO records_search (records_search) VALUES ('optimize')")
+
+
+def _create_settlements(conn):
+    # Взаимозачёты /settle, ждущие подтверждения: наибольший id и число
+    # учтённых долгов, участники и отметки подтверждения тех, кому должны.
+    # AUTOINCREMENT: id удалённого взаимозачёта не достаётся новому, и
+    # кнопка из старого сообщения не подтвердит чужой план
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS settlements (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        max_debt_id INTEGER NOT NULL,
+        debts INTEGER NOT NULL,
+        created INTEGER NOT NULL
+    )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_settlements_created ON settlements (created)')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS settlement_members (
+        settlement_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        creditor INTEGER NOT NULL,
+        confirmed INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (settlement_id, user_id)
+    ) WITHOUT ROWID''')
+
+
+# Миграции схемы: (версия, описание, функция). Новые шаги добавляются
+# только в конец списка, уже выпущенные шаги не меняются
+MIGRATIONS = [
+    (1, 'Базовые таблицы', _create_tables),
+    (2, 'Составные индексы по пользователю и дате', _add_record_indexes),
+    (3, 'Помесячные итоги monthly_totals', _create_monthly_totals),
+    (4, 'Индекс долгов для постраничной статистики', _add_debts_page_index),
+    (5, 'Даты в секундах и суммы в копейках', _numeric_dates_and_amounts),
+    (6, 'Состояния диалогов и user_data', _create_persistence_tables),
+    (7, 'Индексы непогашенных долгов для взаимозачёта', _add_open_debts_indexes),
+    (8, 'Месячные бюджеты расходов по категориям', _create_budgets),
+    (9, 'Регулярные операции', _create_recurring),
+    (10, 'Валюты записей и таблица курсов', _add_currencies),
+    (11, 'Полнотекстовый поиск записей', _create_search),
+    (12, 'Подтверждение взаимозачёта участниками', _create_settlements),
+]
+
+
+# Таблицы записей и столбец владельца для каждого вида статистики
+RECORD_TABLES = {
+    'income': ('incomes', 'user_id'),
+    'expense': ('expenses', 'user_id'),
+    'debt': ('debts', 'from_user_id'),
+}
+
+
+# Пользователи
+def upsert_user(conn, user_id, username, first_name, last_name, now):
+    cursor = conn.cursor()
+    cursor.execute(
+        '''INSERT OR IGNORE INTO users
+        (user_id, username, first_name, last_name, registration_date, last_activity)
+        VALUES (?, ?, ?, ?, ?, ?)''',
+        (user_id, username, first_name, last_name, now, now)
+    )
+    cursor.execute(
+        '''UPDATE users SET
+        username = ?,
+        first_name = ?,
+        last_name = ?,
+        last_activity = ?
+        WHERE user_id = ?''',
+        (username, first_name, last_name, now, user_id)
+    )
+    cursor.execute(
+        'SELECT registration_date FROM users WHERE user_id = ?',
+        (user_id,)
+    )
+    return cursor.fetchone()[0]
+
+
+def touch_user(conn, user_id, now):
+    conn.execute('UPDATE users SET last_activity = ? WHERE user_id = ?', (now, user_id))
+
+
+def get_profile(conn, user_id):
+    cursor = conn.execute(
+        '''SELECT username, first_name, last_name, registration_date
+        FROM users WHERE user_id = ?''',
+        (user_id,)
+    )
+    return cursor.fetchone()
+
+
+def find_by_username(conn, username):
+    cursor = conn.execute(
+        '''SELECT user_id, first_name, last_name, registration_date
+        FROM users WHERE username = ?''',
+        (username,)
+    )
+    return cursor.fetchone()
+
+
+# Итоги читаются из monthly_totals: число строк зависит от количества
+# месяцев и категорий пользователя, а не от длины его истории.
+# Суммы в разных валютах пересчитываются в валюту отчёта currency прямо в
+# запросе: к строкам подключается курс их валюты (JOIN rates), а сумма
+# делится на курс валюты отчёта — первый параметр запроса
+def _converted(expr):
+    return f'''CAST(ROUND(SUM({expr} * rates.rate)
+        / (SELECT rate FROM rates AS report WHERE report.currency = ?)) AS INTEGER)'''
+
+
+def _sum_by_kind(rows):
+    totals = {'income': 0, 'expense': 0, 'debt': 0}
+    for kind, total in rows:
+        totals[kind] = total or 0
+    return totals['income'], totals['expense'], totals['debt']
+
+
+def profile_totals(conn, user_id, currency=BASE_CURRENCY):
+    cursor = conn.execute(
+        f'''SELECT kind, {_converted('total')}
+        FROM monthly_totals JOIN rates USING (currency)
+        WHERE user_id = ? GROUP BY kind''',
+        (currency, user_id)
+    )
+    return _sum_by_kind(cursor.fetchall())
+
+
+def _whole_months(start, end):
+    # (первый, последний) месяц как (год, месяц), если [start, end) —
+    # целые календарные месяцы, иначе None
+    if start % SECONDS_PER_DAY or end % SECONDS_PER_DAY:
+        return None
+    first, last = time.gmtime(start), time.gmtime(end)
+    if first.tm_mday != 1 or last.tm_mday != 1 or end <= start:
+        return None
+    return (first.tm_year, first.tm_mon), year_month(end - 1)
+
+
+def finance_totals(conn, user_id, start=None, end=None, currency=BASE_CURRENCY):
+    # (доходы, расходы, непогашенные долги) за [start, end) или за все
+    # время; целые месяцы и годы читаются из monthly_totals, остальные
+    # периоды (скользящие окна) — суммой по индексам с датой
+    if start is None:
+        return profile_totals(conn, user_id, currency)
+    months = _whole_months(start, end)
+    if months is not None:
+        cursor = conn.execute(
+            f'''SELECT kind, {_converted('total')}
+            FROM monthly_totals JOIN rates USING (currency)
+            WHERE user_id = ? AND (year, month) BETWEEN (?, ?) AND (?, ?)
+            GROUP BY kind''',
+            (currency, user_id, *months[0], *months[1])
+        )
+        return _sum_by_kind(cursor.fetchall())
+
+    cursor = conn.execute(
+        f'''SELECT 'income', {_converted('amount')}
+        FROM incomes JOIN rates USING (currency)
+        WHERE user_id = ? AND date >= ? AND date < ?
+        UNION ALL
+        SELECT 'expense', {_converted('amount')}
+        FROM expenses JOIN rates USING (currency)
+        WHERE user_id = ? AND date >= ? AND date < ?
+        UNION ALL
+        SELECT 'debt', {_converted('amount')}
+        FROM debts JOIN rates USING (currency)
+        WHERE from_user_id = ? AND date >= ? AND date < ? AND is_paid = 0''',
+        (currency, user_id, start, end) * 3
+    )
+    return _sum_by_kind(cursor.fetchall())
+
+
+# Данные графиков и аналитики — из тех же помесячных итогов
+def category_totals(conn, user_id, kind, start=None, end=None, currency=BASE_CURRENCY):
+    # [(категория, сотые доли)] по убыванию суммы за [start, end) или за
+    # все время
+    months = None if start is None else _whole_months(start, end)
+    if start is None:
+        cursor = conn.execute(
+            f'''SELECT category, {_converted('total')}
+            FROM monthly_totals JOIN rates USING (currency)
+            WHERE user_id = ? AND kind = ? GROUP BY category ORDER BY 2 DESC''',
+            (currency, user_id, kind)
+        )
+    elif months is not None:
+        cursor = conn.execute(
+            f'''SELECT category, {_converted('total')}
+            FROM monthly_totals JOIN rates USING (currency)
+            WHERE user_id = ? AND (year, month) BETWEEN (?, ?) AND (?, ?) AND kind = ?
+            GROUP BY category ORDER BY 2 DESC''',
+            (currency, user_id, *months[0], *months[1], kind)
+        )
+    else:
+        table, owner = RECORD_TABLES[kind]
+        cursor = conn.execute(
+            f'''SELECT category, {_converted('amount')}
+            FROM {table} JOIN rates USING (currency)
+            WHERE {owner} = ? AND date >= ? AND date < ?
+            GROUP BY category ORDER BY 2 DESC''',
+            (currency, user_id, start, end)
+        )
+    return [(category, total) for category, total in cursor if total > 0]
+
+
+def month_totals(conn, user_id, first, last, currency=BASE_CURRENCY):
+    # {(год, месяц, вид): сотые доли} за месяцы от first до last
+    # включительно, first и last — (год, месяц)
+    cursor = conn.execute(
+        f'''SELECT year, month, kind, {_converted('total')}
+        FROM monthly_totals JOIN rates USING (currency)
+        WHERE user_id = ? AND (year, month) BETWEEN (?, ?) AND (?, ?)
+        GROUP BY year, month, kind''',
+        (currency, user_id, *first, *last)
+    )
+    return {(year, month, kind): total for year, month, kind, total in cursor}
+
+
+def balance_series(conn, user_id, first, months, currency=BASE_CURRENCY):
+    # [(год, месяц, доходы, расходы, баланс на конец месяца)] за months
+    # месяцев начиная с first = (год, месяц), без пропусков. Баланс —
+    # нарастающий итог доходов минус расходы с начала истории: остаток до
+    # first плюс оконная сумма по месяцам ряда, всё одним запросом.
+    # Помесячные суммы пересчитываются в валюту отчёта без округления,
+    # округляются только выводимые значения
+    cursor = conn.execute(
+        '''WITH RECURSIVE calendar(n, year, month) AS (
+            SELECT 0, ?, ?
+            UNION ALL
+            SELECT n + 1, year + month / 12, month % 12 + 1 FROM calendar
+            WHERE n + 1 < ?
+        ), sums AS (
+            SELECT year, month,
+                   SUM(CASE kind WHEN 'income' THEN total * rates.rate ELSE 0 END)
+                   / report.rate AS income,
+                   SUM(CASE kind WHEN 'expense' THEN total * rates.rate ELSE 0 END)
+                   / report.rate AS expense
+            FROM monthly_totals JOIN rates USING (currency),
+                 (SELECT rate FROM rates WHERE currency = ?) AS report
+            WHERE user_id = ? AND kind IN ('income', 'expense')
+            GROUP BY year, month
+        )
+        SELECT c.year, c.month,
+               CAST(ROUND(COALESCE(s.income, 0)) AS INTEGER),
+               CAST(ROUND(COALESCE(s.expense, 0)) AS INTEGER),
+               CAST(ROUND(
+                   (SELECT COALESCE(SUM(income - expense), 0) FROM sums
+                    WHERE (year, month) < (?, ?))
+                   + SUM(COALESCE(s.income, 0) - COALESCE(s.expense, 0)) OVER (ORDER BY c.n)
+               ) AS INTEGER)
+        FROM calendar AS c LEFT JOIN sums AS s USING (year, month)
+        ORDER BY c.n''',
+        (*first, months, currency, user_id, *first)
+    )
+    return cursor.fetchall()
+
+
+def rolling_totals(conn, user_id, end, windows, currency=BASE_CURRENCY):
+    # {дней: (доходы, расходы)} за скользящие окна, заканчивающиеся в end:
+    # каждая таблица читается по индексу один раз за самое длинное окно
+    starts = [end - days * SECONDS_PER_DAY for days in windows]
+    columns = ', '.join(
+        _converted('CASE WHEN date >= ? THEN amount ELSE 0 END') for _ in windows
+    )
+    params = []
+    for start in starts:
+        params += [start, currency]
+    totals = {}
+    for kind in ('income', 'expense'):
+        table, owner = RECORD_TABLES[kind]
+        totals[kind] = conn.execute(
+            f'''SELECT {columns} FROM {table} JOIN rates USING (currency)
+            WHERE {owner} = ? AND date >= ? AND date < ?''',
+            (*params, user_id, min(starts), end)
+        ).fetchone()
+    return {
+        days: (totals['income'][i] or 0, totals['expense'][i] or 0)
+        for i, days in enumerate(windows)
+    }
+
+
+def debts_between(conn, user_id, other_id, currency=BASE_CURRENCY):
+    cursor = conn.cursor()
+    cursor.execute(
+        f'''SELECT {_converted('amount')} FROM debts JOIN rates USING (currency)
+        WHERE from_user_id = ? AND to_user_id = ? AND is_paid = 0''',
+        (currency, user_id, other_id)
+    )
+    debts_to_user = cursor.fetchone()[0] or 0
+
+    cursor.execute(
+        f'''SELECT {_converted('amount')} FROM debts JOIN rates USING (currency)
+        WHERE from_user_id = ? AND to_user_id = ? AND is_paid = 0''',
+        (currency, other_id, user_id)
+    )
+    debts_from_user = cursor.fetchone()[0] or 0
+    return debts_to_user, debts_from_user
+
+
+# Взаимозачёт (см. settlement.py): участвуют непогашенные долги между
+# зарегистрированными пользователями. Суммы сворачиваются по парам
+# (должник, кредитор) в SQL, в Python приходят только пары — уже в валюте
+# отчёта, поэтому долги в разных валютах взаимозачитываются.
+# Круг пользователя — все, с кем он связан цепочкой долгов в любую сторону
+_DEBT_CIRCLE = f'''
+    WITH RECURSIVE members(user_id) AS (
+        SELECT ?
+        UNION
+        SELECT to_user_id FROM debts JOIN members ON from_user_id = members.user_id
+        WHERE is_paid = 0 AND to_user_id IS NOT NULL AND id <= ?
+        UNION
+        SELECT from_user_id FROM debts JOIN members ON to_user_id = members.user_id
+        WHERE is_paid = 0 AND to_user_id IS NOT NULL AND id <= ?
+    )
+    SELECT from_user_id, to_user_id, {_converted('amount')}, COUNT(*)
+    FROM members JOIN debts ON from_user_id = members.user_id JOIN rates USING (currency)
+    WHERE is_paid = 0 AND to_user_id IS NOT NULL AND id <= ?
+    GROUP BY 1, 2'''
+
+
+def _debt_pairs(conn, circle_of, group, currency, max_id):
+    # (должник, кредитор, сумма в currency, число долгов) по непогашенным
+    # долгам с id <= max_id; circle_of и group — как в debt_balances
+    if circle_of is not None:
+        return conn.execute(_DEBT_CIRCLE, (circle_of, max_id, max_id, currency, max_id))
+    if group is not None:
+        marks = ', '.join('?' * len(group))
+        return conn.execute(
+            f'''SELECT from_user_id, to_user_id, {_converted('amount')}, COUNT(*)
+            FROM debts JOIN rates USING (currency)
+            WHERE is_paid = 0 AND to_user_id IS NOT NULL AND id <= ?
+            AND from_user_id IN ({marks}) AND to_user_id IN ({marks})
+            GROUP BY 1, 2''',
+            (currency, max_id, *group, *group)
+        )
+    return conn.execute(
+        f'''SELECT from_user_id, to_user_id, {_converted('amount')}, COUNT(*)
+        FROM debts JOIN rates USING (currency)
+        WHERE is_paid = 0 AND to_user_id IS NOT NULL AND id <= ?
+        GROUP BY 1, 2''',
+        (currency, max_id)
+    )
+
+
+def _pair_balances(pairs):
+    balances = {}
+    for debtor, creditor, amount, _ in pairs:
+        balances[debtor] = balances.get(debtor, 0) - amount
+        balances[creditor] = balances.get(creditor, 0) + amount
+    return {user_id: balance for user_id, balance in balances.items() if balance}
+
+
+def debt_balances(conn, circle_of=None, group=None, currency=BASE_CURRENCY):
+    # ({user_id: баланс в сотых долях currency}, наибольший id учтённых
+    # долгов). circle_of — круг пользователя; group — только долги между
+    # перечисленными user_id; без аргументов — весь граф долгов.
+    # Пользователи с нулевым балансом не возвращаются
+    max_id = conn.execute('SELECT MAX(id) FROM debts').fetchone()[0] or 0
+    return _pair_balances(_debt_pairs(conn, circle_of, group, currency, max_id)), max_id
+
+
+# Долги, которые закрывает взаимозачёт: все непогашенные, учтённые в
+# расчёте (id <= max_debt_id), между его участниками. Это ровно долги
+# круга или группы, по которым строился план: участники — все, между кем
+# они есть, включая посредников с нулевым балансом.
+# Параметры: max_debt_id, id взаимозачёта дважды
+_SETTLED_DEBTS = '''is_paid = 0 AND id <= ? AND to_user_id IS NOT NULL
+    AND from_user_id IN (SELECT user_id FROM settlement_members WHERE settlement_id = ?)
+    AND to_user_id IN (SELECT user_id FROM settlement_members WHERE settlement_id = ?)'''
+
+
+def _drop_settlements(conn, where, params):
+    conn.execute(
+        f'''DELETE FROM settlement_members
+        WHERE settlement_id IN (SELECT id FROM settlements WHERE {where})''',
+        params
+    )
+    conn.execute(f'DELETE FROM settlements WHERE {where}', params)
+
+
+def create_settlement(conn, circle_of, group, currency, max_id, plan, now):
+    # Взаимозачёт по плану, показанному /settle (переводы (кто, кому,
+    # сумма)). Долги пересчитываются в той же транзакции: если план по ним
+    # уже другой, возвращает None. Иначе запоминает участников и
+    # возвращает (id взаимозачёта, user_id тех, кому должны). Подтвердить
+    # должен каждый из них: и получатели переводов, и посредники, чьи
+    # долги закрываются вместе с долгами перед ними
+    pairs = _debt_pairs(conn, circle_of, group, currency, max_id).fetchall()
+    expected = sorted(settlement.transfers(_pair_balances(pairs)))
+    if not expected or expected != sorted(tuple(transfer) for transfer in plan):
+        return None
+
+    _drop_settlements(conn, 'created < ?', (now - SETTLE_EXPIRE_DAYS * SECONDS_PER_DAY,))
+    settlement_id = conn.execute(
+        'INSERT INTO settlements (max_debt_id, debts, created) VALUES (?, 0, ?)',
+        (max_id, now)
+    ).lastrowid
+    creditors = {creditor for _, creditor, _, _ in pairs}
+    members = creditors | {debtor for debtor, _, _, _ in pairs}
+    conn.executemany(
+        '''INSERT INTO settlement_members (settlement_id, user_id, creditor)
+        VALUES (?, ?, ?)''',
+        [(settlement_id, user_id, int(user_id in creditors)) for user_id in members]
+    )
+    conn.execute(
+        f'''UPDATE settlements SET debts = (SELECT COUNT(*) FROM debts WHERE {_SETTLED_DEBTS})
+        WHERE id = ?''',
+        (max_id, settlement_id, settlement_id, settlement_id)
+    )
+    return settlement_id, sorted(creditors)
+
+
+def confirm_settlement(conn, settlement_id, user_id, now):
+    # Подтверждение участника, которому должны. None — взаимозачёта нет,
+    # он устарел или user_id не из подтверждающих. Иначе (участники,
+    # сколько подтверждений ещё ждём, число закрытых долгов, user_id
+    # владельцев записей, чьи итоги изменились); пока ждём, участники не
+    # читаются. После последнего подтверждения закрываются все долги
+    # взаимозачёта, и взаимозачёт удаляется; если часть долгов успели
+    # погасить или удалить иначе, план уже неверен — ничего не
+    # закрывается, число закрытых долгов — None
+    row = conn.execute(
+        'SELECT max_debt_id, debts, created FROM settlements WHERE id = ?', (settlement_id,)
+    ).fetchone()
+    if row is None or row[2] < now - SETTLE_EXPIRE_DAYS * SECONDS_PER_DAY:
+        return None
+    max_id, debts, _ = row
+    confirmed = conn.execute(
+        '''UPDATE settlement_members SET confirmed = 1
+        WHERE settlement_id = ? AND user_id = ? AND creditor = 1''',
+        (settlement_id, user_id)
+    ).rowcount
+    if not confirmed:
+        return None
+
+    waiting = conn.execute(
+        '''SELECT COUNT(*) FROM settlement_members
+        WHERE settlement_id = ? AND creditor = 1 AND confirmed = 0''',
+        (settlement_id,)
+    ).fetchone()[0]
+    if waiting:
+        return [], waiting, 0, set()
+
+    members = [member for (member,) in conn.execute(
+        'SELECT user_id FROM settlement_members WHERE settlement_id = ?', (settlement_id,)
+    )]
+    params = (max_id, settlement_id, settlement_id)
+    closed, owners = None, set()
+    if conn.execute(f'SELECT COUNT(*) FROM debts WHERE {_SETTLED_DEBTS}', params).fetchone()[0] == debts:
+        closed, owners = _close_debts(conn, _SETTLED_DEBTS, params)
+    _drop_settlements(conn, 'id = ?', (settlement_id,))
+    return members, 0, closed, owners
+
+
+def _close_debts(conn, where, params):
+    # Отмечает погашенными долги по условию; monthly_totals уменьшается в
+    # той же транзакции. Возвращает (число долгов, user_id владельцев
+    # записей, чьи итоги изменились)
+    deltas = {}
+    cursor = conn.execute(
+        f'''SELECT from_user_id,
+                  CAST(strftime('%Y', date, 'unixepoch') AS INTEGER),
+                  CAST(strftime('%m', date, 'unixepoch') AS INTEGER),
+                  currency, SUM(amount), COUNT(*)
+        FROM debts WHERE {where} GROUP BY 1, 2, 3, 4''',
+        params
+    )
+    for owner, year, month, currency, total, closed in cursor:
+        delta = deltas.setdefault((owner, year, month, 'debt', '', currency), [0, 0])
+        delta[0] -= total
+        delta[1] -= closed
+    count = conn.execute(f'UPDATE debts SET is_paid = 1 WHERE {where}', params).rowcount
+    _apply_totals(conn, deltas)
+    return count, {key[0] for key in deltas}
+
+
+def usernames(conn, user_ids):
+    # {user_id: (username, first_name)}
+    marks = ', '.join('?' * len(user_ids))
+    cursor = conn.execute(
+        f'SELECT user_id, username, first_name FROM users WHERE user_id IN ({marks})',
+        tuple(user_ids)
+    )
+    return {user_id: (username, first_name) for user_id, username, first_name in cursor}
+
+
+# Статистика. Записи читаются страницами по ключу (date, id): следующая
+# страница — строки «старше» последней показанной, предыдущая — «новее»
+# первой. Стоимость запроса не зависит от того, какая это страница.
+def stats_page(conn, kind, user_id, start_date=None, end_date=None,
+               direction=None, key=None, limit=20):
+    table, owner = RECORD_TABLES[kind]
+    if kind == 'debt':
+        columns = 'id, amount, to_username, description, date, currency'
+    else:
+        columns = 'id, amount, category, date, currency'
+
+    where = [f'{owner} = ?']
+    params = [user_id]
+    if start_date is not None:
+        where.append('date >= ? AND date < ?')
+        params += [start_date, end_date]
+    if direction == 'prev':
+        where.append('(date, id) > (?, ?)')
+        params += list(key)
+        order = 'ASC'
+    else:
+        if direction == 'next':
+            where.append('(date, id) < (?, ?)')
+            params += list(key)
+        order = 'DESC'
+
+    cursor = conn.execute(
+        f'''SELECT {columns} FROM {table}
+        WHERE {' AND '.join(where)}
+        ORDER BY date {order}, id {order} LIMIT ?''',
+        params + [limit + 1]
+    )
+    rows = cursor.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if order == 'ASC':
+        rows.reverse()
+    return rows, has_more
+
+
+def stats_total(conn, kind, user_id, start_date=None, end_date=None, currency=BASE_CURRENCY):
+    table, owner = RECORD_TABLES[kind]
+    if start_date is None and kind != 'debt':
+        # За всё время доходы и расходы суммируются по помесячным итогам
+        cursor = conn.execute(
+            f'''SELECT {_converted('total')} FROM monthly_totals JOIN rates USING (currency)
+            WHERE user_id = ? AND kind = ?''',
+            (currency, user_id, kind)
+        )
+    elif start_date is None:
+        cursor = conn.execute(
+            f'''SELECT {_converted('amount')} FROM {table} JOIN rates USING (currency)
+            WHERE {owner} = ?''',
+            (currency, user_id)
+        )
+    else:
+        cursor = conn.execute(
+            f'''SELECT {_converted('amount')} FROM {table} JOIN rates USING (currency)
+            WHERE {owner} = ? AND date >= ? AND date < ?''',
+            (currency, user_id, start_date, end_date)
+        )
+    return cursor.fetchone()[0] or 0
+
+
+# Добавление записей. Строки передаются кортежами в порядке столбцов:
+# incomes/expenses — (user_id, username, amount, category, date, currency),
+# debts — (from_user_id, from_username, to_user_id, to_username,
+#          amount, description, date, currency)
+INSERT_SQL = {
+    'income': '''INSERT INTO incomes
+        (user_id, username, amount, category, date, currency)
+        VALUES (?, ?, ?, ?, ?, ?)''',
+    'expense': '''INSERT INTO expenses
+        (user_id, username, amount, category, date, currency)
+        VALUES (?, ?, ?, ?, ?, ?)''',
+    'debt': '''INSERT INTO debts
+        (from_user_id, from_username, to_user_id, to_username,
+         amount, description, date, currency)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+}
+
+
+# Строк в одном INSERT. Триггеры индекса поиска (FTS5) сбрасывают его
+# буфер на диск после каждого выражения, поэтому пачка вставляется
+# несколькими многострочными INSERT, а не executemany по строке. Размеры
+# кусков — степени двойки: разных текстов выражений (и подготовленных
+# выражений в кэше соединения) остаётся немного
+INSERT_CHUNK = 256
+
+
+def _insert_sql(kind, count):
+    sql = INSERT_SQL[kind]
+    values = sql[sql.index('VALUES') + len('VALUES'):].strip()
+    return sql + (', ' + values) * (count - 1)
+
+
+def insert_records(conn, kind, rows):
+    start = 0
+    while start < len(rows):
+        size = min(INSERT_CHUNK, 1 << (len(rows) - start).bit_length() - 1)
+        conn.execute(
+            _insert_sql(kind, size),
+            [value for row in rows[start:start + size] for value in row]
+        )
+        start += size
+
+    deltas = {}
+    for row in rows:
+        if kind == 'debt':
+            user_id, amount, category, date = row[0], row[4], '', row[6]
+        else:
+            user_id, _, amount, category, date, _ = row
+        _add_delta(deltas, user_id, kind, category, date, amount, 1, row[-1])
+    _apply_totals(conn, deltas)
+
+
+def add_income(conn, user_id, username, amount, category, date, currency=BASE_CURRENCY):
+    insert_records(conn, 'income', [(user_id, username, amount, category, date, currency)])
+
+
+def add_expense(conn, user_id, username, amount, category, date, currency=BASE_CURRENCY):
+    insert_records(conn, 'expense', [(user_id, username, amount, category, date, currency)])
+
+
+def add_debt(conn, from_user_id, from_username, to_user_id, to_username,
+             amount, description, date, currency=BASE_CURRENCY):
+    insert_records(conn, 'debt', [(
+        from_user_id, from_username, to_user_id, to_username,
+        amount, description, date, currency
+    )])
+
+
+# Бюджеты: лимит категории и потраченное за месяц — поиски по первичным
+# ключам budgets и monthly_totals (по строке на валюту расходов), без
+# суммирования самих расходов. Потраченное пересчитывается в валюту лимита
+_BUDGET_SPENT = '''
+    SELECT b.amount, b.currency,
+           COALESCE(SUM(t.total * r.rate) / lr.rate, 0), lr.rate
+    FROM budgets AS b JOIN rates AS lr ON lr.currency = b.currency
+    LEFT JOIN monthly_totals AS t
+    ON t.user_id = b.user_id AND t.year = ? AND t.month = ?
+    AND t.kind = 'expense' AND t.category = b.category
+    LEFT JOIN rates AS r ON r.currency = t.currency
+    WHERE b.user_id = ? AND b.category = ?
+    GROUP BY b.user_id, b.category'''
+
+
+def budget_checks(conn, rows):
+    # Для каждой строки расходов (как в INSERT_SQL) — (лимит, потрачено за
+    # месяц до записи, после, валюта лимита) или None, если лимита нет.
+    # Вызывается в транзакции вставки после обновления monthly_totals,
+    # поэтому счётчики уже включают эти строки; более ранние строки пакета
+    # той же категории входят в «до»
+    keys = [(row[0], *year_month(row[4]), row[3] or '') for row in rows]
+    spent = {}
+    for key in set(keys):
+        user_id, year, month, category = key
+        found = conn.execute(_BUDGET_SPENT, (year, month, user_id, category)).fetchone()
+        if found is not None:
+            spent[key] = list(found)
+    if not spent:
+        return [None] * len(rows)
+
+    rates = dict(conn.execute('SELECT currency, rate FROM rates'))
+    results = [None] * len(rows)
+    for i in reversed(range(len(rows))):
+        budget = spent.get(keys[i])
+        if budget is not None:
+            limit, currency, after, limit_rate = budget
+            before = after - rows[i][2] * rates[rows[i][5]] / limit_rate
+            results[i] = (limit, round(before), round(after), currency)
+            budget[2] = before
+    return results
+
+
+def set_budget(conn, user_id, category, amount, currency=BASE_CURRENCY):
+    # amount — сотые доли currency, 0 снимает лимит; False, если снимать
+    # было нечего
+    if amount:
+        conn.execute(
+            '''INSERT INTO budgets (user_id, category, amount, currency) VALUES (?, ?, ?, ?)
+            ON CONFLICT (user_id, category) DO UPDATE SET
+            amount = excluded.amount, currency = excluded.currency''',
+            (user_id, category, amount, currency)
+        )
+        return True
+    cursor = conn.execute(
+        'DELETE FROM budgets WHERE user_id = ? AND category = ?',
+        (user_id, category)
+    )
+    return cursor.rowcount > 0
+
+
+def budget_report(conn, user_id, year, month):
+    # [(категория, лимит, потрачено за месяц, валюта лимита)] по всем
+    # лимитам пользователя
+    cursor = conn.execute(
+        '''SELECT b.category, b.amount,
+                  COALESCE(CAST(ROUND(SUM(t.total * r.rate) / lr.rate) AS INTEGER), 0),
+                  b.currency
+        FROM budgets AS b JOIN rates AS lr ON lr.currency = b.currency
+        LEFT JOIN monthly_totals AS t
+        ON t.user_id = b.user_id AND t.year = ? AND t.month = ?
+        AND t.kind = 'expense' AND t.category = b.category
+        LEFT JOIN rates AS r ON r.currency = t.currency
+        WHERE b.user_id = ? GROUP BY b.category ORDER BY b.category''',
+        (year, month, user_id)
+    )
+    return cursor.fetchall()
+
+
+# Регулярные операции
+def add_recurring(conn, user_id, username, kind, amount, category, period, day, next_due,
+                  currency=BASE_CURRENCY):
+    cursor = conn.execute(
+        '''INSERT INTO recurring
+        (user_id, username, kind, amount, category, period, day, next_due, currency)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+        (user_id, username, kind, amount, category, period, day, next_due, currency)
+    )
+    return cursor.lastrowid
+
+
+def recurring_rules(conn, user_id):
+    cursor = conn.execute(
+        '''SELECT id, kind, amount, category, period, day, next_due, currency
+        FROM recurring WHERE user_id = ? ORDER BY id''',
+        (user_id,)
+    )
+    return cursor.fetchall()
+
+
+def delete_recurring(conn, rule_id, user_id):
+    cursor = conn.execute(
+        'DELETE FROM recurring WHERE id = ? AND user_id = ?',
+        (rule_id, user_id)
+    )
+    return cursor.rowcount > 0
+
+
+def materialize_recurring(conn, now, limit):
+    # Создаёт записи по всем наступившим срокам не более чем limit правил
+    # (с самым ранним next_due) и переносит их next_due за now — в одной
+    # транзакции писателя, поэтому после простоя пропущенные сроки
+    # создаются по одному разу, а повторный запуск их не дублирует.
+    # Возвращает ([(user_id, kind, amount, category, currency, [даты])],
+    # есть ли ещё)
+    rules = conn.execute(
+        '''SELECT id, user_id, username, kind, amount, category, period, day, next_due, currency
+        FROM recurring WHERE next_due <= ? ORDER BY next_due LIMIT ?''',
+        (now, limit)
+    ).fetchall()
+
+    rows = {'income': [], 'expense': []}
+    created = []
+    moved = []
+    for rule_id, user_id, username, kind, amount, category, period, day, due, currency in rules:
+        dates = []
+        while due <= now:
+            dates.append(due)
+            due = recurring_due(period, day, due + SECONDS_PER_DAY)
+        rows[kind].extend(
+            (user_id, username, amount, category, date, currency) for date in dates
+        )
+        created.append((user_id, kind, amount, category, currency, dates))
+        moved.append((due, rule_id))
+
+    for kind, kind_rows in rows.items():
+        if kind_rows:
+            insert_records(conn, kind, kind_rows)
+    conn.executemany('UPDATE recurring SET next_due = ? WHERE id = ?', moved)
+    return created, len(rules) == limit
+
+
+def write_batch(conn, batch):
+    # Записи из пакета группируются по таблицам и вставляются
+    # многострочными INSERT в одной транзакции писателя. Возвращает по
+    # элементу на строку пакета: проверку бюджета для расходов (см.
+    # budget_checks), иначе None
+    by_kind = {}
+    for index, (kind, row) in enumerate(batch):
+        by_kind.setdefault(kind, []).append((index, row))
+    results = [None] * len(batch)
+    for kind, items in by_kind.items():
+        rows = [row for _, row in items]
+        insert_records(conn, kind, rows)
+        if kind == 'expense':
+            for (index, _), check in zip(items, budget_checks(conn, rows)):
+                results[index] = check
+    return results
+
+
+class WriteBatcher:
+    # Групповая фиксация: пока писатель занят пакетом, записи от многих
+    # пользователей копятся в буфере, и следующим пакетом (не больше
+    # batch_size строк) пишется всё накопленное одной транзакцией. Если
+    # писатель свободен, запись фиксируется сразу, без ожидания соседей.
+    # submit() возвращает управление только после COMMIT своего пакета.
+
+    def __init__(self, batch_size=WRITE_BATCH_SIZE):
+        self.batch_size = max(1, batch_size)
+        self._pending = []
+        self._has_pending = asyncio.Event()
+        self._closing = False
+        self._task = None
+
+    @property
+    def queue_size(self):
+        return len(self._pending)
+
+    async def submit(self, kind, row):
+        if self._closing:
+            raise RuntimeError('WriteBatcher закрыт')
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((kind, row, future))
+        self._has_pending.set()
+        return await future
+
+    async def close(self):
+        # Дописывает всё, что уже в очереди, и останавливает фоновую задачу
+        self._closing = True
+        self._has_pending.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+
+    async def _run(self):
+        while True:
+            if not self._pending:
+                if self._closing:
+                    return
+                self._has_pending.clear()
+                await self._has_pending.wait()
+                continue
+
+            batch = self._pending[:self.batch_size]
+            del self._pending[:self.batch_size]
+            await self._flush(batch)
+
+    async def _flush(self, batch):
+        loop = asyncio.get_running_loop()
+        rows = [(kind, row) for kind, row, _ in batch]
+        try:
+            results = await loop.run_in_executor(get_executor(), _write, write_batch, (rows,))
+        except Exception as e:
+            if len(batch) > 1:
+                # Повторяем по одной строке, чтобы ошибка досталась только
+                # обработчику, чья запись её вызвала
+                for item in batch:
+                    await self._flush([item])
+                return
+            logger.exception("Не удалось записать строку в %s", rows[0][0])
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, _, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+
+_batcher = None
+
+
+def get_batcher() -> WriteBatcher:
+    global _batcher
+    if _batcher is None:
+        _batcher = WriteBatcher()
+    return _batcher
+
+
+def pending_writes():
+    return _batcher.queue_size if _batcher is not None else 0
+
+
+async def add_record(kind, row):
+    # Ставит запись в очередь групповой фиксации и ждёт, пока пакет будет
+    # записан; для расходов возвращает проверку бюджета (см. budget_checks)
+    return await get_batcher().submit(kind, row)
+
+
+async def close_batcher():
+    global _batcher
+    if _batcher is not None:
+        await _batcher.close()
+        _batcher = None
+
+
+def import_records(conn, user_id, username, rows, seen):
+    # Пачка импорта выписки: rows — [(вид, копейки, категория, секунды)].
+    # Дубликатом считается строка, для которой в БД до начала импорта уже
+    # было столько же записей с теми же (вид, дата, сумма): повторная
+    # загрузка той же выписки ничего не добавит, а две одинаковые покупки
+    # в один день из одного файла сохранятся. seen — общее для всех пачек
+    # импорта состояние: (вид, дата, сумма) -> [строк в файле, записей в БД].
+    by_kind = {}
+    for kind, amount, category, date, currency in rows:
+        by_kind.setdefault(kind, []).append((amount, category, date, currency))
+
+    inserted = {'income': 0, 'expense': 0, 'duplicates': 0}
+    for kind, kind_rows in by_kind.items():
+        table, owner = RECORD_TABLES[kind]
+        dates = [date for _, _, date, _ in kind_rows]
+        existing = {}
+        for key in conn.execute(
+            f'''SELECT date, amount FROM {table}
+            WHERE {owner} = ? AND date >= ? AND date <= ?''',
+            (user_id, min(dates), max(dates))
+        ):
+            existing[key] = existing.get(key, 0) + 1
+
+        new_rows = []
+        for amount, category, date, currency in kind_rows:
+            state = seen.get((kind, date, amount))
+            if state is None:
+                state = seen[(kind, date, amount)] = [0, existing.get((date, amount), 0)]
+            state[0] += 1
+            if state[0] > state[1]:
+                new_rows.append((user_id, username, amount, category, date, currency))
+            else:
+                inserted['duplicates'] += 1
+        if new_rows:
+            insert_records(conn, kind, new_rows)
+        inserted[kind] += len(new_rows)
+    return inserted
+
+
+# Выгрузка: записи каждого вида читаются страницами по (date, id), и вне
+# транзакции каждая страница — свой короткий снимок: долгая выгрузка не
+# держит снимок БД, и checkpoint переносит WAL в файл БД. Запись, добавленная
+# или удалённая во время выгрузки, может попасть в неё или нет. Страницы трёх
+# видов сливаются в одну ленту по дате. Строка ленты:
+# (дата, вид, сумма, категория, кому, описание, погашен, валюта)
+LEDGER_PAGE = 1000
+_LEDGER_COLUMNS = {
+    'income': "date, 'income', amount, category, NULL, NULL, NULL, currency",
+    'expense': "date, 'expense', amount, category, NULL, NULL, NULL, currency",
+    'debt': "date, 'debt', amount, NULL, to_username, description, is_paid, currency",
+}
+
+
+def _ledger_rows(conn, kind, user_id, page):
+    table, owner = RECORD_TABLES[kind]
+    key = ()
+    while True:
+        rows = conn.execute(
+            f'''SELECT {_LEDGER_COLUMNS[kind]}, id FROM {table}
+            WHERE {owner} = ?{' AND (date, id) > (?, ?)' if key else ''}
+            ORDER BY date, id LIMIT ?''',
+            (user_id, *key, page)
+        ).fetchall()
+        for row in rows:
+            yield row[:-1]
+        if len(rows) < page:
+            return
+        key = (rows[-1][0], rows[-1][-1])
+
+
+def ledger(conn, user_id, page=LEDGER_PAGE):
+    return heapq.merge(
+        *(_ledger_rows(conn, kind, user_id, page) for kind in ('income', 'expense', 'debt')),
+        key=lambda row: row[0]
+    )
+
+
+# Удаление записей
+def recent_records(conn, kind, user_id, limit):
+    table, owner = RECORD_TABLES[kind]
+    if kind == 'debt':
+        columns = 'id, amount, to_username, description, date, currency'
+    else:
+        columns = 'id, amount, category, date, currency'
+    cursor = conn.execute(
+        f'''SELECT {columns} FROM {table}
+        WHERE {owner} = ? ORDER BY date DESC LIMIT ?''',
+        (user_id, limit)
+    )
+    return cursor.fetchall()
+
+
+def delete_record(conn, kind, record_id, user_id):
+    table, owner = RECORD_TABLES[kind]
+    if kind == 'debt':
+        columns = "amount, '', date, is_paid, currency"
+    else:
+        columns = 'amount, category, date, 0, currency'
+    record = conn.execute(
+        f'SELECT {columns} FROM {table} WHERE id = ? AND {owner} = ?',
+        (record_id, user_id)
+    ).fetchone()
+    if record is None:
+        return None
+
+    amount, category, date, is_paid, currency = record
+    conn.execute(f'DELETE FROM {table} WHERE id = ?', (record_id,))
+    if not is_paid:
+        _update_totals(conn, user_id, kind, category, date, -amount, -1, currency)
+    # Дата удалённой записи нужна, чтобы сбросить кэш итогов за её месяц
+    return date
+
+
+# Полнотекстовый поиск (таблица records_search, миграция 11). Текст
+# записи — категория, у долга — описание и получатель; «ё» заменяется на
+# «е» и в индексе, и в запросе. Слова запроса ищутся как префиксы:
+# «такс» найдёт «Такси», «обед» — «обеды»
+SEARCH_KINDS = {'income': 1, 'expense': 2, 'debt': 3}
+_SEARCH_KIND_NAMES = {code: kind for kind, code in SEARCH_KINDS.items()}
+MAX_SEARCH_WORDS = 8
+_SEARCH_WORD = re.compile(r'[^\W_]+')
+
+
+def _words(text):
+    return _SEARCH_WORD.findall(text.lower().replace('ё', 'е'))
+
+
+def search_tokens(owner, text):
+    # 1, 'Такси, ночь' -> 'u1xтакси u1xночь'. SQL-функция search_tokens
+    # есть на каждом соединении пула, её вызывают триггеры. Строка
+    # удаляется из индекса по тем же токенам, поэтому после изменения
+    # разбора индекс пересоздаётся: python database.py rebuild-search
+    return ' '.join(f'u{owner}x{word}' for word in _words(text or ''))
+
+
+def search_words(text):
+    # 'Такси, ночь!' -> ['такси', 'ночь']; не больше MAX_SEARCH_WORDS слов
+    return _words(text)[:MAX_SEARCH_WORDS]
+
+
+def _search_values(kind, row=''):
+    # SQL-выражения (rowid, body, month) строки records_search для записи
+    # вида kind; row — 'NEW.'/'OLD.' в триггерах или '' в SELECT
+    table, owner = RECORD_TABLES[kind]
+    if kind == 'debt':
+        text = f"COALESCE({row}description, '') || ' ' || COALESCE({row}to_username, '')"
+    else:
+        text = f'{row}category'
+    return (
+        f'{row}id * 4 + {SEARCH_KINDS[kind]}',
+        f'search_tokens({row}{owner}, {text})',
+        f"'u' || {row}{owner} || 'm' || strftime('%Y%m', {row}date, 'unixepoch')",
+    )
+
+
+def rebuild_search(conn):
+    # Заполняет records_search заново по всем записям
+    conn.execute("INSERT INTO records_search (records_search) VALUES ('delete-all')")
+    for kind in SEARCH_KINDS:
+        table, _ = RECORD_TABLES[kind]
+        conn.execute(
+            f'''INSERT INTO records_search (rowid, body, month)
+            SELECT {', '.join(_search_values(kind))} FROM {table}'''
+        )
+    conn.execute("INSERT INTO records_search (records_search) VALUES ('optimize')")
+
+
+def _search_months(start_date, end_date):
+    # Коды месяцев 'ГГГГММ', которые задевает период [start_date, end_date)
+    months = []
+    year, month = year_month(start_date)
+    last = year_month(end_date - 1)
+    while (year, month) <= last:
+        months.append(f'{year}{month:02d}')
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def search_records(conn, user_id, words, start_date=None, end_date=None, limit=10, offset=0):
+    # Записи пользователя, в тексте которых есть все слова (префиксы) words,
+    # от самых релевантных (bm25), при равной релевантности — добавленные
+    # позже раньше. Строки (вид, id, сумма, категория или описание долга,
+    # получатель долга, дата, валюта) и число всех найденных. Индекс
+    # отдаёт только совпадения пользователя за месяцы периода
+    if not words:
+        return [], 0
+    owner = f'u{int(user_id)}'
+    match = 'body : (' + ' AND '.join(f'"{owner}x{word}"*' for word in words) + ')'
+    if start_date is not None:
+        months = _search_months(start_date, end_date)
+        match += ' AND month : (' + ' OR '.join(f'"{owner}m{code}"' for code in months) + ')'
+
+    date = 'COALESCE(i.date, e.date, d.date)'
+    if start_date is None or _whole_months(start_date, end_date):
+        # Период целиком отобран индексом: сортировка и страница — в FTS5,
+        # записи читаются по id только для строк страницы
+        page = '''SELECT rowid AS key, rank, COUNT(*) OVER () AS total
+            FROM records_search WHERE records_search MATCH ?
+            ORDER BY rank, rowid DESC LIMIT ? OFFSET ?'''
+        where, limits = '', ''
+        params = [match, limit, offset]
+    else:
+        # Скользящее окно: края неполных месяцев отсекаются по дате записи
+        page = '''SELECT rowid AS key, rank, 0 AS total
+            FROM records_search WHERE records_search MATCH ?'''
+        where, limits = f'WHERE {date} >= ? AND {date} < ?', 'LIMIT ? OFFSET ?'
+        params = [match, start_date, end_date, limit, offset]
+
+    # Запись ищется по id в таблице своего вида. LEFT JOIN — один проход по
+    # совпадениям, и SQLite не строит фильтр Блума полным чтением таблиц
+    cursor = conn.execute(
+        f'''WITH page AS MATERIALIZED ({page})
+        SELECT m.key & 3, m.key >> 2,
+               COALESCE(i.amount, e.amount, d.amount),
+               COALESCE(i.category, e.category, d.description),
+               d.to_username, {date},
+               COALESCE(i.currency, e.currency, d.currency),
+               MAX(m.total, COUNT(*) OVER ())
+        FROM page AS m
+        LEFT JOIN incomes AS i ON m.key & 3 = {SEARCH_KINDS['income']} AND i.id = m.key >> 2
+        LEFT JOIN expenses AS e ON m.key & 3 = {SEARCH_KINDS['expense']} AND e.id = m.key >> 2
+        LEFT JOIN debts AS d ON m.key & 3 = {SEARCH_KINDS['debt']} AND d.id = m.key >> 2
+        {where}
+        ORDER BY m.rank, m.key DESC {limits}''',
+        params
+    )
+    rows = cursor.fetchall()
+    total = rows[0][-1] if rows else 0
+    return [(_SEARCH_KIND_NAMES[row[0]],) + row[1:7] for row in rows], total
+
+
+# Состояние диалогов (см. persistence.py). Значения хранятся JSON-строками
+def load_user_data(conn):
+    return conn.execute('SELECT user_id, key, value FROM user_data').fetchall()
+
+
+def load_conversations(conn, name):
+    cursor = conn.execute(
+        'SELECT key, state FROM conversations WHERE name = ?',
+        (name,)
+    )
+    return cursor.fetchall()
+
+
+def save_state(conn, dropped_users, user_rows, conversation_rows):
+    # dropped_users — [user_id], чьи данные удаляются целиком (до остальных
+    # изменений); user_rows — [(user_id, key, value)], conversation_rows —
+    # [(name, key, state)]; None в значении или состоянии удаляет строку
+    conn.executemany(
+        'DELETE FROM user_data WHERE user_id = ?',
+        [(user_id,) for user_id in dropped_users]
+    )
+    conn.executemany(
+        'DELETE FROM user_data WHERE user_id = ? AND key = ?',
+        [(user_id, key) for user_id, key, value in user_rows if value is None]
+    )
+    conn.executemany(
+        '''INSERT INTO user_data (user_id, key, value) VALUES (?, ?, ?)
+        ON CONFLICT (user_id, key) DO UPDATE SET value = excluded.value''',
+        [row for row in user_rows if row[2] is not None]
+    )
+    conn.executemany(
+        'DELETE FROM conversations WHERE name = ? AND key = ?',
+        [(name, key) for name, key, state in conversation_rows if state is None]
+    )
+    conn.executemany(
+        '''INSERT INTO conversations (name, key, state) VALUES (?, ?, ?)
+        ON CONFLICT (name, key) DO UPDATE SET state = excluded.state''',
+        [row for row in conversation_rows if row[2] is not None]
+    )
+
+
+# Курсы валют: рублей за единицу, RUB = 1
+def load_rates(conn, rates):
+    # Записывает курсы {код: курс}; валюты, которых нет в rates, остаются
+    # с прежним курсом — на них могут ссылаться записи. True, если
+    # что-то изменилось
+    before = dict(conn.execute('SELECT currency, rate FROM rates'))
+    changed = [(currency, rate) for currency, rate in rates.items() if before.get(currency) != rate]
+    conn.executemany(
+        '''INSERT INTO rates (currency, rate) VALUES (?, ?)
+        ON CONFLICT (currency) DO UPDATE SET rate = excluded.rate''',
+        changed
+    )
+    return bool(changed)
+
+
+def currency_rates(conn):
+    return dict(conn.execute('SELECT currency, rate FROM rates ORDER BY currency'))
+
+
+# Помесячные итоги
+_TOTALS_SOURCE = '''
+    SELECT user_id,
+           CAST(strftime('%Y', date, 'unixepoch') AS INTEGER) AS year,
+           CAST(strftime('%m', date, 'unixepoch') AS INTEGER) AS month,
+           'income' AS kind, COALESCE(category, '') AS category, currency,
+           SUM(amount) AS total, COUNT(*) AS count
+    FROM incomes GROUP BY 1, 2, 3, 5, 6
+    UNION ALL
+    SELECT user_id,
+           CAST(strftime('%Y', date, 'unixepoch') AS INTEGER),
+           CAST(strftime('%m', date, 'unixepoch') AS INTEGER),
+           'expense', COALESCE(category, ''), currency,
+           SUM(amount), COUNT(*)
+    FROM expenses GROUP BY 1, 2, 3, 5, 6
+    UNION ALL
+    SELECT from_user_id,
+           CAST(strftime('%Y', date, 'unixepoch') AS INTEGER),
+           CAST(strftime('%m', date, 'unixepoch') AS INTEGER),
+           'debt', '', currency,
+           SUM(amount), COUNT(*)
+    FROM debts WHERE is_paid = 0 GROUP BY 1, 2, 3, 6
+'''
+
+
+def _add_delta(deltas, user_id, kind, category, date, amount, count, currency):
+    # date — секунды, amount — сотые доли валюты; amount и count со знаком
+    key = (user_id, *year_month(date), kind, category or '', currency)
+    total = deltas.get(key)
+    if total is None:
+        deltas[key] = [amount, count]
+    else:
+        total[0] += amount
+        total[1] += count
+
+
+def _apply_totals(conn, deltas):
+    conn.executemany(
+        '''INSERT INTO monthly_totals
+        (user_id, year, month, kind, category, currency, total, count)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (user_id, year, month, kind, category, currency) DO UPDATE SET
+        total = total + excluded.total,
+        count = count + excluded.count''',
+        [key + (total, count) for key, (total, count) in deltas.items()]
+    )
+    removed = [key for key, (_, count) in deltas.items() if count < 0]
+    if removed:
+        conn.executemany(
+            '''DELETE FROM monthly_totals
+            WHERE user_id = ? AND year = ? AND month = ? AND kind = ?
+            AND category = ? AND currency = ? AND count <= 0''',
+            removed
+        )
+
+
+def _update_totals(conn, user_id, kind, category, date, amount, count, currency):
+    deltas = {}
+    _add_delta(deltas, user_id, kind, category, date, amount, count, currency)
+    _apply_totals(conn, deltas)
+
+
+def rebuild_monthly_totals(conn):
+    conn.execute('DELETE FROM monthly_totals')
+    conn.execute(
+        '''INSERT INTO monthly_totals
+        (user_id, year, month, kind, category, currency, total, count)
+        ''' + _TOTALS_SOURCE
+    )
+
+
+def check_monthly_totals(conn):
+    # Строки, которые расходятся между monthly_totals и пересчётом по записям
+    cursor = conn.execute(
+        '''SELECT s.user_id, s.year, s.month, s.kind, s.category, s.currency,
+                  s.total, s.count, t.total, t.count
+        FROM (''' + _TOTALS_SOURCE + ''') AS s
+        LEFT JOIN monthly_totals AS t USING (user_id, year, month, kind, category, currency)
+        WHERE t.count IS NULL OR t.count != s.count OR t.total != s.total
+        UNION ALL
+        SELECT t.user_id, t.year, t.month, t.kind, t.category, t.currency,
+               NULL, NULL, t.total, t.count
+        FROM monthly_totals AS t
+        LEFT JOIN (''' + _TOTALS_SOURCE + ''') AS s
+        USING (user_id, year, month, kind, category, currency)
+        WHERE s.count IS NULL'''
+    )
+    return cursor.fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Обслуживание БД бота')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser(
+        'rebuild-totals',
+        help='пересчитать monthly_totals по записям и проверить совпадение'
+    )
+    subparsers.add_parser('rebuild-search', help='пересоздать индекс полнотекстового поиска')
+    load = subparsers.add_parser('load-rates', help='загрузить курсы валют из CSV-файла')
+    load.add_argument('path', nargs='?', default=RATES_PATH)
+    args = parser.parse_args()
+
+    init_db()
+    if args.command == 'load-rates':
+        rates = read_rates(args.path)
+        with get_pool().writer() as conn:
+            changed = load_rates(conn, rates)
+        print(f"Курсов в файле: {len(rates)}, {'обновлены' if changed else 'без изменений'}")
+        mismatches = []
+    elif args.command == 'rebuild-search':
+        with get_pool().writer() as conn:
+            rebuild_search(conn)
+            count = conn.execute('SELECT COUNT(*) FROM records_search').fetchone()[0]
+        print(f'Записей в индексе поиска: {count}')
+        mismatches = []
+    elif args.command == 'rebuild-totals':
+        with get_pool().reader() as conn:
+            mismatches = check_monthly_totals(conn)
+        for row in mismatches:
+            print('Расхождение (пересчёт / monthly_totals):', row)
+        print(f'Расхождений до пересчёта: {len(mismatches)}')
+
+        with get_pool().writer() as conn:
+            rebuild_monthly_totals(conn)
+        with get_pool().reader() as conn:
+            mismatches = check_monthly_totals(conn)
+        print(f'Расхождений после пересчёта: {len(mismatches)}')
+    shutdown()
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,166 @@
+import csv
+import re
+import time
+import zipfile
+from xml.sax.saxutils import escape
+
+import database as db
+from formatting import SECONDS_PER_DAY, money
+
+KIND_TITLES = {'income': 'Доход', 'expense': 'Расход', 'debt': 'Долг'}
+HEADER = ('Тип', 'Дата операции', 'Сумма операции', 'Валюта', 'Категория', 'Кому', 'Описание',
+          'Погашен')
+FORMATS = ('csv', 'xlsx')
+
+# Секунды от 1970-01-01 -> дни от 1899-12-30 (даты в Excel)
+EXCEL_EPOCH_DAYS = 25569
+_CONTROL = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def _text(value):
+    return '' if value is None else str(value)
+
+
+# CSV: «;» и BOM, чтобы Excel с русской локалью открыл файл без мастера
+# импорта; столбцы совпадают с теми, что понимает импорт выписок
+def write_csv(rows, f):
+    writer = csv.writer(f, delimiter=';')
+    writer.writerow(HEADER)
+    for date, kind, amount, category, to_username, description, is_paid, currency in rows:
+        writer.writerow((
+            KIND_TITLES[kind],
+            _date_text(date),
+            money(amount).replace('.', ','),
+            currency,
+            _text(category),
+            _text(to_username),
+            _text(description),
+            '' if is_paid is None else ('да' if is_paid else 'нет'),
+        ))
+
+
+def _date_text(ts):
+    return time.strftime('%d.%m.%Y %H:%M:%S', time.gmtime(ts))
+
+
+# XLSX собирается вручную: лист пишется в zip построчно (zipfile умеет
+# писать элемент архива потоком), строки — inline, без таблицы общих строк
+_CONTENT_TYPES = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>
+<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>
+</Types>'''
+_ROOT_RELS = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>
+</Relationships>'''
+_WORKBOOK = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets><sheet name="Операции" sheetId="1" r:id="rId1"/></sheets>
+</workbook>'''
+_WORKBOOK_RELS = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>
+<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>
+</Relationships>'''
+# Стиль 1 — дата и время, стиль 2 — сумма с копейками
+_STYLES = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<numFmts count="1"><numFmt numFmtId="164" formatCode="dd.mm.yyyy hh:mm"/></numFmts>
+<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>
+<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>
+<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>
+<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>
+<cellXfs count="3">
+<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>
+<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+<xf numFmtId="4" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+</cellXfs>
+</styleSheet>'''
+_SHEET_START = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<cols><col min="1" max="1" width="9"/><col min="2" max="2" width="17"/><col min="3" max="3" width="14"/><col min="4" max="4" width="8"/><col min="5" max="8" width="18"/></cols>
+<sheetData>'''
+_SHEET_END = '</sheetData></worksheet>'
+
+
+def _string_cell(value):
+    if value is None or value == '':
+        return '<c/>'
+    return f'<c t="inlineStr"><is><t>{escape(_CONTROL.sub("", str(value)))}</t></is></c>'
+
+
+def write_xlsx(rows, f):
+    with zipfile.ZipFile(f, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', _CONTENT_TYPES)
+        archive.writestr('_rels/.rels', _ROOT_RELS)
+        archive.writestr('xl/workbook.xml', _WORKBOOK)
+        archive.writestr('xl/_rels/workbook.xml.rels', _WORKBOOK_RELS)
+        archive.writestr('xl/styles.xml', _STYLES)
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as raw:
+            sheet = _Buffered(raw)
+            sheet.write(_SHEET_START)
+            sheet.write('<row>' + ''.join(_string_cell(title) for title in HEADER) + '</row>')
+            for date, kind, amount, category, to_username, description, is_paid, currency in rows:
+                paid = None if is_paid is None else ('да' if is_paid else 'нет')
+                sheet.write(
+                    '<row>'
+                    + _string_cell(KIND_TITLES[kind])
+                    + f'<c s="1"><v>{date / SECONDS_PER_DAY + EXCEL_EPOCH_DAYS!r}</v></c>'
+                    + f'<c s="2"><v>{money(amount)}</v></c>'
+                    + _string_cell(currency)
+                    + _string_cell(category)
+                    + _string_cell(to_username)
+                    + _string_cell(description)
+                    + _string_cell(paid)
+                    + '</row>'
+                )
+            sheet.write(_SHEET_END)
+            sheet.flush()
+
+
+class _Buffered:
+    # Строки листа копятся до ~64 КБ и сжимаются одним куском
+
+    def __init__(self, raw, limit=65536):
+        self.raw = raw
+        self.limit = limit
+        self._parts = []
+        self._size = 0
+
+    def write(self, text):
+        self._parts.append(text)
+        self._size += len(text)
+        if self._size >= self.limit:
+            self.flush()
+
+    def flush(self):
+        if self._parts:
+            self.raw.write(''.join(self._parts).encode('utf-8'))
+            self._parts = []
+            self._size = 0
+
+
+def export_ledger(conn, user_id, file_format, path):
+    # Выполняется в своём потоке на своём соединении (db.read_detached):
+    # страницы записей, генератор строк и запись файла идут одним проходом,
+    # в памяти — только текущие страницы и буферы. Возвращает число
+    # выгруженных записей.
+    count = [0]
+
+    def counted(rows):
+        for row in rows:
+            count[0] += 1
+            yield row
+
+    rows = counted(db.ledger(conn, user_id))
+    if file_format == 'csv':
+        with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+            write_csv(rows, f)
+    else:
+        with open(path, 'wb') as f:
+            write_xlsx(rows, f)
+    return count[0]
@@ -1,19 +1,60 @@
 import logging
-from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
+from telegram import (
+    Update,
+    ReplyKeyboardMarkup,
+    ReplyKeyboardRemove,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup
+)
+from telegram.error import TelegramError
 from telegram.ext import (
     Application,
+    CallbackQueryHandler,
     CommandHandler,
     MessageHandler,
     ConversationHandler,
     ContextTypes,
     filters
 )
-import sqlite3
 from datetime import datetime
 from calendar import month_name
+import asyncio
 import os
-from pathlib import Path
-from dotenv import load_dotenv
+import re
+import tempfile
+
+import charts
+import currencies
+import database as db
+import exporter
+import importer
+import metrics
+import querylog
+import settlement
+from config import (
+    ADMIN_IDS, BOT_MODE, IMPORT_MAX_BYTES, METRICS_LISTEN, METRICS_PORT, RATES_PATH,
+    RECURRING_BATCH_SIZE, RECURRING_INTERVAL, RECURRING_NOTIFY_CONCURRENCY,
+    WEBHOOK_QUEUE_SIZE
+)
+from webhook import WebhookServer, run_webhook
+from persistence import SQLitePersistence
+from scheduler import PerUserUpdateProcessor
+from cache import chart_files, summaries, users, invalidate_record
+from currencies import BASE_CURRENCY, amount_text, label, parse_money
+from formatting import (
+    ROLLING_DAYS,
+    SECONDS_PER_DAY,
+    day_start,
+    format_date,
+    money,
+    month_code,
+    month_end,
+    month_start,
+    now_timestamp,
+    recurring_due,
+    to_timestamp,
+    year_month
+)
 
 # Настройка логгирования
 logging.basicConfig(
@@ -26,11 +67,17 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Получаем абсолютный путь к директории скрипта
-BASE_DIR = Path(__file__).parent
-DB_PATH = os.path.join(BASE_DIR, 'finance.db')
-
-# Состояния ConversationHandler
+# Состояния ConversationHandler; имена — для меток метрик
+STATE_NAMES = [
+    'MAIN_MENU',
+    'INCOME_AMOUNT', 'INCOME_CATEGORY', 'INCOME_CUSTOM_CATEGORY',
+    'EXPENSE_AMOUNT', 'EXPENSE_CATEGORY', 'EXPENSE_CUSTOM_CATEGORY',
+    'DEBT_AMOUNT', 'DEBT_PERSON', 'DEBT_TO_USER', 'DEBT_DESCRIPTION',
+    'STATS_MENU', 'STATS_TYPE', 'STATS_MONTH',
+    'SELECT_MONTH',
+    'DELETE_MENU', 'DELETE_INCOME', 'DELETE_EXPENSE', 'DELETE_DEBT',
+    'PROFILE_MENU',
+]
 (
     MAIN_MENU,
     INCOME_AMOUNT, INCOME_CATEGORY, INCOME_CUSTOM_CATEGORY,
@@ -40,7 +87,7 @@ DB_PATH = os.path.join(BASE_DIR, 'finance.db')
     SELECT_MONTH,
     DELETE_MENU, DELETE_INCOME, DELETE_EXPENSE, DELETE_DEBT,
     PROFILE_MENU
-) = range(20)
+) = range(len(STATE_NAMES))
 
 # Категории и константы
 INCOME_CATEGORIES = ['Зарплата', 'Подарок', 'Перевод', 'Другое']
@@ -49,65 +96,15 @@ RUSSIAN_MONTHS = [
     'Январь', 'Февраль', 'Март', 'Апрель', 'Май', 'Июнь',
     'Июль', 'Август', 'Сентябрь', 'Октябрь', 'Ноябрь', 'Декабрь'
 ]
-CURRENT_YEAR = datetime.now().year
+# Кнопки скользящих окон -> коды периодов
+PERIOD_WINDOWS = {f'{days} дней': code for code, days in ROLLING_DAYS.items()}
+PERIOD_HINT = ('Выберите период или введите месяц и год («03.2023», «март 2023») '
+               'либо год («2023»):')
 RECORDS_PER_PAGE = 5
-
-# Инициализация БД
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        user_id INTEGER PRIMARY KEY,
-        username TEXT UNIQUE,
-        first_name TEXT,
-        last_name TEXT,
-        registration_date TEXT,
-        last_activity TEXT
-    )''')
-    
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS incomes (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER,
-        username TEXT,
-        amount REAL,
-        category TEXT,
-        date TEXT,
-        FOREIGN KEY (user_id) REFERENCES users (user_id)
-    )''')
-    
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS expenses (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER,
-        username TEXT,
-        amount REAL,
-        category TEXT,
-        date TEXT,
-        FOREIGN KEY (user_id) REFERENCES users (user_id)
-    )''')
-    
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS debts (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        from_user_id INTEGER,
-        from_username TEXT,
-        to_user_id INTEGER,
-        to_username TEXT,
-        amount REAL,
-        description TEXT,
-        date TEXT,
-        is_paid INTEGER DEFAULT 0,
-        FOREIGN KEY (from_user_id) REFERENCES users (user_id),
-        FOREIGN KEY (to_user_id) REFERENCES users (user_id)
-    )''')
-    
-    conn.commit()
-    conn.close()
-
-init_db()
+STATS_KINDS = {'Доходы': 'income', 'Расходы': 'expense', 'Долги': 'debt'}
+STATS_TITLES = {kind: title for title, kind in STATS_KINDS.items()}
+STATS_PAGE_SIZE = 20
+AMOUNT_HINT = 'Введите корректную сумму (например: 1500, 1500.50 или 20 USD)'
 
 # Клавиатуры
 def main_menu_keyboard():
@@ -124,7 +121,11 @@ def stats_menu_keyboard():
     )
 
 def months_keyboard():
+    # Год берётся на момент показа: процесс бота живёт дольше одного года
+    year = datetime.now().year
     keyboard = [RUSSIAN_MONTHS[i:i+3] for i in range(0, len(RUSSIAN_MONTHS), 3)]
+    keyboard.append(list(PERIOD_WINDOWS))
+    keyboard.append([f'{year} год', f'{year - 1} год'])
     keyboard.append(['За все время', 'Назад'])
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
 
@@ -143,35 +144,79 @@ def profile_menu_keyboard():
         resize_keyboard=True
     )
 
+# Итоги читаются через кэш; обработчики записи и удаления сбрасывают
+# ровно те записи кэша, которые относятся к изменённому месяцу
+async def read_summary(user_id, view, period_code, func, *args):
+    key = (user_id, view, period_code)
+    value = summaries.get(key)
+    if value is None:
+        version = summaries.version(user_id)
+        value = await db.read(func, *args)
+        summaries.set(key, value, version)
+    return value
+
+# Валюта отчетов пользователя: итоги записей во всех валютах
+# пересчитываются в нее, и в ней же вводятся суммы без указания валюты
+def report_currency(context):
+    return context.user_data.get('currency', BASE_CURRENCY)
+
+def money_input(context, text):
+    # (сотые доли, валюта) из введенной суммы. ValueError — не сумма,
+    # KeyError — курс валюты не загружен
+    amount, currency = parse_money(text)
+    currency = currency or report_currency(context)
+    if currency not in currencies.rates:
+        raise KeyError(currency)
+    return amount, currency
+
+def unknown_currency_text(currency):
+    return (f"Курс валюты {currency} не загружен. "
+            f"Доступные валюты: {', '.join(sorted(currencies.rates))}")
+
 # Регистрация и обновление пользователя
 async def register_user(user):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
     username = f"@{user.username.lower()}" if user.username else None
-    now = datetime.now().isoformat()
     
-    cursor.execute(
-        '''INSERT OR IGNORE INTO users 
-        (user_id, username, first_name, last_name, registration_date, last_activity) 
-        VALUES (?, ?, ?, ?, ?, ?)''',
-        (user.id, username, user.first_name, user.last_name, now, now)
-    )
+    # Если имя и юзернейм не менялись, обновляется только время последней
+    # активности, и то не чаще раза в USER_ACTIVITY_INTERVAL секунд
+    profile = await get_user(user.id)
+    if profile and profile[:3] == (username, user.first_name, user.last_name):
+        if users.activity_due(user.id):
+            await db.write(db.touch_user, user.id, datetime.now().isoformat())
+            users.mark_active(user.id)
+        return username
     
-    cursor.execute(
-        '''UPDATE users SET 
-        username = ?,
-        first_name = ?,
-        last_name = ?,
-        last_activity = ?
-        WHERE user_id = ?''',
-        (username, user.first_name, user.last_name, now, user.id)
+    now = datetime.now().isoformat()
+    registration_date = await db.write(
+        db.upsert_user,
+        user.id, username, user.first_name, user.last_name, now
     )
-    
-    conn.commit()
-    conn.close()
+    users.put(user.id, username, user.first_name, user.last_name, registration_date)
+    users.mark_active(user.id)
     return username
 
+# Пользователи разрешаются через справочник в памяти, БД читается только
+# при промахе: (username, first_name, last_name, registration_date)
+async def get_user(user_id):
+    profile = users.get(user_id)
+    if profile is None:
+        profile = await db.read(db.get_profile, user_id)
+        if profile:
+            users.put(user_id, *profile)
+    return profile
+
+# Возвращает (user_id, first_name, last_name, registration_date) или None
+async def resolve_username(username):
+    found = users.resolve(username)
+    if found is not None:
+        user_id, (_, first_name, last_name, registration_date) = found
+        return user_id, first_name, last_name, registration_date
+    
+    found = await db.read(db.find_by_username, username)
+    if found:
+        users.put(found[0], username, *found[1:])
+    return found
+
 # Основные команды
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user = update.message.from_user
@@ -195,6 +240,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     return MAIN_MENU
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    clear_debt_draft(context)
     await update.message.reply_text(
         'Действие отменено.',
         reply_markup=main_menu_keyboard()
@@ -211,18 +257,9 @@ async def profile_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
 
 async def show_profile(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user = update.message.from_user
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute(
-        '''SELECT username, first_name, last_name, registration_date 
-        FROM users WHERE user_id = ?''',
-        (user.id,)
-    )
-    profile = cursor.fetchone()
+    profile = await get_user(user.id)
     
     if not profile:
-        conn.close()
         await update.message.reply_text(
             'Профиль не найден! Начните с команды /start',
             reply_markup=main_menu_keyboard()
@@ -233,25 +270,10 @@ async def show_profile(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     reg_date = datetime.fromisoformat(reg_date).strftime('%d.%m.%Y %H:%M')
     
     # Получаем статистику
-    cursor.execute(
-        '''SELECT SUM(amount) FROM incomes WHERE user_id = ?''',
-        (user.id,)
+    currency = report_currency(context)
+    total_income, total_expense, total_debts = await read_summary(
+        user.id, 'profile', 'all', db.profile_totals, user.id, currency
     )
-    total_income = cursor.fetchone()[0] or 0
-    
-    cursor.execute(
-        '''SELECT SUM(amount) FROM expenses WHERE user_id = ?''',
-        (user.id,)
-    )
-    total_expense = cursor.fetchone()[0] or 0
-    
-    cursor.execute(
-        '''SELECT SUM(amount) FROM debts WHERE from_user_id = ? AND is_paid = 0''',
-        (user.id,)
-    )
-    total_debts = cursor.fetchone()[0] or 0
-    
-    conn.close()
     
     profile_msg = (
         f"📌 Ваш профиль:\n"
@@ -259,9 +281,9 @@ async def show_profile(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         f"📛 Юзернейм: {username or 'не установлен'}\n"
         f"🆔 ID: {user.id}\n"
         f"📅 Регистрация: {reg_date}\n\n"
-        f"💰 Общие доходы: {total_income:.2f} руб.\n"
-        f"💸 Общие расходы: {total_expense:.2f} руб.\n"
-        f"🧾 Текущие долги: {total_debts:.2f} руб.\n\n"
+        f"💰 Общие доходы: {amount_text(total_income, currency)}\n"
+        f"💸 Общие расходы: {amount_text(total_expense, currency)}\n"
+        f"🧾 Текущие долги: {amount_text(total_debts, currency)}\n\n"
         f"Чтобы другие пользователи могли ссылаться на вас, "
         f"установите username в настройках Telegram"
     )
@@ -287,17 +309,9 @@ async def find_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not username.startswith('@'):
         username = f"@{username}"
     
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
-        '''SELECT user_id, first_name, last_name, registration_date 
-        FROM users WHERE username = ?''',
-        (username,)
-    )
-    found_user = cursor.fetchone()
+    found_user = await resolve_username(username)
     
     if not found_user:
-        conn.close()
         await update.message.reply_text(
             f"Пользователь {username} не найден в системе",
             reply_markup=main_menu_keyboard()
@@ -308,21 +322,10 @@ async def find_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     reg_date = datetime.fromisoformat(reg_date).strftime('%d.%m.%Y')
     
     # Проверяем есть ли долги между пользователями
-    cursor.execute(
-        '''SELECT SUM(amount) FROM debts 
-        WHERE from_user_id = ? AND to_user_id = ? AND is_paid = 0''',
-        (user.id, user_id)
+    currency = report_currency(context)
+    debts_to_user, debts_from_user = await db.read(
+        db.debts_between, user.id, user_id, currency
     )
-    debts_to_user = cursor.fetchone()[0] or 0
-    
-    cursor.execute(
-        '''SELECT SUM(amount) FROM debts 
-        WHERE from_user_id = ? AND to_user_id = ? AND is_paid = 0''',
-        (user_id, user.id)
-    )
-    debts_from_user = cursor.fetchone()[0] or 0
-    
-    conn.close()
     
     response_msg = (
         f"🔍 Найден пользователь:\n"
@@ -333,9 +336,9 @@ async def find_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     
     if debts_to_user > 0:
-        response_msg += f"→ Вы должны ему: {debts_to_user:.2f} руб.\n"
+        response_msg += f"→ Вы должны ему: {amount_text(debts_to_user, currency)}\n"
     if debts_from_user > 0:
-        response_msg += f"← Он должен вам: {debts_from_user:.2f} руб."
+        response_msg += f"← Он должен вам: {amount_text(debts_from_user, currency)}"
     
     if debts_to_user == 0 and debts_from_user == 0:
         response_msg += "Нет активных долгов между вами"
@@ -345,6 +348,188 @@ async def find_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup=main_menu_keyboard()
     )
 
+# Взаимозачёт долгов между пользователями бота
+SETTLE_SHOWN = 30
+
+def settle_name(names, user_id):
+    username, first_name = names.get(user_id, (None, None))
+    return username or first_name or f'id {user_id}'
+
+async def settle(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # /settle — круг пользователя: все, с кем он связан цепочкой долгов;
+    # /settle @a @b — только долги между вами и перечисленными
+    user = update.message.from_user
+    await register_user(user)
+    
+    group = None
+    if context.args:
+        group = {user.id}
+        for name in context.args:
+            username = name.lower() if name.startswith('@') else f"@{name.lower()}"
+            found = await resolve_username(username)
+            if not found:
+                await update.message.reply_text(
+                    f"Пользователь {username} не найден в системе",
+                    reply_markup=main_menu_keyboard()
+                )
+                return
+            group.add(found[0])
+        group = sorted(group)
+    
+    # Долги в разных валютах сводятся в валюте отчетов
+    currency = report_currency(context)
+    balances, max_id = await db.read(
+        db.debt_balances, user.id if group is None else None, group, currency
+    )
+    plan = settlement.transfers(balances)
+    if not plan:
+        await update.message.reply_text(
+            'Нет непогашенных долгов между пользователями бота.',
+            reply_markup=main_menu_keyboard()
+        )
+        return
+    
+    # Свои переводы — первыми
+    plan.sort(key=lambda transfer: user.id not in transfer[:2])
+    shown = plan[:SETTLE_SHOWN]
+    names = await db.read(
+        db.usernames, {user_id for transfer in shown for user_id in transfer[:2]}
+    )
+    balance = balances.get(user.id, 0)
+    if balance > 0:
+        position = f"вам должны {amount_text(balance, currency)}"
+    elif balance < 0:
+        position = f"вы должны {amount_text(-balance, currency)}"
+    else:
+        position = "вы никому не должны"
+    lines = [
+        f"🤝 Взаимозачёт: участников {len(balances)}, переводов {len(plan)}",
+        f"Итого {position}",
+        "",
+        *settle_lines(plan, names, currency),
+    ]
+    if len(plan) > SETTLE_SHOWN:
+        # Предложить можно только план, который виден целиком
+        lines.append("Чтобы предложить взаимозачёт, сузьте круг: /settle @a @b")
+        await update.message.reply_text('\n'.join(lines), reply_markup=main_menu_keyboard())
+        return
+    
+    # Предложение закрывает только долги, учтённые в этом расчёте
+    context.user_data['settle'] = {
+        'group': group, 'max_id': max_id, 'currency': currency, 'plan': plan
+    }
+    await update.message.reply_text(
+        '\n'.join(lines),
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(
+            'Предложить взаимозачёт', callback_data='settle:offer'
+        )]])
+    )
+
+def settle_lines(plan, names, currency):
+    lines = [
+        f"{settle_name(names, debtor)} → {settle_name(names, creditor)}: "
+        f"{amount_text(amount, currency)}"
+        for debtor, creditor, amount in plan[:SETTLE_SHOWN]
+    ]
+    if len(plan) > SETTLE_SHOWN:
+        lines.append(f"… и еще {len(plan) - SETTLE_SHOWN}")
+    return lines
+
+async def notify_settlement(bot, user_ids, text, reply_markup=None):
+    # Как и уведомления о регулярных операциях — не больше
+    # RECURRING_NOTIFY_CONCURRENCY запросов к Bot API одновременно
+    slots = asyncio.Semaphore(RECURRING_NOTIFY_CONCURRENCY)
+    
+    async def send(user_id):
+        async with slots:
+            try:
+                await bot.send_message(user_id, text, reply_markup=reply_markup)
+            except TelegramError as e:
+                logger.warning("Не удалось уведомить %s о взаимозачёте: %s", user_id, e)
+    
+    await asyncio.gather(*(send(user_id) for user_id in user_ids))
+
+async def settle_offer_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # Долги закрываются не сразу: план уходит на подтверждение всем, кому
+    # должны, — получателям переводов и посредникам, чьи долги
+    # взаимозачитываются
+    query = update.callback_query
+    offer = context.user_data.pop('settle', None)
+    if offer is None:
+        await query.answer('Расчет устарел, повторите /settle')
+        return
+    
+    user = query.from_user
+    created = await db.write(
+        db.create_settlement, user.id if offer['group'] is None else None, offer['group'],
+        offer['currency'], offer['max_id'], offer['plan'], now_timestamp()
+    )
+    await query.answer()
+    await query.edit_message_reply_markup(reply_markup=None)
+    if created is None:
+        await query.message.reply_text(
+            'Долги изменились после расчета, повторите /settle',
+            reply_markup=main_menu_keyboard()
+        )
+        return
+    
+    settlement_id, confirmers = created
+    plan = offer['plan']
+    names = await db.read(
+        db.usernames, {user.id, *(user_id for transfer in plan for user_id in transfer[:2])}
+    )
+    await notify_settlement(
+        context.bot, confirmers,
+        '\n'.join([
+            f"🤝 {settle_name(names, user.id)} предлагает взаимозачёт #{settlement_id}:",
+            "",
+            *settle_lines(plan, names, offer['currency']),
+            "",
+            "Вам должны по долгам из этого плана. Подтвердите, когда получите свои "
+            "переводы: после подтверждения всех, кому должны, долги участников "
+            "будут отмечены погашенными.",
+        ]),
+        InlineKeyboardMarkup([[InlineKeyboardButton(
+            'Подтверждаю', callback_data=f'settle:ok:{settlement_id}'
+        )]])
+    )
+    await query.message.reply_text(
+        f"Взаимозачёт #{settlement_id} отправлен на подтверждение: "
+        f"ждем {len(confirmers)} участников, которым должны.",
+        reply_markup=main_menu_keyboard()
+    )
+
+async def settle_confirm_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    settlement_id = int(query.data.rsplit(':', 1)[1])
+    result = await db.write(
+        db.confirm_settlement, settlement_id, query.from_user.id, now_timestamp()
+    )
+    if result is None:
+        await query.answer('Взаимозачёт устарел или уже завершен')
+        await query.edit_message_reply_markup(reply_markup=None)
+        return
+    
+    members, waiting, closed, owners = result
+    await query.answer()
+    await query.edit_message_reply_markup(reply_markup=None)
+    if waiting:
+        await query.message.reply_text(
+            f"Подтверждение принято, ждем еще {waiting}.",
+            reply_markup=main_menu_keyboard()
+        )
+        return
+    
+    if closed is None:
+        text = (f"Взаимозачёт #{settlement_id} отменен: долги изменились после расчета. "
+                f"Повторите /settle")
+    else:
+        # Непогашенные долги входят в итоги владельцев записей
+        for owner in owners:
+            summaries.invalidate_user(owner)
+        text = f"✅ Взаимозачёт #{settlement_id} подтвержден, отмечено погашенными долгов: {closed}."
+    await notify_settlement(context.bot, members, text)
+
 # Доходы
 async def income_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await update.message.reply_text(
@@ -355,12 +540,13 @@ async def income_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
 
 async def income_amount(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
-        amount = float(update.message.text.replace(',', '.'))
+        amount, currency = money_input(context, update.message.text)
         if amount <= 0:
             await update.message.reply_text('Сумма должна быть положительной!')
             return INCOME_AMOUNT
             
         context.user_data['income_amount'] = amount
+        context.user_data['income_currency'] = currency
         await update.message.reply_text(
             'Выберите категорию:',
             reply_markup=ReplyKeyboardMarkup(
@@ -370,7 +556,10 @@ async def income_amount(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
         )
         return INCOME_CATEGORY
     except ValueError:
-        await update.message.reply_text('Введите корректную сумму (например: 1500 или 1500.50)')
+        await update.message.reply_text(AMOUNT_HINT)
+        return INCOME_AMOUNT
+    except KeyError as e:
+        await update.message.reply_text(unknown_currency_text(e.args[0]))
         return INCOME_AMOUNT
 
 async def income_category(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -396,23 +585,20 @@ async def income_custom_category(update: Update, context: ContextTypes.DEFAULT_T
 
 async def save_income(update: Update, context: ContextTypes.DEFAULT_TYPE, category: str):
     amount = context.user_data['income_amount']
+    currency = context.user_data.get('income_currency', BASE_CURRENCY)
     user = update.message.from_user
     username = f"@{user.username.lower()}" if user.username else None
-    current_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    now = datetime.now()
+    current_date = to_timestamp(now)
     
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
-        '''INSERT INTO incomes 
-        (user_id, username, amount, category, date) 
-        VALUES (?, ?, ?, ?, ?)''',
-        (user.id, username, amount, category, current_date)
+    await db.add_record(
+        'income',
+        (user.id, username, amount, category, current_date, currency)
     )
-    conn.commit()
-    conn.close()
+    invalidate_record(user.id, 'income', month_code(current_date))
     
     await update.message.reply_text(
-        f'✅ Доход {amount:.2f} руб. ({category}) от {current_date[:10]} добавлен!',
+        f'✅ Доход {amount_text(amount, currency)} ({category}) от {now:%Y-%m-%d} добавлен!',
         reply_markup=main_menu_keyboard()
     )
 
@@ -426,12 +612,13 @@ async def expense_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
 
 async def expense_amount(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
-        amount = float(update.message.text.replace(',', '.'))
+        amount, currency = money_input(context, update.message.text)
         if amount <= 0:
             await update.message.reply_text('Сумма должна быть положительной!')
             return EXPENSE_AMOUNT
             
         context.user_data['expense_amount'] = amount
+        context.user_data['expense_currency'] = currency
         await update.message.reply_text(
             'Выберите категориу:',
             reply_markup=ReplyKeyboardMarkup(
@@ -441,7 +628,10 @@ async def expense_amount(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         )
         return EXPENSE_CATEGORY
     except ValueError:
-        await update.message.reply_text('Введите корректную сумму (например: 1500 или 1500.50)')
+        await update.message.reply_text(AMOUNT_HINT)
+        return EXPENSE_AMOUNT
+    except KeyError as e:
+        await update.message.reply_text(unknown_currency_text(e.args[0]))
         return EXPENSE_AMOUNT
 
 async def expense_category(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -467,28 +657,109 @@ async def expense_custom_category(update: Update, context: ContextTypes.DEFAULT_
 
 async def save_expense(update: Update, context: ContextTypes.DEFAULT_TYPE, category: str):
     amount = context.user_data['expense_amount']
+    currency = context.user_data.get('expense_currency', BASE_CURRENCY)
     user = update.message.from_user
     username = f"@{user.username.lower()}" if user.username else None
-    current_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    now = datetime.now()
+    current_date = to_timestamp(now)
     
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
-        '''INSERT INTO expenses 
-        (user_id, username, amount, category, date) 
-        VALUES (?, ?, ?, ?, ?)''',
-        (user.id, username, amount, category, current_date)
+    budget = await db.add_record(
+        'expense',
+        (user.id, username, amount, category, current_date, currency)
     )
-    conn.commit()
-    conn.close()
+    invalidate_record(user.id, 'expense', month_code(current_date))
     
     await update.message.reply_text(
-        f'✅ Расход {amount:.2f} руб. ({category}) от {current_date[:10]} добавлен!',
+        f'✅ Расход {amount_text(amount, currency)} ({category}) от {now:%Y-%m-%d} добавлен!'
+        + budget_warning(category, budget),
         reply_markup=main_menu_keyboard()
     )
 
-# Долги
+# Бюджеты: месячные лимиты расходов по категориям
+BUDGET_WARNING_PERCENT = 80
+
+def budget_warning(category, budget):
+    # budget — (лимит, потрачено до записи, после, валюта лимита) из
+    # db.add_record или None. Предупреждение, когда запись перешла
+    # BUDGET_WARNING_PERCENT% лимита; пока лимит исчерпан — на каждый новый расход
+    if budget is None:
+        return ''
+    limit, before, after, currency = budget
+    if after >= limit:
+        state = 'превышен' if after > limit else 'исчерпан'
+        return (f"\n\n🚫 Бюджет «{category}» на месяц {state}: "
+                f"{amount_text(after, currency)} из {amount_text(limit, currency)}")
+    if before * 100 < limit * BUDGET_WARNING_PERCENT <= after * 100:
+        return (f"\n\n⚠️ Потрачено {after * 100 // limit}% бюджета «{category}» на месяц: "
+                f"{amount_text(after, currency)} из {amount_text(limit, currency)}")
+    return ''
+
+async def budget_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # /budget — лимиты и расходы за текущий месяц,
+    # /budget <категория> <сумма> — задать лимит, сумма 0 — снять
+    user = update.message.from_user
+    await register_user(user)
+    
+    if not context.args:
+        year, month = year_month(now_timestamp())
+        rows = await db.read(db.budget_report, user.id, year, month)
+        lines = [f"💰 Бюджеты на {RUSSIAN_MONTHS[month - 1].lower()} {year}:"]
+        for category, limit, spent, currency in rows:
+            mark = '🚫' if spent >= limit else '⚠️' if spent * 100 >= limit * BUDGET_WARNING_PERCENT else '✅'
+            lines.append(
+                f"{mark} {category}: {amount_text(spent, currency)} из {amount_text(limit, currency)} "
+                f"({spent * 100 // limit}%)"
+            )
+        if not rows:
+            lines.append("Лимитов нет.")
+        lines.append("\nЗадать лимит: /budget Еда 15000, снять: /budget Еда 0")
+        await update.message.reply_text('\n'.join(lines), reply_markup=main_menu_keyboard())
+        return
+    
+    try:
+        if len(context.args) < 2:
+            raise ValueError(context.args)
+        amount, currency = money_input(context, context.args[-1])
+        if amount < 0:
+            raise ValueError(amount)
+    except ValueError:
+        await update.message.reply_text(
+            'Использование: /budget <категория> <сумма в месяц>, например /budget Еда 15000',
+            reply_markup=main_menu_keyboard()
+        )
+        return
+    except KeyError as e:
+        await update.message.reply_text(
+            unknown_currency_text(e.args[0]), reply_markup=main_menu_keyboard()
+        )
+        return
+    category = ' '.join(context.args[:-1])
+    # Стандартные категории — в том написании, в котором их сохраняет бот
+    for name in EXPENSE_CATEGORIES:
+        if name.lower() == category.lower():
+            category = name
+    
+    if await db.write(db.set_budget, user.id, category, amount, currency):
+        text = (f"✅ Лимит «{category}»: {amount_text(amount, currency)} в месяц" if amount
+                else f"Лимит «{category}» снят")
+    else:
+        text = f"Лимита «{category}» не было"
+    await update.message.reply_text(text, reply_markup=main_menu_keyboard())
+
+# Долги. Черновик долга в user_data удаляется в начале диалога, после
+# сохранения и при отмене: user_data переживает перезапуск, и получатель
+# прежнего долга не должен достаться долгу на простое имя
+DEBT_DRAFT_KEYS = (
+    'debt_amount', 'debt_currency', 'debt_person',
+    'debt_to_user_id', 'debt_to_username', 'debt_to_name'
+)
+
+def clear_debt_draft(context):
+    for key in DEBT_DRAFT_KEYS:
+        context.user_data.pop(key, None)
+
 async def debt_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    clear_debt_draft(context)
     await update.message.reply_text(
         'Введите сумму долга:',
         reply_markup=ReplyKeyboardRemove()
@@ -497,33 +768,30 @@ async def debt_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
 async def debt_amount(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
-        amount = float(update.message.text.replace(',', '.'))
+        amount, currency = money_input(context, update.message.text)
         if amount <= 0:
             await update.message.reply_text('Сумма должна быть положительной!')
             return DEBT_AMOUNT
             
         context.user_data['debt_amount'] = amount
+        context.user_data['debt_currency'] = currency
         await update.message.reply_text(
             'Введите имя должника или его @юзернейм:',
             reply_markup=back_keyboard()
         )
         return DEBT_PERSON
     except ValueError:
-        await update.message.reply_text('Введите корректную сумму (например: 1500 или 1500.50)')
+        await update.message.reply_text(AMOUNT_HINT)
+        return DEBT_AMOUNT
+    except KeyError as e:
+        await update.message.reply_text(unknown_currency_text(e.args[0]))
         return DEBT_AMOUNT
 
 async def debt_person(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     person = update.message.text
     
     if person.startswith('@'):
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT user_id, first_name FROM users WHERE username = ?",
-            (person.lower(),)
-        )
-        user = cursor.fetchone()
-        conn.close()
+        user = await resolve_username(person.lower())
         
         if user:
             context.user_data['debt_to_user_id'] = user[0]
@@ -546,39 +814,30 @@ async def debt_person(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
 async def save_debt(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     description = update.message.text
     amount = context.user_data['debt_amount']
+    currency = context.user_data.get('debt_currency', BASE_CURRENCY)
     user = update.message.from_user
     username = f"@{user.username.lower()}" if user.username else None
-    current_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    current_date = to_timestamp(datetime.now())
     
     if 'debt_to_user_id' in context.user_data:
-        cursor.execute(
-            '''INSERT INTO debts 
-            (from_user_id, from_username, to_user_id, to_username, 
-             amount, description, date) 
-            VALUES (?, ?, ?, ?, ?, ?, ?)''',
-            (user.id, username, 
-             context.user_data['debt_to_user_id'], context.user_data['debt_to_username'],
-             amount, description, current_date)
-        )
+        to_user_id = context.user_data['debt_to_user_id']
+        to_username = context.user_data['debt_to_username']
         person_info = context.user_data['debt_to_name']
     else:
-        cursor.execute(
-            '''INSERT INTO debts 
-            (from_user_id, from_username, to_username, amount, description, date) 
-            VALUES (?, ?, ?, ?, ?, ?)''',
-            (user.id, username, context.user_data['debt_person'], 
-             amount, description, current_date)
-        )
+        to_user_id = None
+        to_username = context.user_data['debt_person']
         person_info = context.user_data['debt_person']
     
-    conn.commit()
-    conn.close()
+    await db.add_record(
+        'debt',
+        (user.id, username, to_user_id, to_username,
+         amount, description, current_date, currency)
+    )
+    invalidate_record(user.id, 'debt', month_code(current_date))
+    clear_debt_draft(context)
     
     await update.message.reply_text(
-        f'✅ Долг {amount:.2f} руб. ({description})\n'
+        f'✅ Долг {amount_text(amount, currency)} ({description})\n'
         f'Для: {person_info}\n'
         f'Успешно добавлен!',
         reply_markup=main_menu_keyboard()
@@ -601,159 +860,284 @@ async def stats_type(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     
     context.user_data['stats_type'] = stats_type
     await update.message.reply_text(
-        'Выберите месяц:',
+        PERIOD_HINT,
         reply_markup=months_keyboard()
     )
     return STATS_MONTH
 
+# Периоды. Код периода: 'all', 'ГГГГ' (год), 'ГГГГММ' (месяц) или
+# 'd30'/'d90'/'d365' (скользящее окно из последних дней, включая сегодня)
+def parse_period(text):
+    # Код периода по кнопке или введённому тексту, None — не распознан.
+    # Месяц без года — последний такой месяц, не позже текущего
+    text = ' '.join(text.lower().split())
+    if text == 'за все время':
+        return 'all'
+    if text in PERIOD_WINDOWS:
+        return PERIOD_WINDOWS[text]
+    
+    now = datetime.now()
+    match = re.fullmatch(r'(\d{4})(?: год)?', text)
+    if match:
+        year = int(match.group(1))
+        return f"{year}" if 1970 <= year <= 9999 else None
+    match = re.fullmatch(r'(\d{1,2})[./](\d{4})', text)
+    if match:
+        month, year = int(match.group(1)), int(match.group(2))
+    else:
+        match = re.fullmatch(r'([а-яё]+)(?: (\d{4}))?', text)
+        months = [name.lower() for name in RUSSIAN_MONTHS]
+        if not match or match.group(1) not in months:
+            return None
+        month = months.index(match.group(1)) + 1
+        if match.group(2):
+            year = int(match.group(2))
+        else:
+            year = now.year if month <= now.month else now.year - 1
+    if not (1 <= month <= 12 and 1970 <= year <= 9999):
+        return None
+    return f"{year}{month:02d}"
+
+def stats_period(period_code):
+    # (start_date, end_date, подпись); конец периода не включается.
+    # ValueError — некорректный код
+    if period_code == 'all':
+        return None, None, "за все время"
+    if period_code in ROLLING_DAYS:
+        days = ROLLING_DAYS[period_code]
+        end_date = day_start(now_timestamp()) + SECONDS_PER_DAY
+        return end_date - days * SECONDS_PER_DAY, end_date, f"за последние {days} дней"
+    if not period_code.isdigit() or len(period_code) not in (4, 6):
+        raise ValueError(period_code)
+    year = int(period_code[:4])
+    if len(period_code) == 4:
+        return month_start(year, 1), month_start(year + 1, 1), f"за {year} год"
+    month_num = int(period_code[4:])
+    if not 1 <= month_num <= 12:
+        raise ValueError(period_code)
+    return (month_start(year, month_num), month_end(year, month_num),
+            f"за {RUSSIAN_MONTHS[month_num - 1].lower()} {year}")
+
+def render_stats_page(stats_type, period, records, total, currency):
+    # Записи — в своих валютах, итог — в валюте отчетов
+    lines = [f"📊 {stats_type} {period}:\n"]
+    if stats_type == 'Долги':
+        for id, amount, to_user, description, date, record_currency in records:
+            lines.append(
+                f"• {amount_text(amount, record_currency)} для {to_user or description} "
+                f"- {format_date(date)}"
+            )
+    else:
+        for id, amount, category, date, record_currency in records:
+            lines.append(
+                f"• {amount_text(amount, record_currency)} ({category}) - {format_date(date)}"
+            )
+    lines.append(f"\n💰 Итого: {amount_text(total, currency)}")
+    return '\n'.join(lines)
+
+def stats_page_keyboard(kind, period_code, records, has_prev, has_next):
+    # callback_data: stats:<вид>:<период>:<prev|next>:<дата в секундах>:<id>
+    def key(record):
+        # Дата — предпоследний столбец записи, последний — валюта
+        return f"{record[-2]}:{record[0]}"
+
+    buttons = []
+    if has_prev:
+        buttons.append(InlineKeyboardButton(
+            '« Новее', callback_data=f"stats:{kind}:{period_code}:prev:{key(records[0])}"
+        ))
+    if has_next:
+        buttons.append(InlineKeyboardButton(
+            'Старее »', callback_data=f"stats:{kind}:{period_code}:next:{key(records[-1])}"
+        ))
+    rows = [buttons] if buttons else []
+    rows.append([chart_button(kind, period_code)])
+    return InlineKeyboardMarkup(rows)
+
+async def load_stats_page(user_id, kind, period_code, currency, direction=None, key=None):
+    start_date, end_date, period = stats_period(period_code)
+    records, has_more = await db.read(
+        db.stats_page, kind, user_id, start_date, end_date,
+        direction, key, STATS_PAGE_SIZE
+    )
+    total = await read_summary(
+        user_id, f'stats:{kind}', period_code,
+        db.stats_total, kind, user_id, start_date, end_date, currency
+    )
+
+    has_prev = direction == 'next' or (direction == 'prev' and has_more)
+    has_next = direction == 'prev' or (direction != 'prev' and has_more)
+    return records, total, period, has_prev, has_next
+
 async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     selected_month = update.message.text
     if selected_month == 'Назад':
         return await stats_menu(update, context)
-    
+
     stats_type = context.user_data['stats_type']
     user = update.message.from_user
-    
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    if selected_month == 'За все время':
-        if stats_type == 'Доходы':
-            cursor.execute(
-                '''SELECT amount, category, date FROM incomes 
-                WHERE user_id = ? ORDER BY date DESC''',
-                (user.id,)
-            )
-        elif stats_type == 'Расходы':
-            cursor.execute(
-                '''SELECT amount, category, date FROM expenses 
-                WHERE user_id = ? ORDER BY date DESC''',
-                (user.id,)
-            )
-        else:
-            cursor.execute(
-                '''SELECT amount, to_username, description, date 
-                FROM debts WHERE from_user_id = ? ORDER BY date DESC''',
-                (user.id,)
-            )
-        period = "за все время"
-    else:
-        month_num = RUSSIAN_MONTHS.index(selected_month) + 1
-        start_date = f"{CURRENT_YEAR}-{month_num:02d}-01"
-        end_date = f"{CURRENT_YEAR}-{month_num+1:02d}-01" if month_num < 12 else f"{CURRENT_YEAR}-12-31"
-        
-        if stats_type == 'Доходы':
-            cursor.execute(
-                '''SELECT amount, category, date FROM incomes 
-                WHERE user_id = ? AND date >= ? AND date < ? 
-                ORDER BY date DESC''',
-                (user.id, start_date, end_date)
-            )
-        elif stats_type == 'Расходы':
-            cursor.execute(
-                '''SELECT amount, category, date FROM expenses 
-                WHERE user_id = ? AND date >= ? AND date < ? 
-                ORDER BY date DESC''',
-                (user.id, start_date, end_date)
-            )
-        else:
-            cursor.execute(
-                '''SELECT amount, to_username, description, date 
-                FROM debts WHERE from_user_id = ? 
-                AND date >= ? AND date < ? 
-                ORDER BY date DESC''',
-                (user.id, start_date, end_date)
-            )
-        period = f"за {selected_month.lower()} {CURRENT_YEAR}"
-    
-    records = cursor.fetchall()
-    
-    # Получаем сумму
-    if selected_month == 'За все время':
-        if stats_type == 'Доходы':
-            cursor.execute(
-                "SELECT SUM(amount) FROM incomes WHERE user_id = ?",
-                (user.id,)
-            )
-        elif stats_type == 'Расходы':
-            cursor.execute(
-                "SELECT SUM(amount) FROM expenses WHERE user_id = ?",
-                (user.id,)
-            )
-        else:
-            cursor.execute(
-                "SELECT SUM(amount) FROM debts WHERE from_user_id = ?",
-                (user.id,)
-            )
-    else:
-        if stats_type == 'Доходы':
-            cursor.execute(
-                '''SELECT SUM(amount) FROM incomes 
-                WHERE user_id = ? AND date >= ? AND date < ?''',
-                (user.id, start_date, end_date)
-            )
-        elif stats_type == 'Расходы':
-            cursor.execute(
-                '''SELECT SUM(amount) FROM expenses 
-                WHERE user_id = ? AND date >= ? AND date < ?''',
-                (user.id, start_date, end_date)
-            )
-        else:
-            cursor.execute(
-                '''SELECT SUM(amount) FROM debts 
-                WHERE from_user_id = ? AND date >= ? AND date < ?''',
-                (user.id, start_date, end_date)
-            )
-    
-    total = cursor.fetchone()[0] or 0
-    conn.close()
-    
+    kind = STATS_KINDS[stats_type]
+
+    period_code = parse_period(selected_month)
+    if period_code is None:
+        await update.message.reply_text(PERIOD_HINT, reply_markup=months_keyboard())
+        return STATS_MONTH
+
+    currency = report_currency(context)
+    records, total, period, has_prev, has_next = await load_stats_page(
+        user.id, kind, period_code, currency
+    )
+
     if not records:
         await update.message.reply_text(
             f'Нет данных {stats_type.lower()} {period}.',
             reply_markup=stats_menu_keyboard()
         )
         return STATS_MENU
-        
-    message = f"📊 {stats_type} {period}:\n\n"
-    
-    if stats_type == 'Доходы':
-        for amount, category, date in records:
-            date_str = datetime.strptime(date, '%Y-%m-%d %H:%M:%S').strftime('%d.%m.%Y')
-            message += f"• {amount:.2f} руб. ({category}) - {date_str}\n"
-    elif stats_type == 'Расходы':
-        for amount, category, date in records:
-            date_str = datetime.strptime(date, '%Y-%m-%d %H:%M:%S').strftime('%d.%m.%Y')
-            message += f"• {amount:.2f} руб. ({category}) - {date_str}\n"
-    else:
-        for amount, to_user, description, date in records:
-            date_str = datetime.strptime(date, '%Y-%m-%d %H:%M:%S').strftime('%d.%m.%Y')
-            message += f"• {amount:.2f} руб. для {to_user or description} - {date_str}\n"
-    
-    message += f"\n💰 Итого: {total:.2f} руб."
-    
-    # Разбиваем сообщение на части, если оно слишком длинное
-    max_length = 4000
-    if len(message) > max_length:
-        parts = [message[i:i+max_length] for i in range(0, len(message), max_length)]
-        for part in parts[:-1]:
-            await update.message.reply_text(part)
-        await update.message.reply_text(
-            parts[-1],
-            reply_markup=stats_menu_keyboard()
+
+    message = render_stats_page(stats_type, period, records, total, currency)
+    navigation = stats_page_keyboard(kind, period_code, records, has_prev, has_next)
+
+    # Страницы и график — кнопками под сообщением, а обычная клавиатура
+    # меню статистики приходит отдельным сообщением
+    await update.message.reply_text(message, reply_markup=navigation)
+    await update.message.reply_text(
+        'Листайте записи или откройте график кнопками под сообщением.',
+        reply_markup=stats_menu_keyboard()
+    )
+
+    return STATS_MENU
+
+async def stats_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    try:
+        _, kind, period_code, direction, date, record_id = query.data.split(':')
+        key = (int(date), int(record_id))
+        stats_type = STATS_TITLES[kind]
+        stats_period(period_code)
+    except (ValueError, KeyError):
+        await query.answer('Некорректный запрос')
+        return
+
+    currency = report_currency(context)
+    records, total, period, has_prev, has_next = await load_stats_page(
+        query.from_user.id, kind, period_code, currency, direction, key
+    )
+    await query.answer()
+
+    if not records:
+        await query.edit_message_text(f'Нет данных {stats_type.lower()} {period}.')
+        return
+
+    await query.edit_message_text(
+        render_stats_page(stats_type, period, records, total, currency),
+        reply_markup=stats_page_keyboard(kind, period_code, records, has_prev, has_next)
+    )
+
+# Поиск
+SEARCH_PAGE_SIZE = 10
+SEARCH_KIND_TITLES = {'income': 'Доход', 'expense': 'Расход', 'debt': 'Долг'}
+SEARCH_HINT = (
+    "Поиск по категориям доходов и расходов, описаниям и получателям долгов:\n"
+    "/search <слова> [период]\n"
+    "например: /search такси, /search такси март 2024, /search обед 90 дней\n"
+    "Слова ищутся по началу: «такс» найдет «Такси»."
+)
+
+def parse_search(args):
+    # args после /search -> (текст запроса, код периода); период — одно
+    # или два последних слова, если parse_period их распознает
+    for size in (2, 1):
+        if len(args) > size:
+            period_code = parse_period(' '.join(args[-size:]))
+            if period_code is not None:
+                return ' '.join(args[:-size]), period_code
+    return ' '.join(args), 'all'
+
+def render_search_page(words, period, records, total, page):
+    pages = (total + SEARCH_PAGE_SIZE - 1) // SEARCH_PAGE_SIZE
+    lines = [f"🔎 «{' '.join(words)}» {period}: найдено {total}, страница {page + 1} из {pages}\n"]
+    for kind, id, amount, text, to_user, date, currency in records:
+        if kind == 'debt' and to_user:
+            text = f"для {to_user}: {text}" if text else f"для {to_user}"
+        lines.append(
+            f"• {amount_text(amount, currency)} {SEARCH_KIND_TITLES[kind]} ({text}) "
+            f"- {format_date(date)}"
         )
-    else:
+    return '\n'.join(lines)
+
+def search_page_keyboard(page, total):
+    # callback_data: search:<номер страницы>; запрос — в user_data['search']
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton('« Назад', callback_data=f"search:{page - 1}"))
+    if (page + 1) * SEARCH_PAGE_SIZE < total:
+        buttons.append(InlineKeyboardButton('Дальше »', callback_data=f"search:{page + 1}"))
+    return InlineKeyboardMarkup([buttons]) if buttons else None
+
+async def load_search_page(user_id, words, period_code, page):
+    start_date, end_date, period = stats_period(period_code)
+    records, total = await db.read(
+        db.search_records, user_id, words, start_date, end_date,
+        SEARCH_PAGE_SIZE, page * SEARCH_PAGE_SIZE
+    )
+    return records, total, period
+
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # /search <слова> [период] — записи пользователя, самые подходящие первыми
+    user = update.message.from_user
+    await register_user(user)
+    
+    text, period_code = parse_search(context.args or [])
+    words = db.search_words(text)
+    if not words:
+        await update.message.reply_text(SEARCH_HINT, reply_markup=main_menu_keyboard())
+        return
+    
+    records, total, period = await load_search_page(user.id, words, period_code, 0)
+    if not records:
         await update.message.reply_text(
-            message,
-            reply_markup=stats_menu_keyboard()
+            f"🔎 По запросу «{' '.join(words)}» {period} ничего не найдено.",
+            reply_markup=main_menu_keyboard()
         )
+        return
     
-    return STATS_MENU
+    # Страницы листаются кнопками, запрос для них хранится в user_data
+    context.user_data['search'] = {'words': words, 'period': period_code}
+    await update.message.reply_text(
+        render_search_page(words, period, records, total, 0),
+        reply_markup=search_page_keyboard(0, total)
+    )
+
+async def search_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    search = context.user_data.get('search')
+    try:
+        page = int(query.data.split(':')[1])
+        if search is None or page < 0:
+            raise ValueError(query.data)
+    except (ValueError, IndexError):
+        await query.answer('Поиск устарел, повторите /search')
+        return
+
+    records, total, period = await load_search_page(
+        query.from_user.id, search['words'], search['period'], page
+    )
+    await query.answer()
+
+    if not records:
+        await query.edit_message_text(f"🔎 По запросу «{' '.join(search['words'])}» больше ничего нет.")
+        return
+
+    await query.edit_message_text(
+        render_search_page(search['words'], period, records, total, page),
+        reply_markup=search_page_keyboard(page, total)
+    )
 
 # Финансы (краткие итоги)
 async def show_finances_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await update.message.reply_text(
-        'Выберите месяц для просмотра статистики:',
+        PERIOD_HINT,
         reply_markup=months_keyboard()
     )
     return SELECT_MONTH
@@ -769,57 +1153,183 @@ async def show_finances(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
         )
         return MAIN_MENU
     
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    period_code = parse_period(selected_month)
+    if period_code is None:
+        await update.message.reply_text(PERIOD_HINT, reply_markup=months_keyboard())
+        return SELECT_MONTH
+    start_date, end_date, period = stats_period(period_code)
     
-    if selected_month == 'За все время':
-        income_query = "SELECT SUM(amount) FROM incomes WHERE user_id = ?"
-        expense_query = "SELECT SUM(amount) FROM expenses WHERE user_id = ?"
-        debt_query = "SELECT SUM(amount) FROM debts WHERE from_user_id = ? AND is_paid = 0"
-        params = (user.id,)
-        period = "за все время"
-    else:
-        month_num = RUSSIAN_MONTHS.index(selected_month) + 1
-        start_date = f"{CURRENT_YEAR}-{month_num:02d}-01"
-        end_date = f"{CURRENT_YEAR}-{month_num+1:02d}-01" if month_num < 12 else f"{CURRENT_YEAR}-12-31"
-        
-        income_query = """
-            SELECT SUM(amount) FROM incomes 
-            WHERE user_id = ? AND date >= ? AND date < ?
-        """
-        expense_query = """
-            SELECT SUM(amount) FROM expenses 
-            WHERE user_id = ? AND date >= ? AND date < ?
-        """
-        debt_query = """
-            SELECT SUM(amount) FROM debts 
-            WHERE from_user_id = ? AND is_paid = 0 AND date >= ? AND date < ?
-        """
-        params = (user.id, start_date, end_date)
-        period = f"за {selected_month.lower()} {CURRENT_YEAR}"
-    
-    cursor.execute(income_query, params)
-    total_income = cursor.fetchone()[0] or 0
-    
-    cursor.execute(expense_query, params)
-    total_expense = cursor.fetchone()[0] or 0
-    
-    cursor.execute(debt_query, params)
-    total_debts = cursor.fetchone()[0] or 0
-    
-    conn.close()
+    currency = report_currency(context)
+    total_income, total_expense, total_debts = await read_summary(
+        user.id, 'finances', period_code,
+        db.finance_totals, user.id, start_date, end_date, currency
+    )
     
     await update.message.reply_text(
         f'📊 <b>Финансы {period}</b>\n\n'
-        f'💰 Доходы: {total_income:.2f} руб.\n'
-        f'💸 Расходы: {total_expense:.2f} руб.\n'
-        f'📉 Баланс: {total_income - total_expense:.2f} руб.\n'
-        f'🧾 Долги: {total_debts:.2f} руб.',
+        f'💰 Доходы: {amount_text(total_income, currency)}\n'
+        f'💸 Расходы: {amount_text(total_expense, currency)}\n'
+        f'📉 Баланс: {amount_text(total_income - total_expense, currency)}\n'
+        f'🧾 Долги: {amount_text(total_debts, currency)}',
         parse_mode='HTML',
+        reply_markup=InlineKeyboardMarkup([[chart_button('finances', period_code)]])
+    )
+    await update.message.reply_text(
+        'График доходов и расходов по месяцам — кнопкой под сообщением.',
         reply_markup=main_menu_keyboard()
     )
     return MAIN_MENU
 
+# Графики. Картинка рисуется в пуле процессов по помесячным итогам, а её
+# file_id запоминается до изменения данных пользователя: повторный показ
+# не читает БД, не рисует и не загружает файл заново
+CHART_MONTHS = 12
+CHART_TITLES = {
+    'income': 'Доходы', 'expense': 'Расходы', 'debt': 'Непогашенные долги',
+    'finances': 'Доходы и расходы',
+}
+
+def chart_button(chart, period_code):
+    return InlineKeyboardButton('📊 График', callback_data=f'chart:{chart}:{period_code}')
+
+def chart_months(period_code):
+    # CHART_MONTHS месяцев (год, месяц), последний — выбранный, последний
+    # месяц выбранного года или текущий
+    if period_code == 'all' or period_code in ROLLING_DAYS:
+        year, month = year_month(now_timestamp())
+    elif len(period_code) == 4:
+        year, month = int(period_code), 12
+    else:
+        year, month = int(period_code[:4]), int(period_code[4:])
+    months = []
+    for _ in range(CHART_MONTHS):
+        months.append((year, month))
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    return months[::-1]
+
+async def render_chart(user_id, chart, period_code, currency):
+    # (PNG, подпись) или (None, None), если рисовать нечего; суммы — в
+    # валюте отчетов
+    loop = asyncio.get_running_loop()
+    if chart in ('income', 'expense'):
+        # Доли категорий; мелкие сверх палитры сводятся в «Прочее»
+        start_date, end_date, period = stats_period(period_code)
+        rows = await db.read(
+            db.category_totals, user_id, chart, start_date, end_date, currency
+        )
+        if not rows:
+            return None, None
+        slices = len(charts.PALETTE)
+        if len(rows) > slices:
+            rows = rows[:slices - 1] + [('Прочее', sum(total for _, total in rows[slices - 1:]))]
+        total = sum(amount for _, amount in rows)
+        lines = [f"📊 {CHART_TITLES[chart]} {period} по категориям:"]
+        for (square, _), (category, amount) in zip(charts.PALETTE, rows):
+            lines.append(
+                f"{square} {category or 'Без категории'}: {amount_text(amount, currency)} "
+                f"({amount * 100 / total:.0f}%)"
+            )
+        png = await loop.run_in_executor(
+            charts.get_pool(), charts.pie, [amount for _, amount in rows]
+        )
+        return png, '\n'.join(lines)
+    
+    # Столбцы по месяцам: доходы и расходы или непогашенные долги
+    months = chart_months(period_code)
+    totals = await db.read(db.month_totals, user_id, months[0], months[-1], currency)
+    if chart == 'finances':
+        legend = [('income', charts.INCOME_COLOR), ('expense', charts.EXPENSE_COLOR)]
+    else:
+        legend = [('debt', charts.DEBT_COLOR)]
+    series = [[totals.get((year, month, kind), 0) for year, month in months] for kind, _ in legend]
+    if not any(any(values) for values in series):
+        return None, None
+    
+    lines = [
+        f"📈 {CHART_TITLES[chart]} по месяцам, {label(currency)}, "
+        f"{months[0][1]:02d}.{months[0][0]} – {months[-1][1]:02d}.{months[-1][0]}:"
+    ]
+    for i, (year, month) in enumerate(months):
+        amounts = ' · '.join(
+            f"{square} {money(values[i])}" for values, (_, (square, _)) in zip(series, legend)
+        )
+        lines.append(f"{month:02d}.{year}: {amounts}")
+    png = await loop.run_in_executor(
+        charts.get_pool(), charts.bars, series, [color for _, (_, color) in legend]
+    )
+    return png, '\n'.join(lines)
+
+async def chart_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # callback_data: chart:<income|expense|debt|finances>:<период>
+    query = update.callback_query
+    try:
+        _, chart, period_code = query.data.split(':')
+        if chart not in CHART_TITLES:
+            raise ValueError(chart)
+        stats_period(period_code)
+    except (ValueError, IndexError):
+        await query.answer('Некорректный запрос')
+        return
+    
+    user_id = query.from_user.id
+    # Версия данных берётся до чтения итогов, как в read_summary; периоды,
+    # которые отсчитываются от сегодняшнего дня, кэшируются до конца дня
+    today = day_start(now_timestamp()) if period_code == 'all' or period_code in ROLLING_DAYS else None
+    key = (user_id, chart, period_code, summaries.version(user_id), today)
+    await query.answer()
+    cached = chart_files.get(key)
+    if cached is not None:
+        file_id, caption = cached
+        await query.message.reply_photo(file_id, caption=caption)
+        return
+    
+    png, caption = await render_chart(user_id, chart, period_code, report_currency(context))
+    if png is None:
+        await query.message.reply_text('Нет данных для графика за этот период.')
+        return
+    message = await query.message.reply_photo(png, caption=caption)
+    chart_files.set(key, (message.photo[-1].file_id, caption))
+
+# Аналитика: скользящие окна и баланс нарастающим итогом
+async def analytics(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # /analytics — последние 12 месяцев, /analytics 2023 — месяцы года
+    user = update.message.from_user
+    await register_user(user)
+    
+    now = now_timestamp()
+    if context.args:
+        if not (len(context.args) == 1 and context.args[0].isdigit() and len(context.args[0]) == 4):
+            await update.message.reply_text(
+                'Использование: /analytics или /analytics ГГГГ',
+                reply_markup=main_menu_keyboard()
+            )
+            return
+        first = (int(context.args[0]), 1)
+    else:
+        year, month = year_month(now)
+        first = (year - 1, month + 1) if month < 12 else (year, 1)
+    
+    currency = report_currency(context)
+    end_date = day_start(now) + SECONDS_PER_DAY
+    windows = await db.read(
+        db.rolling_totals, user.id, end_date, tuple(ROLLING_DAYS.values()), currency
+    )
+    series = await db.read(db.balance_series, user.id, first, CHART_MONTHS, currency)
+    
+    lines = ["📈 Аналитика", "", "Скользящие окна (включая сегодня):"]
+    for days, (income, expense) in windows.items():
+        lines.append(
+            f"{days} дн.: доходы {money(income)}, расходы {money(expense)}, "
+            f"итог {amount_text(income - expense, currency)}, "
+            f"в среднем расходы {amount_text(expense // days, currency)}/день"
+        )
+    lines += ["", "Баланс на конец месяца (доходы − расходы за всю историю):"]
+    for year, month, income, expense, balance in series:
+        lines.append(
+            f"{month:02d}.{year}: +{money(income)} −{money(expense)} → {amount_text(balance, currency)}"
+        )
+    await update.message.reply_text('\n'.join(lines), reply_markup=main_menu_keyboard())
+
 # Удаление записей
 async def delete_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await update.message.reply_text(
@@ -830,16 +1340,7 @@ async def delete_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
 
 async def delete_incomes(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user = update.message.from_user
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute(
-        '''SELECT id, amount, category, date FROM incomes 
-        WHERE user_id = ? ORDER BY date DESC LIMIT ?''',
-        (user.id, RECORDS_PER_PAGE)
-    )
-    incomes = cursor.fetchall()
-    conn.close()
+    incomes = await db.read(db.recent_records, 'income', user.id, RECORDS_PER_PAGE)
     
     if not incomes:
         await update.message.reply_text(
@@ -850,9 +1351,8 @@ async def delete_incomes(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
     keyboard = []
     for income in incomes:
-        id, amount, category, date = income
-        date_str = datetime.strptime(date, '%Y-%m-%d %H:%M:%S').strftime('%d.%m.%Y')
-        text = f"{amount} руб. ({category}) {date_str}"
+        id, amount, category, date, currency = income
+        text = f"{amount_text(amount, currency)} ({category}) {format_date(date)}"
         keyboard.append([f"Удалить доход #{id}: {text}"])
     
     keyboard.append(['Назад'])
@@ -878,18 +1378,10 @@ async def delete_income_record(update: Update, context: ContextTypes.DEFAULT_TYP
         return DELETE_INCOME
     
     user = update.message.from_user
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute(
-        'DELETE FROM incomes WHERE id = ? AND user_id = ?',
-        (income_id, user.id)
-    )
-    deleted = cursor.rowcount
-    conn.commit()
-    conn.close()
+    deleted = await db.write(db.delete_record, 'income', income_id, user.id)
     
-    if deleted > 0:
+    if deleted:
+        invalidate_record(user.id, 'income', month_code(deleted))
         await update.message.reply_text(
             'Доход успешно удален!',
             reply_markup=delete_menu_keyboard()
@@ -904,16 +1396,7 @@ async def delete_income_record(update: Update, context: ContextTypes.DEFAULT_TYP
 
 async def delete_expenses(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user = update.message.from_user
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute(
-        '''SELECT id, amount, category, date FROM expenses 
-        WHERE user_id = ? ORDER BY date DESC LIMIT ?''',
-        (user.id, RECORDS_PER_PAGE)
-    )
-    expenses = cursor.fetchall()
-    conn.close()
+    expenses = await db.read(db.recent_records, 'expense', user.id, RECORDS_PER_PAGE)
     
     if not expenses:
         await update.message.reply_text(
@@ -924,9 +1407,8 @@ async def delete_expenses(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
     keyboard = []
     for expense in expenses:
-        id, amount, category, date = expense
-        date_str = datetime.strptime(date, '%Y-%m-%d %H:%M:%S').strftime('%d.%m.%Y')
-        text = f"{amount} руб. ({category}) {date_str}"
+        id, amount, category, date, currency = expense
+        text = f"{amount_text(amount, currency)} ({category}) {format_date(date)}"
         keyboard.append([f"Удалить расход #{id}: {text}"])
     
     keyboard.append(['Назад'])
@@ -952,18 +1434,10 @@ async def delete_expense_record(update: Update, context: ContextTypes.DEFAULT_TY
         return DELETE_EXPENSE
     
     user = update.message.from_user
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute(
-        'DELETE FROM expenses WHERE id = ? AND user_id = ?',
-        (expense_id, user.id)
-    )
-    deleted = cursor.rowcount
-    conn.commit()
-    conn.close()
+    deleted = await db.write(db.delete_record, 'expense', expense_id, user.id)
     
-    if deleted > 0:
+    if deleted:
+        invalidate_record(user.id, 'expense', month_code(deleted))
         await update.message.reply_text(
             'Расход успешно удален!',
             reply_markup=delete_menu_keyboard()
@@ -978,16 +1452,7 @@ async def delete_expense_record(update: Update, context: ContextTypes.DEFAULT_TY
 
 async def delete_debts(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user = update.message.from_user
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute(
-        '''SELECT id, amount, to_username, description, date FROM debts 
-        WHERE from_user_id = ? ORDER BY date DESC LIMIT ?''',
-        (user.id, RECORDS_PER_PAGE)
-    )
-    debts = cursor.fetchall()
-    conn.close()
+    debts = await db.read(db.recent_records, 'debt', user.id, RECORDS_PER_PAGE)
     
     if not debts:
         await update.message.reply_text(
@@ -998,9 +1463,8 @@ async def delete_debts(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     
     keyboard = []
     for debt in debts:
-        id, amount, to_user, description, date = debt
-        date_str = datetime.strptime(date, '%Y-%m-%d %H:%M:%S').strftime('%d.%m.%Y')
-        text = f"{amount} руб. ({to_user or description}) {date_str}"
+        id, amount, to_user, description, date, currency = debt
+        text = f"{amount_text(amount, currency)} ({to_user or description}) {format_date(date)}"
         keyboard.append([f"Удалить долг #{id}: {text}"])
     
     keyboard.append(['Назад'])
@@ -1026,18 +1490,10 @@ async def delete_debt_record(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return DELETE_DEBT
     
     user = update.message.from_user
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    deleted = await db.write(db.delete_record, 'debt', debt_id, user.id)
     
-    cursor.execute(
-        'DELETE FROM debts WHERE id = ? AND from_user_id = ?',
-        (debt_id, user.id)
-    )
-    deleted = cursor.rowcount
-    conn.commit()
-    conn.close()
-    
-    if deleted > 0:
+    if deleted:
+        invalidate_record(user.id, 'debt', month_code(deleted))
         await update.message.reply_text(
             'Долг успешно удален!',
             reply_markup=delete_menu_keyboard()
@@ -1050,19 +1506,443 @@ async def delete_debt_record(update: Update, context: ContextTypes.DEFAULT_TYPE)
     
     return DELETE_MENU
 
-# Запуск бота
-def main() -> None:
-    # Загружаем переменные из файла .env
-    load_dotenv()
+# Импорт банковских выписок
+async def import_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(
+        'Отправьте выписку из банка CSV-файлом. Нужны столбцы с датой и суммой '
+        'операции («Дата операции», «Сумма операции»), по возможности — с категорией.\n'
+        'Доход или расход определяется по столбцу типа операции или по знаку суммы, '
+        'валюта — по столбцу «Валюта», без него суммы считаются в валюте отчетов (/currency). '
+        'Операции, которые уже есть в учете, повторно не добавляются.',
+        reply_markup=main_menu_keyboard()
+    )
+
+async def import_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    document = update.message.document
+    user = update.message.from_user
+    if document.file_size and document.file_size > IMPORT_MAX_BYTES:
+        await update.message.reply_text(
+            f'Файл слишком большой: не больше {IMPORT_MAX_BYTES // (1024 * 1024)} МБ.'
+        )
+        return
     
-    # Получаем токен из переменных окружения
-    token = os.getenv('BOT_TOKEN')
-    if token is None:
-        raise ValueError("Токен бота не найден! Проверьте файл .env")
+    username = await register_user(user)
+    await update.message.reply_text('Загружаю выписку...')
+    
+    with tempfile.TemporaryDirectory(prefix='finance-import-') as directory:
+        path = os.path.join(directory, 'statement.csv')
+        telegram_file = await document.get_file()
+        await telegram_file.download_to_drive(path)
+        try:
+            result = await importer.import_statement(
+                path, user.id, username, currency=report_currency(context)
+            )
+        except importer.StatementError as e:
+            await update.message.reply_text(
+                f'Не удалось разобрать выписку: {e}. Подробнее: /import',
+                reply_markup=main_menu_keyboard()
+            )
+            return
+        finally:
+            # Записи могли попасть в любые месяцы
+            summaries.invalidate_user(user.id)
     
-    logger.info("Запуск бота...")
+    await update.message.reply_text(
+        f"✅ Импорт завершен: доходов добавлено {result['income']}, "
+        f"расходов {result['expense']}.\n"
+        f"Уже были в учете: {result['duplicates']}, "
+        f"не распознано строк: {result['skipped']}.",
+        reply_markup=main_menu_keyboard()
+    )
+
+# Выгрузка всех записей файлом
+# Предельный размер файла, который бот может отправить через Bot API
+MAX_UPLOAD_BYTES = 50 * 1024 * 1024
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # /export [xlsx|csv]
+    user = update.message.from_user
+    args = context.args or []
+    file_format = args[0].lower() if args and args[0].lower() in exporter.FORMATS else 'xlsx'
+    
+    await update.message.reply_text('Готовлю выгрузку...')
+    with tempfile.TemporaryDirectory(prefix='finance-export-') as directory:
+        path = os.path.join(directory, f'finance.{file_format}')
+        # Файл пишется в отдельном потоке на своём соединении: цикл событий,
+        # потоки и соединения пула БД остаются свободны
+        count = await db.read_detached(exporter.export_ledger, user.id, file_format, path)
+        if not count:
+            await update.message.reply_text(
+                'Пока нечего выгружать: записей нет.',
+                reply_markup=main_menu_keyboard()
+            )
+            return
+        if os.path.getsize(path) > MAX_UPLOAD_BYTES:
+            await update.message.reply_text(
+                'Выгрузка больше 50 МБ, Telegram не примет такой файл.',
+                reply_markup=main_menu_keyboard()
+            )
+            return
+        
+        with open(path, 'rb') as f:
+            await update.message.reply_document(
+                f,
+                filename=f'finance-{datetime.now():%Y-%m-%d}.{file_format}',
+                caption=f'Записей: {count}',
+                reply_markup=main_menu_keyboard()
+            )
+
+# Валюты и курсы
+async def currency_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # /currency — валюта отчетов, /currency USD — сменить
+    user = update.message.from_user
+    current = report_currency(context)
+    if not context.args:
+        await update.message.reply_text(
+            f"Валюта отчетов: {current}. Итоги записей во всех валютах пересчитываются "
+            f"в нее по курсам (/rates), в ней же вводятся суммы без указания валюты.\n"
+            f"Сумму в другой валюте можно ввести так: «20 USD» или «$20».\n"
+            f"Доступные валюты: {', '.join(sorted(currencies.rates))}\n"
+            f"Сменить: /currency USD",
+            reply_markup=main_menu_keyboard()
+        )
+        return
+    
+    currency = currencies.normalize(' '.join(context.args))
+    if currency not in currencies.rates:
+        await update.message.reply_text(
+            unknown_currency_text(currency or ' '.join(context.args)),
+            reply_markup=main_menu_keyboard()
+        )
+        return
+    context.user_data['currency'] = currency
+    # Итоги и графики в кэше посчитаны в прежней валюте
+    if currency != current:
+        summaries.invalidate_user(user.id)
+    await update.message.reply_text(
+        f"✅ Валюта отчетов: {currency}", reply_markup=main_menu_keyboard()
+    )
+
+async def load_rates() -> bool:
+    # Курсы из RATES_PATH -> таблица rates и currencies.rates. Пересчитанные
+    # по старым курсам итоги и графики сбрасываются. True, если курсы изменились
+    rates = await asyncio.get_running_loop().run_in_executor(
+        None, currencies.read_rates, RATES_PATH
+    )
+    changed = await db.write(db.load_rates, rates)
+    currencies.rates = await db.read(db.currency_rates)
+    if changed:
+        summaries.clear()
+        chart_files.clear()
+    return changed
+
+async def rates_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # /rates — курсы к рублю, /rates reload — перечитать файл курсов (администраторы)
+    args = context.args or []
+    if args and args[0].lower() == 'reload':
+        if update.message.from_user.id not in ADMIN_IDS:
+            return
+        try:
+            changed = await load_rates()
+        except (OSError, ValueError) as e:
+            await update.message.reply_text(f'Не удалось загрузить курсы: {e}')
+            return
+        await update.message.reply_text(
+            f"✅ Курсы загружены, валют: {len(currencies.rates)}"
+            + ('' if changed else ' (без изменений)')
+        )
+        return
+    
+    lines = ["💱 Курсы валют, рублей за единицу:"]
+    for currency, rate in sorted(currencies.rates.items()):
+        if currency != BASE_CURRENCY:
+            lines.append(f"{currency}: {rate:g}")
+    if len(lines) == 1:
+        lines.append("Загружен только рубль.")
+    await update.message.reply_text('\n'.join(lines), reply_markup=main_menu_keyboard())
+
+# Администрирование
+async def admin_queries(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # /admin_queries [N] [total|max|count] [reset] — самые дорогие
+    # SQL-выражения; reset после вывода обнуляет счётчики
+    if update.message.from_user.id not in ADMIN_IDS:
+        return
+    profiler = querylog.profiler
+    if profiler is None:
+        await update.message.reply_text('Профиль запросов выключен: запустите бота с QUERY_PROFILE=1.')
+        return
+    
+    args = context.args or []
+    count = int(args[0]) if args and args[0].isdigit() else 10
+    sort = next((arg for arg in args if arg in querylog.SORT_KEYS), 'total')
+    
+    # Снимок сохраняется и для `python -m querylog`
+    await asyncio.get_running_loop().run_in_executor(None, profiler.save)
+    rows = querylog.top(profiler.snapshot(), count, sort)
+    text = querylog.format_top(rows) or 'Запросов пока не было.'
+    if len(text) > 4000:
+        text = text[:4000] + '\n…'
+    if 'reset' in args:
+        profiler.reset()
+    await update.message.reply_text(text)
+
+# Метрики
+def setup_metrics(application: Application) -> None:
+    metrics.instrument_handlers(application, dict(enumerate(STATE_NAMES)))
+    metrics.instrument_request(application.bot.request)
+    registry = metrics.registry
+    registry.collect(
+        'finance_update_queue_size', 'Принятые обновления, ещё не переданные обработчикам',
+        'gauge', application.update_queue.qsize
+    )
+    registry.collect(
+        'finance_updates_in_progress',
+        'Обновления в обработке, включая ждущие предыдущих того же пользователя',
+        'gauge', lambda: application.update_processor.current_concurrent_updates
+    )
+    registry.collect(
+        'finance_db_write_queue_size', 'Записи, ждущие групповой фиксации',
+        'gauge', db.pending_writes
+    )
+    registry.collect(
+        'finance_db_executor_queue_size', 'Вызовы БД, ждущие свободного потока',
+        'gauge', db.executor_queue_size
+    )
+    caches = {'summaries': summaries, 'users': users, 'charts': chart_files}
+    for name, help_text in (
+        ('hits', 'Попадания в кэш'),
+        ('misses', 'Промахи кэша'),
+        ('evictions', 'Вытеснения из кэша'),
+    ):
+        registry.collect(
+            f'finance_cache_{name}_total', help_text, 'counter',
+            lambda name=name: [((cache,), getattr(obj, name)) for cache, obj in caches.items()],
+            ('cache',)
+        )
+    registry.collect(
+        'finance_cache_entries', 'Записей в кэше', 'gauge',
+        lambda: [((cache,), len(obj)) for cache, obj in caches.items()],
+        ('cache',)
+    )
+    registry.collect(
+        'finance_cache_bytes', 'Оценка памяти кэша итогов', 'gauge',
+        lambda: summaries.size
+    )
+
+# Регулярные операции: правила хранятся в БД, наступившие сроки создаются
+# периодической задачей для всех пользователей сразу
+RECURRING_KINDS = {'доход': 'income', 'расход': 'expense'}
+RECURRING_PERIODS = {'ежемесячно': 'monthly', 'еженедельно': 'weekly'}
+WEEKDAYS = ['пн', 'вт', 'ср', 'чт', 'пт', 'сб', 'вс']
+RECURRING_USAGE = (
+    "Добавить: /recurring доход 50000 Зарплата ежемесячно 5\n"
+    "или: /recurring расход 399 Подписки еженедельно пн\n"
+    "в другой валюте: /recurring расход 10 USD Подписки ежемесячно 1\n"
+    "Удалить: /recurring удалить <номер>"
+)
+
+def recurring_schedule(period, day):
+    if period == 'weekly':
+        return f"еженедельно, {WEEKDAYS[day]}"
+    return f"ежемесячно, {day}-го числа"
+
+def parse_recurring(args, currency):
+    # args после /recurring -> (kind, amount, currency, category, period, day);
+    # currency — валюта, если она не указана. ValueError, если команда
+    # записана неверно
+    if len(args) < 5 or args[0].lower() not in RECURRING_KINDS:
+        raise ValueError(args)
+    kind = RECURRING_KINDS[args[0].lower()]
+    amount, code = parse_money(args[1])
+    # Код валюты отдельным словом после суммы: «10 USD Подписки»
+    if code is None and len(args) > 5 and currencies.normalize(args[2]) in currencies.rates:
+        code = currencies.normalize(args[2])
+        args = args[:2] + args[3:]
+    currency = code or currency
+    category = ' '.join(args[2:-2])
+    period = RECURRING_PERIODS.get(args[-2].lower())
+    if amount <= 0 or period is None:
+        raise ValueError(args)
+    if period == 'weekly':
+        day = WEEKDAYS.index(args[-1].lower())
+    else:
+        day = int(args[-1])
+        if not 1 <= day <= 31:
+            raise ValueError(day)
+    # Стандартные категории — в том написании, в котором их сохраняет бот
+    for name in INCOME_CATEGORIES if kind == 'income' else EXPENSE_CATEGORIES:
+        if name.lower() == category.lower():
+            category = name
+    return kind, amount, currency, category, period, day
+
+async def recurring_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # /recurring — список правил, /recurring доход|расход ... — новое правило,
+    # /recurring удалить <номер>
+    user = update.message.from_user
+    await register_user(user)
+    args = context.args
+    
+    if not args:
+        rules = await db.read(db.recurring_rules, user.id)
+        lines = ["🔁 Регулярные операции:"]
+        for rule_id, kind, amount, category, period, day, next_due, currency in rules:
+            lines.append(
+                f"#{rule_id} {'Доход' if kind == 'income' else 'Расход'} {amount_text(amount, currency)} "
+                f"({category}), {recurring_schedule(period, day)}, "
+                f"следующая {format_date(next_due)}"
+            )
+        if not rules:
+            lines.append("Правил нет.")
+        lines.append("")
+        lines.append(RECURRING_USAGE)
+        await update.message.reply_text('\n'.join(lines), reply_markup=main_menu_keyboard())
+        return
     
-    application = Application.builder().token(token).build()
+    if args[0].lower() == 'удалить':
+        if len(args) != 2 or not args[1].lstrip('#').isdigit():
+            text = RECURRING_USAGE
+        elif await db.write(db.delete_recurring, int(args[1].lstrip('#')), user.id):
+            text = f"✅ Правило {args[1]} удалено"
+        else:
+            text = f"Правило {args[1]} не найдено"
+        await update.message.reply_text(text, reply_markup=main_menu_keyboard())
+        return
+    
+    try:
+        kind, amount, currency, category, period, day = parse_recurring(args, report_currency(context))
+    except ValueError:
+        await update.message.reply_text(RECURRING_USAGE, reply_markup=main_menu_keyboard())
+        return
+    if currency not in currencies.rates:
+        await update.message.reply_text(
+            unknown_currency_text(currency), reply_markup=main_menu_keyboard()
+        )
+        return
+    username = f"@{user.username.lower()}" if user.username else None
+    # Если срок сегодня, запись появится при ближайшей проверке
+    next_due = recurring_due(period, day, now_timestamp())
+    rule_id = await db.write(
+        db.add_recurring, user.id, username, kind, amount, category, period, day, next_due, currency
+    )
+    await update.message.reply_text(
+        f"✅ Правило #{rule_id}: {'доход' if kind == 'income' else 'расход'} "
+        f"{amount_text(amount, currency)} ({category}), {recurring_schedule(period, day)}. "
+        f"Первая запись — {format_date(next_due)}.",
+        reply_markup=main_menu_keyboard()
+    )
+
+async def notify_recurring(bot, created):
+    # Одно сообщение на пользователя; одновременно не больше
+    # RECURRING_NOTIFY_CONCURRENCY запросов к Bot API
+    by_user = {}
+    for user_id, kind, amount, category, currency, dates in created:
+        title = 'Доход' if kind == 'income' else 'Расход'
+        by_user.setdefault(user_id, []).extend(
+            f"{title} {amount_text(amount, currency)} ({category}) от {format_date(date)}"
+            for date in dates
+        )
+    slots = asyncio.Semaphore(RECURRING_NOTIFY_CONCURRENCY)
+    
+    async def send(user_id, lines):
+        async with slots:
+            try:
+                await bot.send_message(
+                    user_id, "🔁 Добавлены регулярные операции:\n" + '\n'.join(lines)
+                )
+            except TelegramError as e:
+                # Пользователь мог заблокировать бота: запись уже создана
+                logger.warning("Не удалось уведомить %s о регулярных операциях: %s", user_id, e)
+    
+    await asyncio.gather(*(send(user_id, lines) for user_id, lines in by_user.items()))
+
+async def run_recurring(bot) -> None:
+    # Все наступившие сроки, по RECURRING_BATCH_SIZE правил в транзакции;
+    # уведомления — после всех пачек, чтобы рассылка не задерживала запись
+    now = now_timestamp()
+    created = []
+    more = True
+    while more:
+        batch, more = await db.write(db.materialize_recurring, now, RECURRING_BATCH_SIZE)
+        for user_id, kind, _, _, _, dates in batch:
+            for code in {month_code(date) for date in dates}:
+                invalidate_record(user_id, kind, code)
+        created += batch
+    if created:
+        logger.info(
+            "Регулярные операции: правил %d, записей %d",
+            len(created), sum(len(dates) for *_, dates in created)
+        )
+        await notify_recurring(bot, created)
+
+async def recurring_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    await run_recurring(context.bot)
+
+async def recurring_loop(application: Application) -> None:
+    # Без JobQueue (PTB без extra job-queue): та же проверка в своей задаче
+    while True:
+        try:
+            await run_recurring(application.bot)
+        except Exception:
+            logger.exception("Ошибка при создании регулярных операций")
+        await asyncio.sleep(RECURRING_INTERVAL)
+
+# Запуск бота
+async def on_startup(application: Application) -> None:
+    try:
+        await load_rates()
+    except (OSError, ValueError) as e:
+        # Без файла курсов остаются загруженные ранее
+        logger.warning("Курсы валют из %s не загружены: %s", RATES_PATH, e)
+        currencies.rates = await db.read(db.currency_rates)
+    # В режиме polling (есть updater) своего HTTP-сервера нет: метрики отдаёт отдельный
+    if metrics.enabled and application.updater is not None:
+        server = WebhookServer(application, host=METRICS_LISTEN, port=METRICS_PORT, path=None)
+        await server.start()
+        application.bot_data['metrics_server'] = server
+    if application.job_queue is not None:
+        # Первая проверка сразу: догоняем сроки, пропущенные за время простоя
+        application.job_queue.run_repeating(
+            recurring_job, interval=RECURRING_INTERVAL, first=0, name='recurring'
+        )
+    else:
+        application.bot_data['recurring_task'] = asyncio.create_task(recurring_loop(application))
+
+async def on_shutdown(application: Application) -> None:
+    server = application.bot_data.pop('metrics_server', None)
+    if server is not None:
+        await server.stop()
+    task = application.bot_data.pop('recurring_task', None)
+    if task is not None:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    # Дописываем накопленные в очереди записи до остановки цикла событий
+    await db.close_batcher()
+    charts.shutdown()
+    if querylog.profiler is not None:
+        querylog.profiler.save()
+        querylog.profiler.close()
+
+def build_application(token, request=None, mode=BOT_MODE) -> Application:
+    # Приложение со всеми обработчиками; request подменяет транспорт
+    # к Bot API (нагрузочные тесты работают без сети)
+    builder = (
+        Application.builder()
+        .token(token)
+        .persistence(SQLitePersistence())
+        # Разные пользователи — параллельно, один пользователь — по порядку
+        .concurrent_updates(PerUserUpdateProcessor())
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    if mode == 'webhook':
+        # Обновления приходят от своего HTTP-сервера в ограниченную очередь
+        builder = builder.update_queue(asyncio.Queue(WEBHOOK_QUEUE_SIZE)).updater(None)
+    application = builder.build()
 
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler('start', start)],
@@ -1108,17 +1988,63 @@ def main() -> None:
             DELETE_DEBT: [MessageHandler(filters.TEXT & ~filters.COMMAND, delete_debt_record)],
         },
         fallbacks=[CommandHandler('cancel', cancel)],
+        # Шаг диалога и user_data переживают перезапуск бота
+        name='main',
+        persistent=True,
     )
 
     application.add_handler(conv_handler)
     application.add_handler(CommandHandler("find", find_user))
+    application.add_handler(CommandHandler("settle", settle))
+    application.add_handler(CommandHandler("analytics", analytics))
+    application.add_handler(CommandHandler("budget", budget_command))
+    application.add_handler(CommandHandler("search", search_command))
+    application.add_handler(CommandHandler("recurring", recurring_command))
+    application.add_handler(CommandHandler("currency", currency_command))
+    application.add_handler(CommandHandler("rates", rates_command))
+    application.add_handler(CommandHandler("admin_queries", admin_queries))
+    application.add_handler(CommandHandler("import", import_help))
+    application.add_handler(CommandHandler("export", export_command))
+    application.add_handler(MessageHandler(
+        filters.Document.FileExtension('csv') | filters.Document.MimeType('text/csv'),
+        import_document
+    ))
+    application.add_handler(CallbackQueryHandler(stats_page_callback, pattern='^stats:'))
+    application.add_handler(CallbackQueryHandler(settle_offer_callback, pattern='^settle:offer$'))
+    application.add_handler(CallbackQueryHandler(settle_confirm_callback, pattern='^settle:ok:'))
+    application.add_handler(CallbackQueryHandler(chart_callback, pattern='^chart:'))
+    application.add_handler(CallbackQueryHandler(search_page_callback, pattern='^search:'))
+    if metrics.enabled:
+        setup_metrics(application)
+    return application
+
+def main() -> None:
+    # Получаем токен из переменных окружения
+    token = os.getenv('BOT_TOKEN')
+    if token is None:
+        raise ValueError("Токен бота не найден! Проверьте файл .env")
+    
+    if BOT_MODE not in ('polling', 'webhook'):
+        raise ValueError(f"Неизвестный BOT_MODE: {BOT_MODE} (ожидается polling или webhook)")
+    
+    logger.info("Запуск бота в режиме %s...", BOT_MODE)
+    db.init_db()
+    application = build_application(token)
     
     # Запускаем бота с обработкой ошибок
-    application.run_polling(
-        allowed_updates=Update.ALL_TYPES,
-        drop_pending_updates=True,  # Игнорировать сообщения, отправленные пока бот был offline
-        close_loop=False
-    )
+    if BOT_MODE == 'webhook':
+        asyncio.run(run_webhook(
+            application,
+            allowed_updates=Update.ALL_TYPES,
+            drop_pending_updates=True
+        ))
+    else:
+        application.run_polling(
+            allowed_updates=Update.ALL_TYPES,
+            drop_pending_updates=True,  # Игнорировать сообщения, отправленные пока бот был offline
+            close_loop=False
+        )
+    db.shutdown()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,92 @@
+import calendar
+import time
+from datetime import datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from functools import lru_cache
+
+# Даты хранятся целым числом секунд от 1970-01-01 по часам бота (местное
+# время без часового пояса, как раньше в строке '%Y-%m-%d %H:%M:%S'),
+# суммы — целым числом копеек.
+SECONDS_PER_DAY = 86400
+
+
+def to_timestamp(dt: datetime) -> int:
+    return calendar.timegm(dt.timetuple())
+
+
+def now_timestamp() -> int:
+    return to_timestamp(datetime.now())
+
+
+def month_start(year: int, month: int) -> int:
+    return calendar.timegm((year, month, 1, 0, 0, 0))
+
+
+def month_end(year: int, month: int) -> int:
+    # Начало следующего месяца: граница периода не включается
+    return month_start(year + month // 12, month % 12 + 1)
+
+
+def day_start(ts: int) -> int:
+    return ts - ts % SECONDS_PER_DAY
+
+
+# Скользящие окна: код периода -> число дней, включая сегодняшний
+ROLLING_DAYS = {'d30': 30, 'd90': 90, 'd365': 365}
+
+
+def recurring_due(period: str, day: int, ts: int) -> int:
+    # Первый срок регулярной операции не раньше дня ts (начало суток).
+    # 'monthly' — day-го числа (в коротких месяцах — последнего),
+    # 'weekly' — в день недели day (0 — понедельник)
+    today = day_start(ts)
+    if period == 'weekly':
+        # 01.01.1970 — четверг
+        weekday = (today // SECONDS_PER_DAY + 3) % 7
+        return today + (day - weekday) % 7 * SECONDS_PER_DAY
+    year, month = year_month(today)
+    while True:
+        last_day = calendar.monthrange(year, month)[1]
+        due = month_start(year, month) + (min(day, last_day) - 1) * SECONDS_PER_DAY
+        if due >= today:
+            return due
+        year, month = (year, month + 1) if month < 12 else (year + 1, 1)
+
+
+def year_month(ts: int):
+    tm = time.gmtime(ts)
+    return tm.tm_year, tm.tm_mon
+
+
+def month_code(ts: int) -> str:
+    # 1710504000 -> '202403'
+    year, month = year_month(ts)
+    return f"{year}{month:02d}"
+
+
+@lru_cache(maxsize=4096)
+def _day_str(day: int) -> str:
+    return time.strftime('%d.%m.%Y', time.gmtime(day * SECONDS_PER_DAY))
+
+
+def format_date(ts: int) -> str:
+    # Строка даты кэшируется по номеру дня, без strptime/strftime на каждую запись
+    return _day_str(ts // SECONDS_PER_DAY)
+
+
+def parse_amount(text: str) -> int:
+    # '1500,5' -> 150050; ValueError, если это не число
+    try:
+        value = Decimal(text.strip().replace(',', '.'))
+    except InvalidOperation:
+        raise ValueError(text)
+    if not value.is_finite():
+        raise ValueError(text)
+    return int((value * 100).to_integral_value(ROUND_HALF_UP))
+
+
+def money(kopecks: int) -> str:
+    # 150050 -> '1500.50'
+    sign = '-' if kopecks < 0 else ''
+    rubles, rest = divmod(abs(kopecks), 100)
+    return f"{sign}{rubles}.{rest:02d}"
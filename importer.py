@@ -0,0 +1,233 @@
+import asyncio
+import csv
+from datetime import datetime
+
+import currencies
+import database as db
+from config import IMPORT_CHUNK_SIZE
+from formatting import parse_amount, to_timestamp
+
+# Заголовки столбцов в выписках банков (в нижнем регистре), по приоритету
+COLUMNS = {
+    'date': ('дата операции', 'дата', 'дата платежа', 'дата транзакции',
+             'date', 'transaction date'),
+    'amount': ('сумма операции', 'сумма', 'сумма платежа', 'сумма в валюте счета',
+               'amount'),
+    'income': ('приход', 'поступление', 'зачисление', 'credit'),
+    'expense': ('расход', 'списание', 'debit'),
+    'category': ('категория', 'category', 'категория операции'),
+    'description': ('описание', 'назначение платежа', 'комментарий', 'description'),
+    'kind': ('тип', 'тип операции', 'type'),
+    'status': ('статус', 'status'),
+    'currency': ('валюта операции', 'валюта', 'currency'),
+}
+INCOME_KINDS = {'доход', 'приход', 'поступление', 'зачисление', 'income', 'credit'}
+# Долги из выгрузки /export не импортируются: у них нет категории и получателя в выписке
+SKIPPED_KINDS = {'долг'}
+FAILED_STATUSES = {'failed', 'отклонена', 'отменена', 'ошибка'}
+
+# Категории банков, которые совпадают с категориями бота; остальные
+# сохраняются как свои категории пользователя
+BANK_CATEGORIES = {
+    'супермаркеты': 'Еда', 'продукты': 'Еда', 'рестораны': 'Еда',
+    'фастфуд': 'Еда', 'кафе': 'Еда',
+    'транспорт': 'Транспорт', 'такси': 'Транспорт', 'топливо': 'Транспорт',
+    'азс': 'Транспорт', 'автоуслуги': 'Транспорт',
+    'аптеки': 'Здоровье', 'медицина': 'Здоровье', 'здоровье': 'Здоровье',
+    'жкх': 'Жилье', 'аренда': 'Жилье', 'коммунальные платежи': 'Жилье',
+    'зарплата': 'Зарплата', 'переводы': 'Перевод', 'пополнения': 'Перевод',
+}
+DATE_FORMATS = (
+    '%d.%m.%Y %H:%M:%S', '%d.%m.%Y %H:%M', '%d.%m.%Y',
+    '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d',
+    '%d/%m/%Y', '%d.%m.%y',
+)
+MAX_CATEGORY = 50
+HEADER_SEARCH_ROWS = 20
+
+
+class StatementError(ValueError):
+    pass
+
+
+class _Semicolon(csv.excel):
+    delimiter = ';'
+
+
+def _open_text(path):
+    # UTF-8 (в том числе с BOM) или cp1251 — по первым 64 КБ файла
+    with open(path, 'rb') as f:
+        head = f.read(65536)
+    encoding = 'utf-8-sig'
+    try:
+        head.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # Обрезанный в конце фрагмента многобайтный символ — не ошибка
+        if e.start < len(head) - 3:
+            encoding = 'cp1251'
+    f = open(path, encoding=encoding, errors='replace', newline='')
+    sample = f.read(8192)
+    f.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=';,\t')
+    except csv.Error:
+        dialect = _Semicolon
+    return f, dialect
+
+
+def _find_columns(header):
+    names = [cell.strip().lower() for cell in header]
+    found = {}
+    for field, aliases in COLUMNS.items():
+        for alias in aliases:
+            if alias in names:
+                found[field] = names.index(alias)
+                break
+    if 'date' in found and ('amount' in found or 'income' in found or 'expense' in found):
+        return found
+    return None
+
+
+def _amount(text):
+    # '-1 234,56 ₽' -> -123456
+    cleaned = ''.join(ch for ch in text if ch.isdigit() or ch in '+-,.')
+    if not cleaned:
+        raise ValueError(text)
+    if ',' in cleaned and '.' in cleaned:
+        # '1,234.56' или '1.234,56': первый знак разделяет разряды
+        thousands = ',' if cleaned.index(',') < cleaned.index('.') else '.'
+        cleaned = cleaned.replace(thousands, '')
+    return parse_amount(cleaned)
+
+
+def _category(text):
+    text = text.strip()
+    if not text:
+        return 'Другое'
+    return BANK_CATEGORIES.get(text.lower(), text[:MAX_CATEGORY])
+
+
+class StatementReader:
+    # Читает CSV-выписку построчно и отдаёт пачки по chunk_size строк
+    # (вид, сотые доли, категория, секунды, валюта); весь файл в память не
+    # читается. Без столбца валюты все суммы — в currency. Строки, которые
+    # не удалось разобрать или у валюты которых нет курса, считаются в skipped.
+
+    def __init__(self, path, chunk_size=IMPORT_CHUNK_SIZE, currency=currencies.BASE_CURRENCY):
+        self.chunk_size = chunk_size
+        self.currency = currency
+        self.lines = 0
+        self.skipped = 0
+        self._date_format = None
+        self._file, dialect = _open_text(path)
+        self._rows = csv.reader(self._file, dialect)
+        # Перед заголовком бывают строки с номером счёта и периодом
+        for _ in range(HEADER_SEARCH_ROWS):
+            header = next(self._rows, None)
+            if header is None:
+                break
+            self.columns = _find_columns(header)
+            if self.columns is not None:
+                return
+        self.close()
+        raise StatementError('Не найдены столбцы с датой и суммой операции')
+
+    def close(self):
+        self._file.close()
+
+    def __iter__(self):
+        chunk = []
+        for row in self._rows:
+            self.lines += 1
+            record = self._parse(row)
+            if record is None:
+                continue
+            chunk.append(record)
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def _cell(self, row, field):
+        index = self.columns.get(field)
+        if index is None or index >= len(row):
+            return ''
+        return row[index].strip()
+
+    def _date(self, text):
+        if self._date_format is not None:
+            try:
+                return datetime.strptime(text, self._date_format)
+            except ValueError:
+                pass
+        for date_format in DATE_FORMATS:
+            try:
+                value = datetime.strptime(text, date_format)
+            except ValueError:
+                continue
+            self._date_format = date_format
+            return value
+        raise ValueError(text)
+
+    def _parse(self, row):
+        if not any(cell.strip() for cell in row):
+            return None
+        if self._cell(row, 'status').lower() in FAILED_STATUSES:
+            self.skipped += 1
+            return None
+        try:
+            date = to_timestamp(self._date(self._cell(row, 'date')))
+            if 'amount' in self.columns:
+                amount = _amount(self._cell(row, 'amount'))
+                kind_text = self._cell(row, 'kind').lower()
+                if kind_text in SKIPPED_KINDS:
+                    self.skipped += 1
+                    return None
+                if kind_text:
+                    kind = 'income' if kind_text in INCOME_KINDS else 'expense'
+                    amount = abs(amount)
+                else:
+                    # Без столбца типа: поступления положительные, списания — отрицательные
+                    kind = 'income' if amount > 0 else 'expense'
+            else:
+                income = self._cell(row, 'income')
+                expense = self._cell(row, 'expense')
+                kind = 'income' if income and _amount(income) else 'expense'
+                amount = _amount(income if kind == 'income' else expense)
+        except ValueError:
+            self.skipped += 1
+            return None
+
+        amount = abs(amount)
+        currency = self._cell(row, 'currency')
+        currency = currencies.normalize(currency) if currency else self.currency
+        if amount == 0 or currency not in currencies.rates:
+            self.skipped += 1
+            return None
+        category = self._cell(row, 'category') or self._cell(row, 'description')
+        return kind, amount, _category(category), date, currency
+
+
+async def import_statement(path, user_id, username, chunk_size=IMPORT_CHUNK_SIZE,
+                           currency=currencies.BASE_CURRENCY):
+    # Разбор идёт в потоке по умолчанию, запись — пачками, каждая в своей
+    # транзакции писателя: между пачками пишут другие пользователи.
+    # Возвращает {'income': n, 'expense': n, 'duplicates': n, 'skipped': n}
+    loop = asyncio.get_running_loop()
+    reader = await loop.run_in_executor(None, StatementReader, path, chunk_size, currency)
+    chunks = iter(reader)
+    seen = {}
+    result = {'income': 0, 'expense': 0, 'duplicates': 0}
+    try:
+        while True:
+            chunk = await loop.run_in_executor(None, next, chunks, None)
+            if chunk is None:
+                break
+            inserted = await db.write(db.import_records, user_id, username, chunk, seen)
+            for key, count in inserted.items():
+                result[key] += count
+    finally:
+        reader.close()
+    result['skipped'] = reader.skipped
+    return result
@@ -0,0 +1,248 @@
+import bisect
+import functools
+import re
+import threading
+import time
+
+from config import METRICS_ENABLED
+
+# Выключенные метрики ничего не оборачивают и не наблюдают за SQL:
+# остаётся только проверка этого флага в database._read/_write
+enabled = METRICS_ENABLED
+
+# Границы корзин гистограмм, секунд
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SQL_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+               0.025, 0.05, 0.1, 0.25, 1)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels_text(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class Histogram:
+    # Обновляется из цикла событий и из потоков БД
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.sum
+
+
+class Counter:
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Family:
+    # Метрика с набором меток: labels(...) возвращает дочернюю метрику,
+    # её стоит получить один раз и держать у себя
+
+    def __init__(self, name, help_text, kind, label_names, factory):
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self.label_names = label_names
+        self._factory = factory
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._factory())
+        return child
+
+    def render(self, lines):
+        for values, child in sorted(self._children.items()):
+            if self.kind == 'counter':
+                lines.append(
+                    f'{self.name}{_labels_text(self.label_names, values)} {child.value}'
+                )
+                continue
+            counts, total = child.snapshot()
+            cumulative = 0
+            for bound, count in zip(list(child.buckets) + ['+Inf'], counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(
+                    f'{self.name}_bucket{_labels_text(self.label_names, values, le)} {cumulative}'
+                )
+            labels = _labels_text(self.label_names, values)
+            lines.append(f'{self.name}_sum{labels} {_number(total)}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+
+
+class Registry:
+
+    def __init__(self):
+        self._families = {}
+        # Имя -> (описание, тип, колбэк): значения читаются при запросе /metrics
+        self._collectors = {}
+
+    def histogram(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        return self._family(name, help_text, 'histogram', label_names,
+                            lambda: Histogram(buckets))
+
+    def counter(self, name, help_text, label_names=()):
+        return self._family(name, help_text, 'counter', label_names, Counter)
+
+    def collect(self, name, help_text, kind, callback, label_names=()):
+        # callback() -> число или список (значения меток, число)
+        self._collectors[name] = (help_text, kind, label_names, callback)
+
+    def _family(self, name, help_text, kind, label_names, factory):
+        family = self._families.get(name)
+        if family is None:
+            family = Family(name, help_text, kind, tuple(label_names), factory)
+            self._families[name] = family
+        return family
+
+    def render(self):
+        lines = []
+        for name, family in sorted(self._families.items()):
+            lines.append(f'# HELP {name} {family.help}')
+            lines.append(f'# TYPE {name} {family.kind}')
+            family.render(lines)
+        for name, (help_text, kind, label_names, callback) in sorted(self._collectors.items()):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            value = callback()
+            if isinstance(value, (int, float)):
+                value = [((), value)]
+            for values, number in value:
+                lines.append(f'{name}{_labels_text(label_names, values)} {_number(number)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+HANDLER_SECONDS = registry.histogram(
+    'finance_handler_seconds', 'Время работы обработчика',
+    ('handler', 'state')
+)
+HANDLER_ERRORS = registry.counter(
+    'finance_handler_errors_total', 'Исключения в обработчиках',
+    ('handler', 'state')
+)
+DB_CALL_SECONDS = registry.histogram(
+    'finance_db_call_seconds', 'Функция БД целиком: транзакция, запросы и COMMIT',
+    ('func', 'mode'), SQL_BUCKETS
+)
+SQL_SECONDS = registry.histogram(
+    'finance_sql_statement_seconds', 'Отдельные SQL-выражения (по trace-колбэку sqlite3)',
+    ('verb', 'table'), SQL_BUCKETS
+)
+API_SECONDS = registry.histogram(
+    'finance_bot_api_seconds', 'Запросы к Bot API',
+    ('method',)
+)
+
+
+# Обработчики
+def _timed(callback, handler_name, state):
+    latency = HANDLER_SECONDS.labels(handler_name, state)
+    errors = HANDLER_ERRORS.labels(handler_name, state)
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            latency.observe(time.perf_counter() - started)
+    return wrapper
+
+
+def instrument_handlers(application, state_names):
+    # Оборачивает каждый обработчик приложения; метка state — шаг диалога,
+    # в котором обработчик зарегистрирован (entry, fallback или имя из
+    # state_names), для обработчиков вне ConversationHandler — none
+    from telegram.ext import ConversationHandler
+
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if isinstance(handler, ConversationHandler):
+                inner = [(item, 'entry') for item in handler.entry_points]
+                inner += [(item, 'fallback') for item in handler.fallbacks]
+                for state, state_handlers in handler.states.items():
+                    name = state_names.get(state, str(state))
+                    inner += [(item, name) for item in state_handlers]
+            else:
+                inner = [(handler, 'none')]
+            for item, state in inner:
+                item.callback = _timed(item.callback, item.callback.__name__, state)
+
+
+# Bot API
+def instrument_request(request):
+    # Время и число одновременных запросов к Bot API. У бота нет своей
+    # очереди исходящих сообщений: ответы уходят сразу из обработчиков,
+    # поэтому «глубина очереди» — это запросы, ждущие ответа Telegram
+    do_request = request.do_request
+    in_flight = [0]
+
+    async def timed_request(url, method, *args, **kwargs):
+        latency = API_SECONDS.labels(url.rsplit('/', 1)[-1])
+        in_flight[0] += 1
+        started = time.perf_counter()
+        try:
+            return await do_request(url, method, *args, **kwargs)
+        finally:
+            in_flight[0] -= 1
+            latency.observe(time.perf_counter() - started)
+
+    request.do_request = timed_request
+    registry.collect(
+        'finance_bot_api_in_flight', 'Запросы к Bot API, ожидающие ответа',
+        'gauge', lambda: in_flight[0]
+    )
+
+
+# SQLite
+_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE)\s+(\w+)', re.IGNORECASE)
+
+
+def observe_db_call(func, mode, started):
+    DB_CALL_SECONDS.labels(func.__name__, mode).observe(time.perf_counter() - started)
+
+
+def observe_statement(sql, seconds):
+    # Наблюдатель database.observe_statements
+    verb = sql.lstrip()[:8].split(None, 1)[0].upper() if sql.strip() else ''
+    match = _TABLE.search(sql)
+    SQL_SECONDS.labels(verb, match.group(1).lower() if match else '').observe(seconds)
@@ -0,0 +1,157 @@
+import asyncio
+import json
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+import database as db
+from config import PERSISTENCE_UPDATE_INTERVAL
+
+
+def _encode(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+class SQLitePersistence(BasePersistence):
+    # Состояния ConversationHandler и context.user_data в таблицах
+    # conversations и user_data (по строке на ключ). Application раз в
+    # update_interval секунд передаёт сюда только затронутых пользователей
+    # и диалоги; из них в БД уходят лишь изменившиеся ключи, все изменения
+    # одного прогона — одной транзакцией. chat_data, bot_data и callback_data
+    # бот не использует. Ключи user_data — строки, значения — JSON.
+
+    def __init__(self, update_interval=PERSISTENCE_UPDATE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(
+                bot_data=False, chat_data=False, user_data=True, callback_data=False
+            ),
+            update_interval=update_interval
+        )
+        # Что уже лежит в БД: user_id -> {ключ: JSON}, (имя, ключ) -> JSON
+        self._saved_users = {}
+        self._saved_states = {}
+        # Ещё не записанные изменения; None — удалить строку
+        self._dropped_users = set()
+        self._user_rows = {}
+        self._conversation_rows = {}
+        self._write_task = None
+        self._write_lock = asyncio.Lock()
+
+    async def get_user_data(self):
+        user_data = {}
+        for user_id, key, value in await db.read(db.load_user_data):
+            self._saved_users.setdefault(user_id, {})[key] = value
+            user_data.setdefault(user_id, {})[key] = json.loads(value)
+        return user_data
+
+    async def get_conversations(self, name):
+        conversations = {}
+        for key, state in await db.read(db.load_conversations, name):
+            self._saved_states[(name, key)] = state
+            conversations[tuple(json.loads(key))] = json.loads(state)
+        return conversations
+
+    async def update_user_data(self, user_id, data):
+        saved = self._saved_users.get(user_id, {})
+        current = {key: _encode(value) for key, value in data.items()}
+        changed = False
+        for key, value in current.items():
+            if saved.get(key) != value:
+                self._user_rows[(user_id, key)] = value
+                changed = True
+        for key in saved.keys() - current.keys():
+            self._user_rows[(user_id, key)] = None
+            changed = True
+        self._saved_users[user_id] = current
+        if changed:
+            await self._commit()
+
+    async def drop_user_data(self, user_id):
+        self._saved_users.pop(user_id, None)
+        for row_key in [row_key for row_key in self._user_rows if row_key[0] == user_id]:
+            del self._user_rows[row_key]
+        self._dropped_users.add(user_id)
+        await self._commit()
+
+    async def update_conversation(self, name, key, new_state):
+        row_key = (name, _encode(key))
+        state = None if new_state is None else _encode(new_state)
+        if self._saved_states.get(row_key) == state:
+            return
+        if state is None:
+            del self._saved_states[row_key]
+        else:
+            self._saved_states[row_key] = state
+        self._conversation_rows[row_key] = state
+        await self._commit()
+
+    async def flush(self):
+        if self._dropped_users or self._user_rows or self._conversation_rows:
+            await self._commit()
+        # Дожидаемся записи, начатой раньше
+        async with self._write_lock:
+            pass
+
+    async def _commit(self):
+        # Все обновления одного прогона update_persistence приходят сюда
+        # одновременно и ждут одну общую запись
+        if self._write_task is None:
+            self._write_task = asyncio.ensure_future(self._write_pending())
+        await asyncio.shield(self._write_task)
+
+    async def _write_pending(self):
+        await asyncio.sleep(0)
+        self._write_task = None
+        dropped = list(self._dropped_users)
+        user_rows = [(*row_key, value) for row_key, value in self._user_rows.items()]
+        conversation_rows = [
+            (*row_key, state) for row_key, state in self._conversation_rows.items()
+        ]
+        self._dropped_users = set()
+        self._user_rows = {}
+        self._conversation_rows = {}
+
+        # asyncio.Lock пропускает по очереди: пакеты пишутся в порядке создания
+        async with self._write_lock:
+            try:
+                await db.write(db.save_state, dropped, user_rows, conversation_rows)
+            except Exception:
+                # Возвращаем изменения в очередь, если их не перекрыли новые
+                self._dropped_users.update(
+                    user_id for user_id in dropped if user_id not in self._saved_users
+                )
+                for user_id, key, value in user_rows:
+                    self._user_rows.setdefault((user_id, key), value)
+                for name, key, state in conversation_rows:
+                    self._conversation_rows.setdefault((name, key), state)
+                raise
+
+    # Не используются ботом
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
@@ -0,0 +1,170 @@
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from config import (
+    QUERY_PROFILE, QUERY_PROFILE_PATH, QUERY_PROFILE_SIZE, SLOW_QUERY_MS
+)
+
+logger = logging.getLogger(__name__)
+
+# Выражения с подставленными значениями приводятся к общему виду:
+# литералы заменяются на ?, списки значений сворачиваются
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_BLOB = re.compile(r"\b[xX]\?")
+_NUMBER = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?')
+# NULL подставляется вместо параметра None; IS NULL и NOT NULL остаются
+_NULL = re.compile(r'(?<!IS )(?<!NOT )\bNULL\b', re.IGNORECASE)
+_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_SPACE = re.compile(r'\s+')
+OTHER = '<прочие выражения>'
+
+
+def fingerprint(sql):
+    sql = _STRING.sub('?', sql)
+    sql = _BLOB.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _NULL.sub('?', sql)
+    sql = _LIST.sub('(...)', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+class QueryProfiler:
+    # Счётчики по отпечаткам выражений: число выполнений, суммарное и
+    # максимальное время. record() вызывается из потоков БД (см.
+    # database.observe_statements). Выражения дольше threshold пишутся в
+    # лог вместе с EXPLAIN QUERY PLAN; план строится в отдельном потоке на
+    # своём соединении (explain_connect) по одному разу на отпечаток.
+
+    def __init__(self, threshold_ms=SLOW_QUERY_MS, max_fingerprints=QUERY_PROFILE_SIZE,
+                 explain_connect=None):
+        self.threshold = threshold_ms / 1000
+        self.max_fingerprints = max_fingerprints
+        self.explain_connect = explain_connect
+        # Отпечаток -> [число, сумма секунд, максимум секунд]
+        self._stats = {}
+        self._plans = {}
+        self._lock = threading.Lock()
+        self._explainer = None
+        self._explain_conn = None
+
+    def record(self, sql, seconds):
+        key = fingerprint(sql)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                if len(self._stats) >= self.max_fingerprints:
+                    key = OTHER
+                    stats = self._stats.setdefault(key, [0, 0.0, 0.0])
+                else:
+                    stats = self._stats[key] = [0, 0.0, 0.0]
+            stats[0] += 1
+            stats[1] += seconds
+            if seconds > stats[2]:
+                stats[2] = seconds
+        if seconds >= self.threshold:
+            self._slow(key, sql, seconds)
+
+    def _slow(self, key, sql, seconds):
+        if self.explain_connect is None or key == OTHER:
+            logger.warning("Медленный запрос %.1f мс: %s", seconds * 1000, sql)
+            return
+        if self._explainer is None:
+            with self._lock:
+                if self._explainer is None:
+                    self._explainer = ThreadPoolExecutor(
+                        max_workers=1, thread_name_prefix='explain'
+                    )
+        self._explainer.submit(self._log_slow, key, sql, seconds)
+
+    def _log_slow(self, key, sql, seconds):
+        plan = self._plans.get(key)
+        if plan is None:
+            try:
+                if self._explain_conn is None:
+                    self._explain_conn = self.explain_connect()
+                rows = self._explain_conn.execute('EXPLAIN QUERY PLAN ' + sql).fetchall()
+                plan = '\n'.join('  ' + row[3] for row in rows) or '  (нет плана)'
+            except Exception as e:
+                plan = f'  (план не получен: {e})'
+            self._plans[key] = plan
+        logger.warning("Медленный запрос %.1f мс: %s\n%s", seconds * 1000, sql, plan)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                key: {'count': count, 'total_ms': round(total * 1000, 3),
+                      'max_ms': round(maximum * 1000, 3)}
+                for key, (count, total, maximum) in self._stats.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def save(self, path=QUERY_PROFILE_PATH):
+        # Снимок для `python -m querylog`; файл заменяется атомарно
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def close(self):
+        if self._explainer is not None:
+            self._explainer.shutdown(wait=True)
+            self._explainer = None
+        if self._explain_conn is not None:
+            self._explain_conn.close()
+            self._explain_conn = None
+
+
+SORT_KEYS = {'total': 'total_ms', 'max': 'max_ms', 'count': 'count'}
+
+
+def top(snapshot, n=10, sort='total'):
+    field = SORT_KEYS[sort]
+    return sorted(snapshot.items(), key=lambda item: item[1][field], reverse=True)[:n]
+
+
+def format_top(rows, sql_width=300):
+    lines = []
+    for i, (key, stats) in enumerate(rows, 1):
+        average = stats['total_ms'] / stats['count'] if stats['count'] else 0
+        text = key if len(key) <= sql_width else key[:sql_width] + '…'
+        lines.append(
+            f"{i}. {stats['total_ms']:.1f} мс всего, {stats['count']} раз, "
+            f"в среднем {average:.2f} мс, макс. {stats['max_ms']:.1f} мс\n{text}"
+        )
+    return '\n\n'.join(lines)
+
+
+# Включается QUERY_PROFILE=1; database подключает его к своим соединениям
+profiler = QueryProfiler() if QUERY_PROFILE else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Самые дорогие SQL-выражения бота')
+    parser.add_argument('--path', default=QUERY_PROFILE_PATH,
+                        help='снимок, который бот пишет при остановке и по /admin_queries')
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--sort', choices=list(SORT_KEYS), default='total')
+    args = parser.parse_args()
+
+    try:
+        with open(args.path, encoding='utf-8') as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        print(f'Нет снимка {args.path}: включите QUERY_PROFILE=1 и остановите бота '
+              f'или вызовите /admin_queries')
+        return 1
+    print(format_top(top(snapshot, args.top, args.sort), sql_width=2000))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
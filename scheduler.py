@@ -0,0 +1,73 @@
+import asyncio
+
+from telegram.ext import BaseUpdateProcessor
+
+from config import UPDATE_CONCURRENCY, UPDATE_PENDING_LIMIT
+
+
+def update_key(update):
+    # Обновления одного пользователя обрабатываются строго по очереди:
+    # от этого зависит шаг ConversationHandler и context.user_data
+    user = getattr(update, 'effective_user', None)
+    if user is not None:
+        return user.id
+    chat = getattr(update, 'effective_chat', None)
+    if chat is not None:
+        return ('chat', chat.id)
+    return None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    # Разные пользователи обрабатываются параллельно (не больше concurrency
+    # обработчиков одновременно), обновления одного пользователя — в порядке
+    # поступления. Семафор PTB (max_concurrent_updates) ограничивает только
+    # число принятых обновлений: ожидающие своей очереди не занимают общих
+    # слотов, поэтому пользователь с долгой выгрузкой не задерживает остальных.
+    # Application вызывает do_process_update в порядке очереди обновлений.
+
+    def __init__(self, concurrency=UPDATE_CONCURRENCY, pending_limit=UPDATE_PENDING_LIMIT):
+        if concurrency < 1:
+            raise ValueError("concurrency должно быть положительным")
+        super().__init__(max_concurrent_updates=max(concurrency, pending_limit, 2))
+        self.concurrency = concurrency
+        self._slots = asyncio.Semaphore(concurrency)
+        # Ключ пользователя -> future, завершающийся после его последнего обновления
+        self._tails = {}
+
+    async def do_process_update(self, update, coroutine):
+        key = update_key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+
+        previous = self._tails.get(key)
+        done = asyncio.get_running_loop().create_future()
+        self._tails[key] = done
+        try:
+            if previous is not None:
+                await asyncio.shield(previous)
+            async with self._slots:
+                await coroutine
+        finally:
+            if asyncio.iscoroutine(coroutine):
+                # Отменённое до запуска обработчика обновление не оставляет
+                # невыполненной корутины
+                coroutine.close()
+            if previous is None or previous.done():
+                self._release(key, done)
+            else:
+                # Отменено в ожидании предыдущего: следующие обновления
+                # пользователя всё равно ждут, пока тот завершится
+                previous.add_done_callback(lambda _: self._release(key, done))
+
+    def _release(self, key, done):
+        done.set_result(None)
+        if self._tails.get(key) is done:
+            del self._tails[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
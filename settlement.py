@@ -0,0 +1,41 @@
+import heapq
+
+
+# Взаимозачёт долгов. Баланс пользователя — копейки со знаком: больше нуля —
+# ему должны, меньше нуля — должен он; сумма балансов группы равна нулю.
+# Запись долга (from_user_id, to_user_id) читается так же, как в /find:
+# from_user_id должен to_user_id.
+def transfers(balances):
+    # Список переводов (кто, кому, копейки), после которых все балансы
+    # равны нулю. Сначала сводятся пары с одинаковой суммой долга и
+    # переплаты, затем наибольший должник платит наибольшему кредитору:
+    # переводов не больше, чем участников минус один.
+    debtors = {}
+    result = []
+    for user_id, balance in balances.items():
+        if balance < 0:
+            debtors.setdefault(-balance, []).append(user_id)
+
+    creditors = []
+    for user_id, balance in balances.items():
+        if balance <= 0:
+            continue
+        same = debtors.get(balance)
+        if same:
+            result.append((same.pop(), user_id, balance))
+        else:
+            creditors.append((-balance, user_id))
+    debtors = [(-amount, user_id) for amount, ids in debtors.items() for user_id in ids]
+
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+    while creditors and debtors:
+        credit, creditor = heapq.heappop(creditors)
+        debt, debtor = heapq.heappop(debtors)
+        amount = min(-credit, -debt)
+        result.append((debtor, creditor, amount))
+        if -credit > amount:
+            heapq.heappush(creditors, (credit + amount, creditor))
+        if -debt > amount:
+            heapq.heappush(debtors, (debt + amount, debtor))
+    return result
@@ -0,0 +1,21 @@
+import os
+import sys
+import tempfile
+
+# Тесты не открывают рабочую finance.db: и пул по умолчанию, и пулы
+# фикстур смотрят во временный каталог
+os.environ['FINANCE_DB_PATH'] = os.path.join(tempfile.mkdtemp(prefix='finance-tests-'), 'finance.db')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+import database as db  # noqa: E402
+
+
+@pytest.fixture
+def pool(tmp_path):
+    # Пул соединений к новой БД, к которой применены все миграции
+    pool = db.ConnectionPool(str(tmp_path / 'finance.db'), readers=1)
+    db.init_db(pool)
+    yield pool
+    pool.close()
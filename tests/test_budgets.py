@@ -0,0 +1,72 @@
+# Проверка бюджета при записи расхода: потраченное за месяц читается из
+# monthly_totals в транзакции вставки и пересчитывается в валюту лимита;
+# budget_warning предупреждает при переходе порога и на каждый расход
+# сверх лимита
+from datetime import datetime
+
+import database as db
+import finance_bot as fb
+from formatting import to_timestamp
+
+A = 301
+JANUARY = to_timestamp(datetime(2026, 1, 15, 12))
+FEBRUARY = to_timestamp(datetime(2026, 2, 3, 9))
+
+
+def spend(conn, *expenses, date=JANUARY):
+    # expenses — (сумма, категория, валюта); проверки бюджета по строкам
+    return db.write_batch(conn, [
+        ('expense', (A, '@a', amount, category, date, currency))
+        for amount, category, currency in expenses
+    ])
+
+
+def test_budget_under_at_and_over_limit(pool):
+    with pool.writer() as conn:
+        db.load_rates(conn, {'USD': 100.0})
+        db.set_budget(conn, A, 'Еда', 10000)
+
+        # Ниже порога предупреждения
+        [budget] = spend(conn, (5000, 'Еда', 'RUB'))
+        assert budget == (10000, 0, 5000, 'RUB')
+        assert fb.budget_warning('Еда', budget) == ''
+
+        # Переход порога — одно предупреждение, дальше до лимита тихо
+        [budget] = spend(conn, (3000, 'Еда', 'RUB'))
+        assert budget == (10000, 5000, 8000, 'RUB')
+        assert 'Потрачено 80% бюджета «Еда»' in fb.budget_warning('Еда', budget)
+        [budget] = spend(conn, (1000, 'Еда', 'RUB'))
+        assert fb.budget_warning('Еда', budget) == ''
+
+        # Расход в долларах пересчитывается по курсу: 0.10 USD = 10 ₽
+        [budget] = spend(conn, (10, 'Еда', 'USD'))
+        assert budget == (10000, 9000, 10000, 'RUB')
+        assert 'исчерпан' in fb.budget_warning('Еда', budget)
+        [budget] = spend(conn, (1, 'Еда', 'RUB'))
+        assert budget == (10000, 10000, 10001, 'RUB')
+        assert 'превышен' in fb.budget_warning('Еда', budget)
+        # Пока лимит исчерпан, предупреждение — на каждый расход
+        [budget] = spend(conn, (1, 'Еда', 'RUB'))
+        assert 'превышен' in fb.budget_warning('Еда', budget)
+
+        # Другая категория и другой месяц в лимит не входят
+        assert spend(conn, (50000, 'Кафе', 'RUB')) == [None]
+        [budget] = spend(conn, (2000, 'Еда', 'RUB'), date=FEBRUARY)
+        assert budget == (10000, 0, 2000, 'RUB')
+
+        assert db.budget_report(conn, A, 2026, 1) == [('Еда', 10000, 10002, 'RUB')]
+
+
+def test_budget_in_foreign_currency_and_batched_rows(pool):
+    with pool.writer() as conn:
+        db.load_rates(conn, {'USD': 100.0})
+        # Лимит 10 USD, расходы в рублях
+        db.set_budget(conn, A, 'Кафе', 1000, 'USD')
+        # Строки одного пакета: «до» у второй включает первую
+        first, second = spend(conn, (50000, 'Кафе', 'RUB'), (35000, 'Кафе', 'RUB'))
+        assert first == (1000, 0, 500, 'USD')
+        assert second == (1000, 500, 850, 'USD')
+        assert fb.budget_warning('Кафе', first) == ''
+        warning = fb.budget_warning('Кафе', second)
+        assert 'Потрачено 85% бюджета «Кафе»' in warning
+        assert '8.50 USD из 10.00 USD' in warning
@@ -0,0 +1,79 @@
+# monthly_totals обновляется вручную на каждом пути записи: вставке
+# (одиночной и пакетом), удалении и погашении долгов взаимозачётом. После
+# каждого шага итоги должны совпадать с пересчётом по записям
+from datetime import datetime
+
+import settlement
+
+import database as db
+from currencies import BASE_CURRENCY
+from formatting import now_timestamp, to_timestamp
+
+A, B = 201, 202
+JANUARY = to_timestamp(datetime(2026, 1, 15, 12))
+FEBRUARY = to_timestamp(datetime(2026, 2, 3, 9))
+
+
+def totals(conn, user_id, kind):
+    return sorted(conn.execute(
+        '''SELECT year, month, category, currency, total, count FROM monthly_totals
+        WHERE user_id = ? AND kind = ? AND count != 0''',
+        (user_id, kind)
+    ).fetchall())
+
+
+def record_id(conn, table, amount):
+    return conn.execute(f'SELECT id FROM {table} WHERE amount = ?', (amount,)).fetchone()[0]
+
+
+def test_totals_follow_insert_delete_and_payment(pool):
+    with pool.writer() as conn:
+        db.load_rates(conn, {'USD': 90.0})
+
+        # Вставка по одной и пакетом, два месяца и две валюты
+        db.add_income(conn, A, '@a', 500000, 'Зарплата', JANUARY)
+        db.add_income(conn, A, '@a', 100000, 'Зарплата', FEBRUARY, 'USD')
+        db.add_expense(conn, A, '@a', 30000, 'Еда', JANUARY)
+        db.write_batch(conn, [
+            ('expense', (A, '@a', 1500, 'Еда', FEBRUARY, 'USD')),
+            ('expense', (A, '@a', 2500, 'Еда', FEBRUARY, 'USD')),
+            ('income', (A, '@a', 70000, 'Подработка', FEBRUARY, BASE_CURRENCY)),
+            ('debt', (A, '@a', B, '@b', 10000, 'обед', JANUARY, BASE_CURRENCY)),
+            ('debt', (A, '@a', B, '@b', 2000, 'кино', FEBRUARY, 'USD')),
+        ])
+        db.add_debt(conn, A, '@a', None, 'Вася', 40000, 'такси', FEBRUARY)
+        assert db.check_monthly_totals(conn) == []
+        assert totals(conn, A, 'expense') == [
+            (2026, 1, 'Еда', 'RUB', 30000, 1),
+            (2026, 2, 'Еда', 'USD', 4000, 2),
+        ]
+
+        # Удаление записей каждого вида
+        db.delete_record(conn, 'income', record_id(conn, 'incomes', 70000), A)
+        db.delete_record(conn, 'expense', record_id(conn, 'expenses', 1500), A)
+        db.delete_record(conn, 'debt', record_id(conn, 'debts', 40000), A)
+        assert db.check_monthly_totals(conn) == []
+        assert totals(conn, A, 'income') == [
+            (2026, 1, 'Зарплата', 'RUB', 500000, 1),
+            (2026, 2, 'Зарплата', 'USD', 100000, 1),
+        ]
+        assert totals(conn, A, 'expense') == [
+            (2026, 1, 'Еда', 'RUB', 30000, 1),
+            (2026, 2, 'Еда', 'USD', 2500, 1),
+        ]
+
+        # Погашение: долги A перед B в рублях и долларах закрываются
+        # взаимозачётом после подтверждения B
+        balances, max_id = db.debt_balances(conn, A)
+        settlement_id, confirmers = db.create_settlement(
+            conn, A, None, BASE_CURRENCY, max_id, settlement.transfers(balances), now_timestamp()
+        )
+        assert confirmers == [B]
+        _, _, closed, owners = db.confirm_settlement(conn, settlement_id, B, now_timestamp())
+        assert (closed, owners) == (2, {A})
+        assert db.check_monthly_totals(conn) == []
+        assert totals(conn, A, 'debt') == []
+
+        # Удаление погашенного долга итоги не меняет
+        db.delete_record(conn, 'debt', record_id(conn, 'debts', 2000), A)
+        assert db.check_monthly_totals(conn) == []
@@ -0,0 +1,15 @@
+# Каждое выражение горячих обработчиков на только что созданной схеме идёт
+# по индексу: в плане нет «SCAN» таблиц записей, долгов и пользователей
+import pytest
+
+from benchmarks.query_plans import HOT_QUERIES, capture_statements, full_scans
+
+
+@pytest.mark.parametrize('name, func, args', HOT_QUERIES, ids=[name for name, _, _ in HOT_QUERIES])
+def test_hot_query_uses_indexes(pool, name, func, args):
+    with pool.reader() as conn:
+        statements = capture_statements(conn, func, args)
+        assert statements, f'{name}: не выполнено ни одного запроса'
+        for sql in statements:
+            plan = conn.execute('EXPLAIN QUERY PLAN ' + sql).fetchall()
+            assert not full_scans(plan), f'{name}: {sql}'
@@ -0,0 +1,60 @@
+# Индекс records_search держится триггерами в синхронном состоянии с
+# таблицами записей, а токены «u<user_id>x<слово>» не дают найти чужие
+# записи — в том числе пользователя, чей id начинается с тех же цифр
+from datetime import datetime
+
+import database as db
+from formatting import month_start, to_timestamp
+
+A, B = 7, 71
+JANUARY = to_timestamp(datetime(2026, 1, 15, 12))
+FEBRUARY = to_timestamp(datetime(2026, 2, 3, 9))
+
+
+def found(conn, user_id, text, start=None, end=None):
+    rows, total = db.search_records(conn, user_id, db.search_words(text), start, end)
+    assert total == len(rows)
+    return sorted((kind, amount, text) for kind, _, amount, text, *_ in rows)
+
+
+def test_search_sees_only_own_live_records(pool):
+    with pool.writer() as conn:
+        db.add_expense(conn, A, '@a', 30000, 'Такси', JANUARY)
+        db.add_expense(conn, A, '@a', 12000, 'Такси', FEBRUARY)
+        db.add_debt(conn, A, '@a', None, 'Вася', 50000, 'такси до аэропорта', FEBRUARY)
+        db.add_income(conn, A, '@a', 900000, 'Зарплата', JANUARY)
+        db.add_expense(conn, B, '@b', 45000, 'Такси', JANUARY)
+        db.add_expense(conn, B, '@b', 8000, 'Кофе', FEBRUARY)
+
+    with pool.reader() as conn:
+        assert found(conn, A, 'такси') == [
+            ('debt', 50000, 'такси до аэропорта'),
+            ('expense', 12000, 'Такси'),
+            ('expense', 30000, 'Такси'),
+        ]
+        assert found(conn, B, 'такс') == [('expense', 45000, 'Такси')]
+        assert found(conn, A, 'кофе') == []
+        assert found(conn, B, 'зарплата') == []
+        assert found(conn, A, 'зарплата') == [('income', 900000, 'Зарплата')]
+        # Целый месяц отбирается в индексе, скользящее окно — ещё и по дате
+        assert found(conn, A, 'такси', month_start(2026, 1), month_start(2026, 2)) == [
+            ('expense', 30000, 'Такси'),
+        ]
+        assert found(conn, A, 'такси', FEBRUARY - 5 * 86400, FEBRUARY + 86400) == [
+            ('debt', 50000, 'такси до аэропорта'),
+            ('expense', 12000, 'Такси'),
+        ]
+
+    with pool.writer() as conn:
+        expense_id = conn.execute('SELECT id FROM expenses WHERE amount = 12000').fetchone()[0]
+        debt_id = conn.execute('SELECT id FROM debts WHERE amount = 50000').fetchone()[0]
+        # Чужую запись удалить нельзя, и индекс не меняется
+        assert db.delete_record(conn, 'expense', expense_id, B) is None
+        db.delete_record(conn, 'expense', expense_id, A)
+        db.delete_record(conn, 'debt', debt_id, A)
+
+    with pool.reader() as conn:
+        assert found(conn, A, 'такси') == [('expense', 30000, 'Такси')]
+        assert found(conn, A, 'аэропорт') == []
+        assert found(conn, B, 'такси') == [('expense', 45000, 'Такси')]
+        assert found(conn, B, 'кофе') == [('expense', 8000, 'Кофе')]
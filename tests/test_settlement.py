@@ -0,0 +1,107 @@
+# Взаимозачёт /settle: долги закрываются только по показанному плану и
+# только после подтверждения всех, кому должны, включая посредников
+import settlement
+
+import database as db
+from currencies import BASE_CURRENCY
+from formatting import now_timestamp
+
+A, B, C, D = 101, 102, 103, 104
+
+
+def add_users(conn, *user_ids):
+    for user_id in user_ids:
+        db.upsert_user(conn, user_id, f'@user{user_id}', 'Имя', None, now_timestamp())
+
+
+def add_debt(conn, debtor, creditor, amount):
+    db.add_debt(conn, debtor, f'@user{debtor}', creditor, f'@user{creditor}',
+                amount, 'обед', now_timestamp())
+
+
+def open_debts(conn):
+    return sorted(conn.execute(
+        'SELECT from_user_id, to_user_id, amount FROM debts WHERE is_paid = 0'
+    ).fetchall())
+
+
+def offer(conn, circle_of=None, group=None):
+    # Как /settle и кнопка «Предложить взаимозачёт»
+    balances, max_id = db.debt_balances(conn, circle_of, group)
+    plan = settlement.transfers(balances)
+    return db.create_settlement(
+        conn, circle_of, group, BASE_CURRENCY, max_id, plan, now_timestamp()
+    ), plan
+
+
+def test_chain_closes_after_every_creditor_confirms(pool):
+    with pool.writer() as conn:
+        add_users(conn, A, B, C)
+        add_debt(conn, A, B, 10000)
+        add_debt(conn, B, C, 10000)
+        (settlement_id, confirmers), plan = offer(conn, circle_of=A)
+    # Платит только A, но закрывается и долг посредника B перед C
+    assert plan == [(A, C, 10000)]
+    assert confirmers == [B, C]
+
+    now = now_timestamp()
+    with pool.writer() as conn:
+        # Должник подтвердить не может
+        assert db.confirm_settlement(conn, settlement_id, A, now) is None
+        assert db.confirm_settlement(conn, settlement_id, C, now) == ([], 1, 0, set())
+        assert len(open_debts(conn)) == 2
+        members, waiting, closed, owners = db.confirm_settlement(conn, settlement_id, B, now)
+        assert (sorted(members), waiting, closed, owners) == ([A, B, C], 0, 2, {A, B})
+        assert open_debts(conn) == []
+        assert db.check_monthly_totals(conn) == []
+        # Завершённый взаимозачёт больше не подтверждается
+        assert db.confirm_settlement(conn, settlement_id, B, now) is None
+
+
+def test_group_closes_only_debts_between_members(pool):
+    with pool.writer() as conn:
+        add_users(conn, A, B, C)
+        add_debt(conn, A, B, 5000)
+        add_debt(conn, B, A, 2000)
+        add_debt(conn, B, C, 7000)
+        (settlement_id, confirmers), plan = offer(conn, group=[A, B])
+        assert plan == [(A, B, 3000)]
+        assert confirmers == [A, B]
+        for confirmer in confirmers:
+            result = db.confirm_settlement(conn, settlement_id, confirmer, now_timestamp())
+        assert result[2] == 2
+        assert open_debts(conn) == [(B, C, 7000)]
+
+
+def test_new_debts_stay_open(pool):
+    with pool.writer() as conn:
+        add_users(conn, A, B)
+        add_debt(conn, A, B, 5000)
+        (settlement_id, _), _ = offer(conn, circle_of=A)
+        add_debt(conn, A, B, 1000)
+        assert db.confirm_settlement(conn, settlement_id, B, now_timestamp())[2] == 1
+        assert open_debts(conn) == [(A, B, 1000)]
+
+
+def test_changed_debts_cancel_settlement(pool):
+    with pool.writer() as conn:
+        add_users(conn, A, B, C, D)
+        add_debt(conn, A, B, 5000)
+        add_debt(conn, C, D, 4000)
+        balances, max_id = db.debt_balances(conn, circle_of=A)
+        plan = settlement.transfers(balances)
+        # План, показанный до удаления долга, не принимается
+        debt_id = conn.execute('SELECT MAX(id) FROM debts WHERE from_user_id = ?', (A,)).fetchone()[0]
+        db.delete_record(conn, 'debt', debt_id, A)
+        assert db.create_settlement(
+            conn, A, None, BASE_CURRENCY, max_id, plan, now_timestamp()
+        ) is None
+
+        # Долг удалён после предложения: взаимозачёт отменяется целиком
+        (settlement_id, confirmers), _ = offer(conn, circle_of=C)
+        debt_id = conn.execute('SELECT MAX(id) FROM debts WHERE from_user_id = ?', (C,)).fetchone()[0]
+        db.delete_record(conn, 'debt', debt_id, C)
+        add_debt(conn, C, D, 4000)
+        assert db.confirm_settlement(conn, settlement_id, D, now_timestamp()) == ([C, D], 0, None, set())
+        assert open_debts(conn) == [(C, D, 4000)]
+        assert db.confirm_settlement(conn, settlement_id, D, now_timestamp()) is None
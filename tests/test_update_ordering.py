@@ -0,0 +1,160 @@
+# PerUserUpdateProcessor: обновления одного пользователя выполняются по
+# одному в порядке поступления, разных пользователей — параллельно в
+# пределах concurrency; _tails очищается и после ошибок и отмен
+import asyncio
+import random
+from collections import defaultdict
+from types import SimpleNamespace
+
+import pytest
+from telegram import Update
+from telegram.ext import Application, TypeHandler
+
+from benchmarks.webhook_latency import FakeTelegram, make_update
+from scheduler import PerUserUpdateProcessor
+
+
+def update_from(user_id):
+    return SimpleNamespace(effective_user=SimpleNamespace(id=user_id))
+
+
+class Recorder:
+    # Порядок начала обработки по пользователям и одновременность
+
+    def __init__(self):
+        self.order = defaultdict(list)
+        self.active = set()
+        self.max_active = 0
+        self.overlaps = 0
+
+    async def handle(self, user_id, number, delay):
+        if user_id in self.active:
+            self.overlaps += 1
+        self.active.add(user_id)
+        self.max_active = max(self.max_active, len(self.active))
+        self.order[user_id].append(number)
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            self.active.discard(user_id)
+
+
+def test_application_keeps_per_user_order():
+    # Через Application, как в боте: обновления вперемешку от многих
+    # пользователей, первые — долгие у одного пользователя
+    rng = random.Random(1)
+    recorder = Recorder()
+    updates, sent = [], defaultdict(list)
+    for update_id in range(1, 1001):
+        user_id = 0 if update_id <= 3 else rng.randrange(50)
+        updates.append(make_update(update_id, user_id))
+        sent[user_id].append(update_id)
+
+    async def handle(update, context):
+        delay = 0.2 if update.update_id <= 3 else rng.uniform(0, 0.003)
+        await recorder.handle(update.effective_user.id, update.update_id, delay)
+
+    async def main():
+        application = (
+            Application.builder().token('1:test').request(FakeTelegram(0)).updater(None)
+            .concurrent_updates(PerUserUpdateProcessor(concurrency=8)).build()
+        )
+        application.add_handler(TypeHandler(Update, handle))
+        async with application:
+            await application.start()
+            for update in updates:
+                await application.update_queue.put(Update.de_json(update, application.bot))
+            await application.update_queue.join()
+            await application.stop()
+        return application.update_processor
+
+    processor = asyncio.run(main())
+    assert recorder.overlaps == 0
+    assert dict(recorder.order) == dict(sent)
+    assert 1 < recorder.max_active <= 8
+    assert not processor._tails
+
+
+def test_slow_user_does_not_block_others():
+    recorder = Recorder()
+    finished = []
+
+    async def main():
+        processor = PerUserUpdateProcessor(concurrency=4)
+
+        async def run(user_id, number, delay):
+            await processor.process_update(
+                update_from(user_id), recorder.handle(user_id, number, delay)
+            )
+            finished.append((user_id, number))
+
+        tasks = [asyncio.create_task(run(1, 1, 0.2)), asyncio.create_task(run(1, 2, 0))]
+        tasks += [asyncio.create_task(run(user_id, 1, 0.01)) for user_id in range(2, 6)]
+        await asyncio.gather(*tasks)
+        return processor
+
+    processor = asyncio.run(main())
+    assert finished.index((1, 2)) == len(finished) - 1
+    assert all(finished.index((user_id, 1)) < finished.index((1, 1)) for user_id in range(2, 6))
+    assert recorder.order[1] == [1, 2]
+    assert not processor._tails
+
+
+def test_tails_cleared_after_exception():
+    order = []
+
+    async def failing():
+        order.append('ошибка')
+        raise RuntimeError('обработчик упал')
+
+    async def ok(name):
+        order.append(name)
+
+    async def main():
+        processor = PerUserUpdateProcessor(concurrency=2)
+        first = asyncio.create_task(processor.process_update(update_from(1), failing()))
+        second = asyncio.create_task(processor.process_update(update_from(1), ok('после')))
+        results = await asyncio.gather(first, second, return_exceptions=True)
+        return processor, results
+
+    processor, results = asyncio.run(main())
+    assert isinstance(results[0], RuntimeError)
+    assert order == ['ошибка', 'после']
+    assert not processor._tails
+
+
+def test_tails_cleared_after_cancellation():
+    recorder = Recorder()
+
+    async def main():
+        processor = PerUserUpdateProcessor(concurrency=2)
+
+        def start(number, delay):
+            return asyncio.create_task(processor.process_update(
+                update_from(1), recorder.handle(1, number, delay)
+            ))
+
+        first, waiting, third = start(1, 0.1), start(2, 0), start(3, 0)
+        await asyncio.sleep(0.01)
+        # Отмена обновления, которое ждёт своей очереди, не пропускает
+        # следующее вперёд незавершённого первого
+        waiting.cancel()
+        await asyncio.sleep(0.01)
+        assert recorder.order[1] == [1]
+        await first
+        await third
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+
+        # Отмена выполняющегося обработчика
+        running = start(4, 10)
+        await asyncio.sleep(0.01)
+        running.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await running
+        return processor
+
+    processor = asyncio.run(main())
+    assert recorder.order[1] == [1, 3, 4]
+    assert recorder.overlaps == 0
+    assert not processor._tails
@@ -0,0 +1,106 @@
+# HTTP-сервер webhook: слишком длинные строки и медленные клиенты получают
+# ответ и закрытое соединение, а не необработанную ошибку задачи
+import asyncio
+import json
+
+from telegram.ext import Application
+
+from webhook import WebhookServer
+
+SECRET = 'test-secret'
+
+
+def serve(scenario, **options):
+    # Запускает сервер на свободном порту и выполняет scenario(server);
+    # возвращает результат сценария и ошибки, дошедшие до цикла событий
+    async def main():
+        errors = []
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context))
+        application = Application.builder().token('1:test').updater(None).build()
+        server = WebhookServer(application, host='127.0.0.1', port=0, secret_token=SECRET, **options)
+        await server.start()
+        try:
+            result = await scenario(server)
+        finally:
+            await server.stop()
+        return result, errors
+    return asyncio.run(main())
+
+
+async def exchange(server, data, wait=5):
+    # Отправляет data и читает всё до закрытия соединения сервером
+    reader, writer = await asyncio.open_connection('127.0.0.1', server.port)
+    writer.write(data)
+    await writer.drain()
+    try:
+        return await asyncio.wait_for(reader.read(), wait)
+    finally:
+        writer.close()
+
+
+def post(body, **headers):
+    headers = {'X-Telegram-Bot-Api-Secret-Token': SECRET, 'Connection': 'close', **headers}
+    head = ''.join(f'{name}: {value}\r\n' for name, value in headers.items())
+    return (f'POST /telegram HTTP/1.1\r\nContent-Length: {len(body)}\r\n{head}\r\n').encode() + body
+
+
+def test_update_is_queued():
+    update = {'update_id': 1, 'message': {
+        'message_id': 1, 'date': 0, 'chat': {'id': 5, 'type': 'private'}, 'text': 'привет',
+    }}
+
+    async def scenario(server):
+        response = await exchange(server, post(json.dumps(update).encode()))
+        return response, server.application.update_queue.get_nowait()
+
+    (response, queued), errors = serve(scenario)
+    assert response.startswith(b'HTTP/1.1 200 ')
+    assert queued.message.text == 'привет'
+    assert not errors
+
+
+def test_long_header_line_gets_400():
+    async def scenario(server):
+        return await exchange(server, post(b'{}', **{'X-Long': 'a' * 100_000}))
+
+    response, errors = serve(scenario)
+    assert response.startswith(b'HTTP/1.1 400 ')
+    assert not errors
+
+
+def test_long_request_line_gets_400():
+    async def scenario(server):
+        return await exchange(server, b'GET /' + b'a' * 100_000 + b' HTTP/1.1\r\n\r\n')
+
+    response, errors = serve(scenario)
+    assert response.startswith(b'HTTP/1.1 400 ')
+    assert not errors
+
+
+def test_too_many_headers_get_400():
+    async def scenario(server):
+        headers = {f'X-Header-{i}': 'x' for i in range(200)}
+        return await exchange(server, post(b'{}', **headers))
+
+    response, errors = serve(scenario)
+    assert response.startswith(b'HTTP/1.1 400 ')
+    assert not errors
+
+
+def test_slow_request_gets_408():
+    async def scenario(server):
+        # Заголовки пришли, тело — нет
+        return await exchange(server, post(b'{}')[:-2])
+
+    response, errors = serve(scenario, read_timeout=0.2)
+    assert response.startswith(b'HTTP/1.1 408 ')
+    assert not errors
+
+
+def test_idle_connection_is_closed():
+    async def scenario(server):
+        return await exchange(server, b'')
+
+    response, errors = serve(scenario, idle_timeout=0.2)
+    assert response == b''
+    assert not errors
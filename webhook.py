@@ -0,0 +1,275 @@
+import asyncio
+import hmac
+import json
+import logging
+import signal
+import ssl
+
+from telegram import Update
+from telegram.ext import Application
+
+import metrics
+from config import (
+    METRICS_PATH, METRICS_TOKEN, WEBHOOK_CERT, WEBHOOK_IDLE_TIMEOUT, WEBHOOK_KEY,
+    WEBHOOK_LISTEN, WEBHOOK_MAX_BODY, WEBHOOK_MAX_CONNECTIONS, WEBHOOK_PATH, WEBHOOK_PORT,
+    WEBHOOK_READ_TIMEOUT, WEBHOOK_SECRET, WEBHOOK_URL
+)
+
+logger = logging.getLogger(__name__)
+
+REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    401: 'Unauthorized',
+    403: 'Forbidden',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    408: 'Request Timeout',
+    413: 'Payload Too Large',
+    503: 'Service Unavailable',
+}
+# Строк заголовков в одном запросе, больше — ответ 400
+MAX_HEADERS = 100
+
+
+class WebhookServer:
+    # Минимальный HTTP/1.1-сервер на asyncio для приёма обновлений от Telegram
+    # (или от балансировщика перед несколькими экземплярами бота).
+    # Обновление кладётся в application.update_queue без ожидания: если
+    # очередь ограничена и заполнена, отвечаем 503 и Telegram повторит
+    # доставку позже. Соединения keep-alive, Telegram держит их открытыми;
+    # простаивающее дольше idle_timeout закрывается. Запрос, не дочитанный
+    # за read_timeout, получает 408, слишком длинная строка запроса или
+    # заголовка — 400.
+    # При включённых метриках GET metrics_path отдаёт их в формате Prometheus;
+    # с path=None сервер обслуживает только метрики (режим polling).
+
+    def __init__(self, application: Application, host=WEBHOOK_LISTEN,
+                 port=WEBHOOK_PORT, path=WEBHOOK_PATH, secret_token=WEBHOOK_SECRET,
+                 max_body=WEBHOOK_MAX_BODY, ssl_context=None,
+                 metrics_path=METRICS_PATH, metrics_token=METRICS_TOKEN,
+                 read_timeout=WEBHOOK_READ_TIMEOUT, idle_timeout=WEBHOOK_IDLE_TIMEOUT):
+        self.application = application
+        self.host = host
+        self.port = port
+        self.path = path
+        self.metrics_path = metrics_path if metrics.enabled else None
+        self.metrics_token = metrics_token.encode() if metrics_token else None
+        self.secret_token = secret_token.encode() if secret_token else None
+        self.max_body = max_body
+        self.ssl_context = ssl_context
+        self.read_timeout = read_timeout
+        self.idle_timeout = idle_timeout
+        self.rejected = 0
+        self._server = None
+        self._closing = False
+        # Задача соединения -> ждёт ли оно следующий запрос (простаивает)
+        self._connections = {}
+        if self.metrics_path is not None and path is not None:
+            metrics.registry.collect(
+                'finance_webhook_rejected_total', 'Обновления, отклонённые из-за полной очереди',
+                'counter', lambda: self.rejected
+            )
+
+    async def start(self):
+        self._server = await asyncio.start_server(
+            self._serve_connection, self.host, self.port, ssl=self.ssl_context
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info("HTTP-сервер слушает %s:%d (обновления: %s, метрики: %s)",
+                    self.host, self.port, self.path, self.metrics_path)
+
+    @property
+    def started(self):
+        return self._server is not None and not self._closing
+
+    async def stop(self):
+        # Перестаём принимать соединения, закрываем простаивающие и ждём
+        # ответа на запросы, которые уже читаются
+        self._closing = True
+        self._server.close()
+        for task, idle in list(self._connections.items()):
+            if idle:
+                task.cancel()
+        if self._connections:
+            await asyncio.gather(*self._connections, return_exceptions=True)
+        await self._server.wait_closed()
+
+    async def _serve_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections[task] = True
+        try:
+            while not self._closing:
+                self._connections[task] = True
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    break
+                except (ValueError, asyncio.LimitOverrunError):
+                    # Строка запроса длиннее лимита StreamReader
+                    await self._respond(writer, 400, False)
+                    break
+                if not request_line:
+                    break
+                self._connections[task] = False
+                keep_alive = await self._handle_request(request_line, reader, writer)
+                if not keep_alive:
+                    break
+        except (asyncio.CancelledError, asyncio.IncompleteReadError, asyncio.TimeoutError,
+                ConnectionError):
+            pass
+        finally:
+            del self._connections[task]
+            writer.close()
+
+    async def _handle_request(self, request_line, reader, writer):
+        try:
+            method, target, version, headers, body = await asyncio.wait_for(
+                self._read_request(request_line, reader), self.read_timeout
+            )
+        except asyncio.TimeoutError:
+            await self._respond(writer, 408, False)
+            return False
+        except (ValueError, asyncio.LimitOverrunError):
+            await self._respond(writer, 400, False)
+            return False
+        if body is None:
+            await self._respond(writer, 413, False)
+            return False
+
+        keep_alive = (
+            version == 'HTTP/1.1'
+            and headers.get('connection', '').lower() != 'close'
+            and not self._closing
+        )
+        route = target.split('?', 1)[0]
+        if self.metrics_path is not None and route == self.metrics_path:
+            status, payload = self._metrics(method, headers)
+            await self._respond(writer, status, keep_alive, payload)
+            return keep_alive
+        status = self._dispatch(method, route, headers, body)
+        await self._respond(writer, status, keep_alive)
+        return keep_alive
+
+    async def _read_request(self, request_line, reader):
+        # (method, target, version, headers, body), body None — тело больше
+        # max_body. ValueError: запрос не разобран или строка длиннее лимита
+        # StreamReader
+        method, target, version = request_line.decode('latin-1').split()
+        headers = {}
+        for _ in range(MAX_HEADERS + 1):
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        else:
+            raise ValueError('слишком много заголовков')
+
+        length = int(headers.get('content-length', '0'))
+        if length < 0:
+            raise ValueError(f'Content-Length: {length}')
+        if length > self.max_body:
+            return method, target, version, headers, None
+        return method, target, version, headers, await reader.readexactly(length)
+
+    def _metrics(self, method, headers):
+        if method != 'GET':
+            return 405, b''
+        if self.metrics_token is not None:
+            token = headers.get('authorization', '').encode('latin-1')
+            if not hmac.compare_digest(token, b'Bearer ' + self.metrics_token):
+                return 401, b''
+        return 200, metrics.registry.render().encode('utf-8')
+
+    def _dispatch(self, method, route, headers, body):
+        if self.path is None or route != self.path:
+            return 404
+        if method != 'POST':
+            return 405
+        if self.secret_token is not None:
+            token = headers.get('x-telegram-bot-api-secret-token', '').encode('latin-1')
+            if not hmac.compare_digest(token, self.secret_token):
+                logger.warning("Webhook: запрос с неверным секретным токеном")
+                return 403
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except (ValueError, TypeError, KeyError):
+            return 400
+        if update is None:
+            return 400
+        try:
+            self.application.update_queue.put_nowait(update)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return 503
+        return 200
+
+    async def _respond(self, writer, status, keep_alive, payload=b''):
+        head = [
+            f'HTTP/1.1 {status} {REASONS[status]}',
+            f'Content-Length: {len(payload)}',
+            'Connection: ' + ('keep-alive' if keep_alive else 'close'),
+        ]
+        if payload:
+            head.append('Content-Type: text/plain; version=0.0.4; charset=utf-8')
+        if status == 503:
+            head.append('Retry-After: 1')
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + payload)
+        # Клиент, который не читает ответ, не держит соединение дольше read_timeout
+        await asyncio.wait_for(writer.drain(), self.read_timeout)
+
+
+def ssl_context_from_config():
+    # TLS обычно завершается на балансировщике или обратном прокси;
+    # сертификат нужен, только если Telegram стучится в бота напрямую
+    if not WEBHOOK_CERT:
+        return None
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(WEBHOOK_CERT, WEBHOOK_KEY or None)
+    return context
+
+
+async def run_webhook(application: Application, allowed_updates=None,
+                      drop_pending_updates=False):
+    # Аналог application.run_webhook() на своём сервере: те же хуки
+    # post_init/post_stop/post_shutdown, остановка по SIGINT/SIGTERM.
+    # При остановке сначала закрывается сервер, затем application.stop()
+    # обрабатывает всё, что уже принято в очередь.
+    if not WEBHOOK_URL:
+        raise ValueError("Не задан WEBHOOK_URL для режима webhook")
+    if not WEBHOOK_SECRET:
+        raise ValueError("Не задан WEBHOOK_SECRET для режима webhook")
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    server = WebhookServer(application, ssl_context=ssl_context_from_config())
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        await server.start()
+        await application.bot.set_webhook(
+            url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=allowed_updates,
+            drop_pending_updates=drop_pending_updates
+        )
+        logger.info("Бот работает в режиме webhook")
+        await stop_event.wait()
+        logger.info("Остановка: дожидаемся обработки принятых обновлений")
+    finally:
+        if server.started:
+            await server.stop()
+        if application.running:
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)